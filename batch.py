@@ -0,0 +1,184 @@
+"""命令行批量生成提示词
+
+用法示例：
+    python -m batch -t 最新全身 -n 500 -o 最新全身.jsonl
+    python -m batch --all-presets -n 100 -o out.txt --library 模版.xlsx
+    python -m batch -t 最新全身 -n 500 -o out.jsonl --library 春季.xlsx 夏季.xlsx
+    python -m batch --all-presets -n 100000 --workers 8 --seed 42 -o catalog.jsonl
+    python -m batch -t 最新全身 --exhaustive -o 全组合.jsonl
+
+写入文件时会同时生成 <输出文件>.meta.json，记录随机种子、模板内容与变量库指纹；
+之后用相同的种子、模板和变量库（以及相同的已用记录）即可逐字节重新生成，无需保存全部结果。
+"""
+import argparse
+import json
+import os
+import sys
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, TextIO, Tuple
+
+from core import PromptGenerator
+from persistence import write_json_atomic
+
+TXT_SEPARATOR = "\n\n-----\n\n"
+
+
+def _selected_values(generator: PromptGenerator, template: str) -> Optional[Dict[str, str]]:
+    """与 GUI 一致：自定义参数中出现在模板里的字段作为固定值"""
+    markers = set(generator.extract_markers(template))
+    custom_map = generator.custom_params_map or {}
+    sel = {k: v for k, v in custom_map.items() if k in markers}
+    return sel or None
+
+
+def _iter_results(generator: PromptGenerator, names: List[str], count: Optional[int], mark_used: bool, workers: Optional[int], seed: Optional[int]) -> Iterator[Tuple[str, str, List[Dict[str, Any]]]]:
+    selected: Dict[str, Dict[str, str]] = {}
+    jobs: List[Tuple[str, int]] = []
+    for name in names:
+        template = generator.get_template_by_name(name)
+        if template is None:
+            raise ValueError(f"模板预设不存在: {name}")
+        sel = _selected_values(generator, template)
+        if sel:
+            selected[name] = sel
+        # 穷举模式未指定条数时生成全部组合（批量生成到最后一个组合即停止）
+        jobs.append((name, count if count is not None else generator.count_combinations(template, sel)))
+    if workers:
+        yield from generator.iter_batch_parallel(jobs, workers, seed, selected, mark_used=mark_used)
+        return
+    for name, n in jobs:
+        for text, spans in generator.iter_batch(name, n, selected.get(name), mark_used=mark_used):
+            yield name, text, spans
+
+
+def _check_capacity(generator: PromptGenerator, names: List[str], count: Optional[int], shared: bool = True) -> Optional[str]:
+    """生成前检查用完即删字段的剩余取值是否够用，不够时返回错误信息
+    shared 为 True（记为已用或并行生成）时各预设共用剩余值，按字段累加所有预设的需求量；
+    否则各预设分别在剩余值的副本上抽取，只需满足需求最大的那个预设
+    """
+    if count is None:
+        return None
+    demand: Dict[str, int] = {}
+    users: Dict[str, List[str]] = {}
+    for name in names:
+        template = generator.get_template_by_name(name)
+        if template is None:
+            continue
+        for field, k in generator.draw_demand(template, _selected_values(generator, template)).items():
+            need = k * count
+            demand[field] = demand.get(field, 0) + need if shared else max(demand.get(field, 0), need)
+            users.setdefault(field, []).append(name)
+    for field, need in demand.items():
+        available = generator.available_values(field)
+        if available < need:
+            return f"字段 {field} 剩 {available} 个可用值，模板 {'、'.join(users[field])} 各生成 {count} 条需要 {need} 个；请清除已用记录或添加新变量值"
+    return None
+
+
+def _write_results(generator: PromptGenerator, names: List[str], count: Optional[int], fmt: str, out: TextIO, mark_used: bool, workers: Optional[int] = None, seed: Optional[int] = None) -> int:
+    written = 0
+    indices: Dict[str, int] = {}
+    for name, text, spans in _iter_results(generator, names, count, mark_used, workers, seed):
+        i = indices.get(name, 0)
+        indices[name] = i + 1
+        if fmt == "jsonl":
+            record = {"template": name, "index": i, "text": text, "spans": spans}
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        else:
+            if written:
+                out.write(TXT_SEPARATOR)
+            out.write(text)
+        written += 1
+    if fmt == "txt" and written:
+        out.write("\n")
+    return written
+
+
+def _metadata(generator: PromptGenerator, names: List[str], args: argparse.Namespace, seed: int) -> Dict[str, Any]:
+    return {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "seed": seed,
+        "count": args.count,
+        "written": 0,
+        "workers": args.workers,
+        "matching_mode": generator.matching_mode,
+        "start": args.start if args.exhaustive else None,
+        "mark_used": not args.no_mark_used,
+        "templates": {name: generator.get_template_by_name(name) for name in names},
+        "template_versions": {name: len(generator.template_versions(name)) for name in names},
+        "library": {"paths": generator.library_sources, "merge_mode": generator.library_merge_mode, "fingerprint": generator.library_fingerprint()},
+        "delete_on_use_fields": list(generator.delete_on_use_fields),
+        "used_counts_before": {f: len(generator.used_values.get(f, [])) for f in generator.delete_on_use_fields},
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m batch", description="批量生成提示词并输出为 JSONL 或 TXT")
+    parser.add_argument("-t", "--template", action="append", default=[], help="模板预设名称，可重复指定")
+    parser.add_argument("--all-presets", action="store_true", help="为所有模板预设生成")
+    parser.add_argument("-n", "--count", type=int, help="每个预设生成的条数（默认 1；穷举模式默认全部组合）")
+    parser.add_argument("-o", "--output", help="输出文件路径，省略时写到标准输出")
+    parser.add_argument("-f", "--format", choices=["jsonl", "txt"], help="输出格式，默认按输出文件扩展名判断")
+    parser.add_argument("--library", nargs="+", help="变量库 Excel 路径（可多个，全部工作表合并），默认使用上次加载的变量库")
+    parser.add_argument("--no-mark-used", action="store_true", help="不把生成的值记为已用（用完即删字段）")
+    parser.add_argument("-j", "--workers", type=int, help="使用多进程并行生成的进程数（大批量时使用）")
+    parser.add_argument("--exhaustive", action="store_true", help="穷举模式：按序遍历模板字段取值的全部组合（不记为已用）")
+    parser.add_argument("--start", type=int, default=0, help="穷举模式下从第几个组合开始（从 0 计）")
+    parser.add_argument("--seed", type=int, help="随机种子，省略时随机生成；相同种子、模板与变量库可复现结果")
+    args = parser.parse_args(argv)
+
+    generator = PromptGenerator()
+    if args.library:
+        ok, message = generator.load_library_sources(args.library)
+        if not ok:
+            print(message, file=sys.stderr)
+            return 1
+    if not generator.value_library:
+        print("变量库为空，请通过 --library 指定 Excel 文件", file=sys.stderr)
+        return 1
+
+    names = generator.list_template_names() if args.all_presets else args.template
+    if not names:
+        names = [generator.get_current_preset_name() or generator.get_last_preset(1)]
+
+    if args.exhaustive:
+        # 只对本次运行生效，不写回设置
+        generator.matching_mode = "exhaustive"
+        for name in names:
+            template = generator.get_template_by_name(name)
+            if template is not None:
+                generator.combination_indices[template] = args.start
+    elif args.count is None:
+        args.count = 1
+
+    fmt = args.format
+    if not fmt:
+        fmt = "txt" if args.output and os.path.splitext(args.output)[1].lower() == ".txt" else "jsonl"
+
+    problem = _check_capacity(generator, names, args.count, not args.no_mark_used or bool(args.workers))
+    if problem:
+        print(problem, file=sys.stderr)
+        return 1
+
+    seed = generator.set_seed(args.seed)
+    print(f"随机种子: {seed}", file=sys.stderr)
+    meta = _metadata(generator, names, args, seed)
+    try:
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as out:
+                written = _write_results(generator, names, args.count, fmt, out, not args.no_mark_used, args.workers, seed)
+            meta["written"] = written
+            write_json_atomic(args.output + ".meta.json", meta)
+        else:
+            written = _write_results(generator, names, args.count, fmt, sys.stdout, not args.no_mark_used, args.workers, seed)
+    except ValueError as e:
+        print(f"生成失败: {e}", file=sys.stderr)
+        return 1
+    finally:
+        generator.flush()
+    print(f"已生成 {written} 条提示词", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,259 @@
+"""PromptGenerator 热点路径基准测试
+
+用合成的变量库（每字段 10 ~ 1,000,000 个值）和模板（1 ~ 200 个占位符）测量：
+generate_prompt_with_spans、generate_preview_with_spans、extract_markers、
+load_action_library_from_file、mark_used_from_spans、save_used_values，
+输出吞吐量、p50/p99 延迟与峰值内存，结果写入 JSON 便于跨提交对比。
+
+用法示例：
+    python -m benchmark -o bench.json
+    python -m benchmark --sizes 10,1000 --markers 1,10 -o quick.json
+    python -m benchmark -o new.json --compare old.json
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from core import PromptGenerator
+
+DEFAULT_SIZES = "10,1000,100000,1000000"
+DEFAULT_MARKERS = "1,10,200"
+
+
+def _parse_ints(text: str) -> List[int]:
+    return [int(x) for x in text.split(",") if x.strip()]
+
+
+def _library(size: int, fields: int) -> Dict[str, List[str]]:
+    return {f"字段{f}": [f"字段{f}-取值{i}-背景描述" for i in range(size)] for f in range(fields)}
+
+
+def _template(markers: int, fields: int) -> str:
+    return "".join(f"第{i}段说明文字，{{字段{i % fields}}}；" for i in range(markers))
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[idx]
+
+
+def _measure(func: Callable[[], Any], min_time: float, max_iterations: int, min_iterations: int = 5) -> List[float]:
+    """重复执行 func 直到累计 min_time 秒或达到 max_iterations 次，返回每次耗时（秒）"""
+    latencies: List[float] = []
+    start = time.perf_counter()
+    while len(latencies) < max_iterations:
+        t0 = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - t0)
+        if len(latencies) >= min_iterations and time.perf_counter() - start >= min_time:
+            break
+    return latencies
+
+
+def _peak_memory(func: Callable[[], Any], iterations: int) -> int:
+    """单独一轮带 tracemalloc 的执行，返回期间的峰值内存（字节）；不计入延迟统计"""
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        for _ in range(iterations):
+            func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return max(0, peak - base)
+
+
+def _result(name: str, params: Dict[str, Any], latencies: List[float], peak: int) -> Dict[str, Any]:
+    ordered = sorted(latencies)
+    total = sum(latencies)
+    return {
+        "name": name,
+        "params": params,
+        "iterations": len(latencies),
+        "throughput_per_s": len(latencies) / total if total > 0 else 0.0,
+        "p50_ms": _percentile(ordered, 0.50) * 1000,
+        "p99_ms": _percentile(ordered, 0.99) * 1000,
+        "peak_memory_kib": peak / 1024,
+    }
+
+
+def _case_key(result: Dict[str, Any]) -> str:
+    params = ",".join(f"{k}={v}" for k, v in sorted(result["params"].items()))
+    return f"{result['name']}[{params}]"
+
+
+class BenchmarkRunner:
+    def __init__(self, work_dir: str, min_time: float, max_iterations: int, fields: int, seed: int = 0) -> None:
+        self.work_dir = work_dir
+        self.min_time = min_time
+        self.max_iterations = max_iterations
+        self.fields = fields
+        self.seed = seed
+        self.results: List[Dict[str, Any]] = []
+
+    def _generator(self, size: int, delete_on_use: bool = False) -> PromptGenerator:
+        data_dir = tempfile.mkdtemp(prefix="gen-", dir=self.work_dir)
+        gen = PromptGenerator(load_library=False, data_dir=data_dir)
+        gen.used_values = {}
+        gen.set_value_library(_library(size, self.fields))
+        gen.delete_on_use_fields = ["字段0"] if delete_on_use else []
+        gen.matching_mode = "random"
+        gen.set_seed(self.seed)
+        return gen
+
+    def _run(self, name: str, params: Dict[str, Any], func: Callable[[], Any], max_iterations: Optional[int] = None) -> None:
+        limit = max_iterations or self.max_iterations
+        latencies = _measure(func, self.min_time, limit)
+        peak = _peak_memory(func, min(len(latencies), 20))
+        result = _result(name, params, latencies, peak)
+        self.results.append(result)
+        print(f"{_case_key(result):<70} p50 {result['p50_ms']:9.3f} ms  p99 {result['p99_ms']:9.3f} ms  {result['throughput_per_s']:10.1f}/s", file=sys.stderr)
+
+    def bench_generation(self, sizes: List[int], markers: List[int]) -> None:
+        for size in sizes:
+            for delete_on_use in (False, True):
+                gen = self._generator(size, delete_on_use)
+                for m in markers:
+                    template = _template(m, self.fields)
+                    params = {"values": size, "markers": m, "delete_on_use": delete_on_use}
+                    self._run("generate_prompt_with_spans", params, lambda: gen.generate_prompt_with_spans("", template_str=template))
+                    if not delete_on_use:
+                        self._run("generate_preview_with_spans", params, lambda: gen.generate_preview_with_spans("", template_str=template))
+                gen.flush()
+
+    def bench_extract_markers(self, markers: List[int]) -> None:
+        gen = self._generator(10)
+        for m in markers:
+            template = _template(m, self.fields)
+            self._run("extract_markers", {"markers": m, "cache": "warm"}, lambda: gen.extract_markers(template))
+
+            def cold() -> None:
+                gen.invalidate_compiled_template(template)
+                gen.extract_markers(template)
+            self._run("extract_markers", {"markers": m, "cache": "cold"}, cold)
+
+    def bench_mark_used(self, sizes: List[int]) -> None:
+        for size in sizes:
+            gen = self._generator(size, delete_on_use=True)
+            template = _template(1, 1)
+            count = min(size, self.max_iterations)
+            gen.set_template(template)
+            # 预先生成互不重复的提示词；计时轮次用完后（峰值内存轮）循环复用
+            it = itertools.cycle(gen.generate_batch(None, count, mark_used=False))
+
+            def mark() -> None:
+                text, spans = next(it)
+                gen.mark_used_from_spans(text, spans)
+            self._run("mark_used_from_spans", {"values": size}, mark, max_iterations=count)
+            gen.flush()
+
+    def bench_save_used_values(self, sizes: List[int]) -> None:
+        for size in sizes:
+            gen = self._generator(min(size, 10))
+            gen.used_values = {"字段0": [f"字段0-已用取值{i}-背景描述" for i in range(size)]}
+            self._run("save_used_values", {"used": size}, gen.save_used_values, max_iterations=max(5, min(self.max_iterations, 50)))
+
+    def bench_load_library(self, sizes: List[int], max_rows: int) -> None:
+        try:
+            from openpyxl import Workbook
+        except ImportError:
+            print("未安装 openpyxl，跳过 load_action_library_from_file", file=sys.stderr)
+            return
+        for size in sizes:
+            if size > max_rows:
+                continue
+            path = os.path.join(self.work_dir, f"library_{size}.xlsx")
+            wb = Workbook(write_only=True)
+            ws = wb.create_sheet()
+            ws.append([f"字段{f}" for f in range(self.fields)])
+            for i in range(size):
+                ws.append([f"字段{f}-取值{i}-背景描述" for f in range(self.fields)])
+            wb.save(path)
+            gen = self._generator(10)
+            iterations = max(3, min(self.max_iterations, 20))
+            self._run("load_action_library_from_file", {"rows": size, "cache": "cold"}, lambda: gen.load_action_library_from_file(path, use_cache=False), max_iterations=iterations)
+
+            def warm() -> None:
+                gen.load_default_actions()
+                gen.load_action_library_from_file(path)
+            self._run("load_action_library_from_file", {"rows": size, "cache": "warm"}, warm, max_iterations=iterations)
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, timeout=5)
+        return out.stdout.strip() or None
+    except Exception:
+        return None
+
+
+def compare(results: List[Dict[str, Any]], baseline_path: str) -> None:
+    """与之前保存的结果对比 p50（>1 表示变慢）"""
+    with open(baseline_path, "r", encoding="utf-8") as fp:
+        baseline = {_case_key(r): r for r in json.load(fp).get("results", [])}
+    print(f"\n与 {baseline_path} 对比（p50 新/旧）:", file=sys.stderr)
+    for r in results:
+        old = baseline.get(_case_key(r))
+        if old and old.get("p50_ms"):
+            ratio = r["p50_ms"] / old["p50_ms"]
+            flag = "  ← 变慢" if ratio > 1.2 else ""
+            print(f"  {_case_key(r):<70} {ratio:6.2f}x{flag}", file=sys.stderr)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmark", description="PromptGenerator 热点路径基准测试")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help=f"每字段取值数量，逗号分隔（默认 {DEFAULT_SIZES}）")
+    parser.add_argument("--markers", default=DEFAULT_MARKERS, help=f"模板占位符数量，逗号分隔（默认 {DEFAULT_MARKERS}）")
+    parser.add_argument("--fields", type=int, default=2, help="合成变量库的字段数")
+    parser.add_argument("--min-time", type=float, default=0.5, help="每个用例至少运行的秒数")
+    parser.add_argument("--max-iterations", type=int, default=2000, help="每个用例最多运行的次数")
+    parser.add_argument("--max-load-rows", type=int, default=100000, help="Excel 加载用例的最大行数（生成大文件很慢）")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("-o", "--output", default="bench_output.json", help="结果 JSON 文件路径")
+    parser.add_argument("--compare", help="与之前的结果 JSON 对比")
+    args = parser.parse_args(argv)
+
+    sizes = _parse_ints(args.sizes)
+    markers = _parse_ints(args.markers)
+    work_dir = tempfile.mkdtemp(prefix="prompt-bench-")
+    try:
+        runner = BenchmarkRunner(work_dir, args.min_time, args.max_iterations, max(1, args.fields), args.seed)
+        runner.bench_extract_markers(markers)
+        runner.bench_generation(sizes, markers)
+        runner.bench_mark_used(sizes)
+        runner.bench_save_used_values(sizes)
+        runner.bench_load_library(sizes, args.max_load_rows)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {"sizes": sizes, "markers": markers, "fields": args.fields, "seed": args.seed, "min_time": args.min_time, "max_iterations": args.max_iterations},
+        "results": runner.results,
+    }
+    with open(args.output, "w", encoding="utf-8") as fp:
+        json.dump(report, fp, ensure_ascii=False, indent=2)
+    print(f"结果已写入 {args.output}", file=sys.stderr)
+    if args.compare:
+        compare(runner.results, args.compare)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
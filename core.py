@@ -1,18 +1,508 @@
 import os
+import atexit
+import hashlib
+import pickle
 import random
 import re
 import json
+import shutil
 import sys
 import platform
+import threading
+from array import array
+from collections.abc import Sequence
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Dict, List, Tuple, Optional, Any
-import pandas as pd
+from typing import Dict, List, Tuple, Optional, Any, Set, Iterator, Iterable, Callable, Union
+
+import timing
+from persistence import WriteBehindStore, file_lock, write_json_atomic
+from template_history import TemplateHistory
+
+# 模板占位符匹配规则，如 {产品}、{动作}
+MARKER_PATTERN = re.compile(r"\{([^}]*)\}")
+
+
+class CompiledTemplate:
+    """预解析后的模板：由 (前置文本, 标记名, 原始占位符) 片段和尾部文本组成
+    同一模板只需解析一次，渲染时按片段顺序线性拼接即可
+    """
+
+    __slots__ = ("source", "segments", "tail", "markers")
+
+    def __init__(self, source: str) -> None:
+        segments: List[Tuple[str, str, str]] = []
+        idx = 0
+        for m in MARKER_PATTERN.finditer(source):
+            start, end = m.span()
+            segments.append((source[idx:start], m.group(1), m.group(0)))
+            idx = end
+        self.source: str = source
+        self.segments: List[Tuple[str, str, str]] = segments
+        self.tail: str = source[idx:]
+        # 去重后的标记名（保持首次出现顺序）
+        self.markers: List[str] = list(dict.fromkeys(seg[1] for seg in segments))
+
+
+class InternedColumn(Sequence):
+    """变量库的一列：不同取值在 table 中只存一份，各行保存为 table 下标的紧凑数组 codes（array('I')）
+    对外表现为只读的字符串序列，可像列表一样取长度、下标访问和遍历；table 即去重后的取值（保持首次出现顺序）。
+    """
+
+    __slots__ = ("table", "codes", "_index", "_digest")
+
+    def __init__(self, values: Iterable[str] = ()) -> None:
+        self.table: List[str] = []
+        self.codes = array("I")
+        self._index: Optional[Dict[str, int]] = {}
+        self._digest: Optional[str] = None
+        for value in values:
+            self.append(value)
+
+    @classmethod
+    def from_parts(cls, table: List[str], codes: "array[int]") -> "InternedColumn":
+        column = cls.__new__(cls)
+        column.table = table
+        column.codes = codes
+        column._index = None
+        column._digest = None
+        return column
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        return (InternedColumn.from_parts, (self.table, self.codes))
+
+    def append(self, value: str) -> None:
+        """仅在构建列时使用"""
+        index = self.index_map()
+        i = index.get(value)
+        if i is None:
+            i = index[value] = len(self.table)
+            self.table.append(value)
+            self._digest = None
+        self.codes.append(i)
+
+    def index_map(self) -> Dict[str, int]:
+        """取值 -> table 下标（按需构建）"""
+        if self._index is None:
+            self._index = {v: i for i, v in enumerate(self.table)}
+        return self._index
+
+    def index_of(self, value: str) -> Optional[int]:
+        return self.index_map().get(value)
+
+    def digest(self) -> str:
+        """table 内容的哈希，用于判断按下标保存的已用记录是否仍对应当前变量库"""
+        if self._digest is None:
+            h = hashlib.sha1()
+            for v in self.table:
+                h.update(v.encode("utf-8") + b"\x00")
+            self._digest = h.hexdigest()
+        return self._digest
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __getitem__(self, i: Any) -> Any:
+        if isinstance(i, slice):
+            table = self.table
+            return [table[c] for c in self.codes[i]]
+        return self.table[self.codes[i]]
+
+    def __iter__(self) -> Iterator[str]:
+        return map(self.table.__getitem__, self.codes)
+
+    def __contains__(self, value: object) -> bool:
+        return value in self.index_map()
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, InternedColumn):
+            return self.table == other.table and self.codes == other.codes
+        if isinstance(other, (list, tuple)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    __hash__ = None  # type: ignore[assignment]
+
+    def __repr__(self) -> str:
+        return f"InternedColumn({len(self.codes)} 行, {len(self.table)} 个不同取值)"
+
+
+class LibrarySource:
+    """变量库的一个来源：某个文件中一个工作表的解析结果
+    rows 与 library 中同名列的 codes 一一对应，记录每个取值所在的 Excel 行号（首行为表头，取值从第 2 行起）。
+    """
+
+    __slots__ = ("path", "sheet", "library", "weights", "rows")
+
+    def __init__(self, path: str, sheet: str, library: Dict[str, InternedColumn], weights: Dict[str, List[float]], rows: Dict[str, "array[int]"]) -> None:
+        self.path = path
+        self.sheet = sheet
+        self.library = library
+        self.weights = weights
+        self.rows = rows
+
+
+def _value_digest(value: str) -> str:
+    """单个取值的短哈希（已用记录按下标保存时用于校验和变量库变化后的重新定位）"""
+    return hashlib.sha1(value.encode("utf-8")).hexdigest()[:12]
+
+
+def _file_key(path: str) -> Optional[Tuple[int, int]]:
+    """文件的 (大小, 修改时间) ，不存在时为 None，用于判断文件是否被其他进程改写"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_size, st.st_mtime_ns)
+
+
+def _parse_weight(raw: Any) -> float:
+    """解析权重单元格：空白或无法解析时为 1，负数按 0 处理"""
+    if raw is None:
+        return 1.0
+    try:
+        weight = float(str(raw).strip())
+    except ValueError:
+        return 1.0
+    if weight != weight:
+        return 1.0
+    return max(0.0, weight)
+
+
+class AliasTable:
+    """Walker 别名表：O(n) 构建后按权重抽样为 O(1)（权重全为 0 时退化为均匀抽样）"""
+
+    __slots__ = ("values", "prob", "alias", "total")
+
+    def __init__(self, values: List[str], weights: List[float]) -> None:
+        n = len(values)
+        self.values = values
+        self.total = float(sum(weights))
+        self.prob: List[float] = [1.0] * n
+        self.alias: List[int] = list(range(n))
+        if n == 0 or self.total <= 0:
+            return
+        scaled = [w * n / self.total for w in weights]
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] -= 1.0 - scaled[s]
+            (small if scaled[l] < 1.0 else large).append(l)
+        # 剩余项因浮点误差可能略偏离 1，直接视为 1
+        for i in small + large:
+            self.prob[i] = 1.0
+
+    def sample(self, rng: random.Random) -> str:
+        i = int(rng.random() * len(self.values))
+        return self.values[i] if rng.random() < self.prob[i] else self.values[self.alias[i]]
+
+
+class RemainingPool:
+    """用完即删字段的剩余可用值池
+    items 为无序的剩余值数组，positions 记录每个值在数组中的位置；
+    删除时把末尾元素换到空位（swap-remove），抽取、删除、判空均为 O(1)。
+    order 保留原始（去重后）顺序，供顺序模式按序取值。
+    weights（值 -> 权重）存在时随机抽取按权重进行：在别名表上抽样并拒绝已删除的值，
+    剩余权重不足建表时的一半才重建别名表，摊还后仍为 O(1)。权重为 0 的值不会被随机抽到（live 不计入）。
+    """
+
+    __slots__ = ("order", "items", "positions", "weights", "_table", "_live_weight", "_zero")
+
+    def __init__(self, values: Iterable[str], used: Optional[Union[Set[str], "UsedBitset"]] = None, weights: Optional[Dict[str, float]] = None) -> None:
+        # 变量库的列已去重，直接共享其 table（只读）
+        self.order: List[str] = values.table if isinstance(values, InternedColumn) else list(dict.fromkeys(values))
+        if isinstance(used, UsedBitset) and used.column.table is self.order:
+            # 与已用位图对应同一张 table 时按下标筛选，无需逐个查字典
+            has = used.has_index
+            self.items: List[str] = [v for i, v in enumerate(self.order) if not has(i)]
+        else:
+            used = used or set()
+            self.items = [v for v in self.order if v not in used]
+        self.positions: Dict[str, int] = {v: i for i, v in enumerate(self.items)}
+        self.weights = weights
+        self._table: Optional[AliasTable] = None
+        self._live_weight = 0.0
+        # 剩余值中权重为 0 的个数
+        self._zero = 0 if weights is None else sum(1 for v in self.items if weights.get(v, 1.0) <= 0)
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    @property
+    def live(self) -> int:
+        """随机抽取时还能抽到的剩余值个数（不计权重为 0 的值）"""
+        return len(self.items) - self._zero
+
+    def __contains__(self, value: object) -> bool:
+        return value in self.positions
+
+    def copy(self) -> "RemainingPool":
+        clone = RemainingPool.__new__(RemainingPool)
+        clone.order = self.order
+        clone.items = list(self.items)
+        clone.positions = dict(self.positions)
+        clone.weights = self.weights
+        clone._table = self._table
+        clone._live_weight = self._live_weight
+        clone._zero = self._zero
+        return clone
+
+    def choice(self, rng: random.Random) -> str:
+        if self.weights is None:
+            return rng.choice(self.items)
+        table = self._table
+        if table is None or self._live_weight * 2 < table.total or table.total <= 0:
+            table = self._table = AliasTable(list(self.items), [self.weights.get(v, 1.0) for v in self.items])
+            self._live_weight = table.total
+            if table.total <= 0:
+                # 只剩权重为 0 的值（调用方应先用 live 判断是否耗尽）
+                raise IndexError("剩余值池中没有可抽取的值")
+        while True:
+            value = table.sample(rng)
+            if value in self.positions:
+                return value
+
+    def next_from(self, index: int) -> Tuple[str, int]:
+        """从原始顺序的 index 处起取第一个未用值，返回 (值, 下一个起点)"""
+        n = len(self.order)
+        if index >= n:
+            index = 0
+        for step in range(n):
+            i = (index + step) % n
+            value = self.order[i]
+            if value in self.positions:
+                return value, i + 1
+        raise IndexError("剩余值池为空")
+
+    def patch(self, order: List[str], added: List[str], removed: List[str], used: Union[Set[str], "UsedBitset"]) -> None:
+        """变量库增量变化时就地更新：换用新的原始顺序，删除已移除的值，加入未用过的新值"""
+        self.order = order
+        for value in removed:
+            self.discard(value)
+        for value in added:
+            if value not in used and value not in self.positions:
+                self.positions[value] = len(self.items)
+                self.items.append(value)
+                if self.weights is not None and self.weights.get(value, 1.0) <= 0:
+                    self._zero += 1
+
+    def discard(self, value: str) -> bool:
+        pos = self.positions.pop(value, None)
+        if pos is None:
+            return False
+        if self.weights is not None:
+            weight = self.weights.get(value, 1.0)
+            self._live_weight -= weight
+            if weight <= 0:
+                self._zero -= 1
+        last = self.items.pop()
+        if pos < len(self.items):
+            self.items[pos] = last
+            self.positions[last] = pos
+        return True
+
+
+class CombinationSpace:
+    """模板各字段取值的笛卡尔积，按混合进制编号（最后一个字段变化最快，与 itertools.product 顺序一致）
+    不展开全部组合：count 为组合总数，[k] 按进制换算直接得到第 k 个组合，iter_from 以进位方式惰性逐个产生。
+    """
+
+    __slots__ = ("markers", "values", "count")
+
+    def __init__(self, axes: List[Tuple[str, List[str]]]) -> None:
+        self.markers: List[str] = [marker for marker, _ in axes]
+        self.values: List[List[str]] = [values for _, values in axes]
+        count = 1
+        for values in self.values:
+            count *= len(values)
+        self.count: int = count
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _digits(self, index: int) -> List[int]:
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError(f"组合序号超出范围: {index}（共 {self.count} 个组合）")
+        digits = [0] * len(self.values)
+        for i in range(len(self.values) - 1, -1, -1):
+            index, digits[i] = divmod(index, len(self.values[i]))
+        return digits
+
+    def __getitem__(self, index: int) -> Dict[str, str]:
+        return {marker: values[d] for marker, values, d in zip(self.markers, self.values, self._digits(index))}
+
+    def __iter__(self) -> Iterator[Dict[str, str]]:
+        return self.iter_from(0)
+
+    def iter_from(self, start: int = 0, stop: Optional[int] = None) -> Iterator[Dict[str, str]]:
+        """依次产生第 start ~ stop-1 个组合"""
+        stop = self.count if stop is None else min(stop, self.count)
+        if start >= stop:
+            return
+        digits = self._digits(start)
+        current = {marker: values[d] for marker, values, d in zip(self.markers, self.values, digits)}
+        for _ in range(stop - start):
+            yield dict(current)
+            # 末位加一并逐位进位
+            i = len(digits) - 1
+            while i >= 0:
+                digits[i] += 1
+                if digits[i] < len(self.values[i]):
+                    current[self.markers[i]] = self.values[i][digits[i]]
+                    break
+                digits[i] = 0
+                current[self.markers[i]] = self.values[i][0]
+                i -= 1
+
+
+class RecencyWindow:
+    """最近 size 个取值的滑动窗口：环形缓冲区记录顺序，计数字典做 O(1) 判断
+    内存只与 size 有关，与历史长度无关。
+    """
+
+    __slots__ = ("size", "ring", "head", "counts")
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self.ring: List[Optional[str]] = [None] * size
+        self.head = 0
+        self.counts: Dict[str, int] = {}
+
+    def __contains__(self, value: object) -> bool:
+        return value in self.counts
+
+    def push(self, value: str) -> None:
+        old = self.ring[self.head]
+        if old is not None:
+            n = self.counts[old] - 1
+            if n:
+                self.counts[old] = n
+            else:
+                del self.counts[old]
+        self.ring[self.head] = value
+        self.counts[value] = self.counts.get(value, 0) + 1
+        self.head = (self.head + 1) % self.size
+
+
+class UsedBitset:
+    """用完即删字段的已用标记：按变量库列 table 下标每个取值占 1 位
+    count 随置位增量维护，剩余数量（remaining）为 O(1)；清空即整块清零。
+    不在变量库中的已用值（变量库修改后残留）放在 extra 集合中，不计入 count。
+    """
+
+    __slots__ = ("column", "bits", "count", "extra")
+
+    def __init__(self, column: InternedColumn, values: Iterable[str] = ()) -> None:
+        self.column = column
+        self.bits = bytearray((len(column.table) + 7) >> 3)
+        self.count = 0
+        self.extra: Set[str] = set()
+        for value in values:
+            self.add(value)
+
+    def __len__(self) -> int:
+        return self.count + len(self.extra)
+
+    def __contains__(self, value: object) -> bool:
+        i = self.column.index_of(value) if isinstance(value, str) else None
+        if i is None:
+            return value in self.extra
+        return self.has_index(i)
+
+    def has_index(self, i: int) -> bool:
+        return bool(self.bits[i >> 3] & (1 << (i & 7)))
+
+    @property
+    def remaining(self) -> int:
+        """变量库中尚未用过的取值个数"""
+        return len(self.column.table) - self.count
+
+    def add(self, value: str) -> bool:
+        """标记为已用，返回是否为新增"""
+        i = self.column.index_of(value)
+        if i is None:
+            if value in self.extra:
+                return False
+            self.extra.add(value)
+            return True
+        byte, bit = i >> 3, 1 << (i & 7)
+        if self.bits[byte] & bit:
+            return False
+        self.bits[byte] |= bit
+        self.count += 1
+        return True
+
+    def clear(self) -> None:
+        self.bits = bytearray(len(self.bits))
+        self.count = 0
+        self.extra.clear()
+
+    def copy(self) -> "UsedBitset":
+        clone = UsedBitset.__new__(UsedBitset)
+        clone.column = self.column
+        clone.bits = bytearray(self.bits)
+        clone.count = self.count
+        clone.extra = set(self.extra)
+        return clone
+
+
+# 多进程批量生成：子进程内只保留渲染所需状态的生成器（不读写任何文件）
+_batch_worker_generator: Optional["PromptGenerator"] = None
+
+
+def _init_batch_worker(state: Dict[str, Any]) -> None:
+    global _batch_worker_generator
+    _batch_worker_generator = PromptGenerator._for_batch_worker(state)
+
+
+def _render_batch_shard(shard: Dict[str, Any]) -> List[Tuple[str, List[Dict[str, Any]]]]:
+    gen = _batch_worker_generator
+    assert gen is not None
+    # 每个分片使用独立的确定性随机数流
+    gen.rng.seed(shard["seed"])
+    gen.field_indices = dict(shard.get("field_indices") or {})
+    gen.combination_indices = {shard["template"]: shard.get("combination_start", 0)}
+    gen._recent = {}
+    gen._pools = {field: RemainingPool(values, weights=gen._weight_map(field)) for field, values in (shard.get("pools") or {}).items()}
+    return list(gen._iter_template_batch(shard["template"], shard["count"], shard["selected"], mark_used=False))
+
 
 class PromptGenerator:
     """核心提示词生成器，处理所有业务逻辑"""
     
     DEFAULT_ACTIONS: Dict[str, List[str]] = {}
     DEFAULT_ATMOSPHERES: List[str] = []
+    # 编译模板缓存上限（防止临时模板无限堆积）
+    COMPILED_CACHE_LIMIT: int = 256
+    # 加载变量库时每读取多少行回调一次进度
+    LOAD_PROGRESS_STEP: int = 2000
+    # 变量库解析缓存：格式版本、最多缓存的文件数、命中时是否额外校验文件内容哈希
+    LIBRARY_CACHE_VERSION: int = 4
+    LIBRARY_CACHE_MAX_ENTRIES: int = 8
+    LIBRARY_CACHE_VERIFY_HASH: bool = False
+    # 设置/模板/已用记录的延迟合并写入窗口（秒）
+    PERSIST_DELAY: float = 0.5
+    # 已用记录日志累计多少条后压缩为快照
+    USED_JOURNAL_COMPACT_THRESHOLD: int = 500
+    # used_values.json 格式版本：2 为按变量库下标 + 内容哈希保存
+    USED_VALUES_FORMAT_VERSION: int = 2
+    # 可选的 SQLite 存储文件名（位于数据目录，存在时启用）
+    STORE_FILE_NAME: str = "prompt.sqlite3"
+    # 权重列后缀：如 "男背景__weight" 列给出同一行 "男背景" 取值的抽样权重
+    WEIGHT_COLUMN_SUFFIX: str = "__weight"
+    # 近期不重复：拒绝抽样最多尝试的次数，超过后改为筛选候选值
+    RECENCY_MAX_REJECTIONS: int = 16
+    # 多进程批量生成时每个分片的条数
+    PARALLEL_SHARD_SIZE: int = 1000
+    # 模板版本的渲染次数每累计多少次保存一次（退出时也会保存）
+    RENDER_COUNT_SAVE_EVERY: int = 200
     
     DEFAULT_TEMPLATE = """主体：一位充满活力的抖音带货达人，镜头全程聚焦，确保【{产品}】是绝对视觉中心。
 主体描述：动作连贯有节奏，突出产品核心卖点。面料自然下垂，严禁任何扭曲或拉伸变形，保证结构真实。
@@ -20,14 +510,13 @@ class PromptGenerator:
 镜头语言：动态运镜强化动作细节 —— 推近特写、跟随移动、环绕拍摄。每帧画面变化率 >35%，确保视觉冲击力。
 氛围：{氛围}，适合短视频平台快速种草。"""
     
-    def __init__(self) -> None:
-        self.action_library: Dict[str, List[str]] = {}
-        self.value_library: Dict[str, List[str]] = {}
-        self.template: str = self.DEFAULT_TEMPLATE
-        self.matching_mode: str = "random"
-        self.field_indices: Dict[str, int] = {}
-        self.delete_on_use_fields: List[str] = []
-        self.template_presets: List[Dict[str, Any]] = []
+    def __init__(self, load_library: bool = True, data_dir: Optional[str] = None) -> None:
+        """load_library 为 False 时不在构造时加载上次的变量库（由调用方在后台线程中加载）
+        data_dir 指定持久化目录（默认为系统用户数据目录），用于脚本、基准测试等隔离运行
+        """
+        self._init_render_state()
+        self._writer = WriteBehindStore(self.PERSIST_DELAY)
+        atexit.register(self.flush)
         base_dir = os.path.dirname(__file__)
         # 计算持久化目录（跨平台）
         def _data_dir() -> str:
@@ -40,7 +529,7 @@ class PromptGenerator:
                 return os.path.join(os.path.expanduser("~"), "Library", "Application Support", app_name)
             else:
                 return os.path.join(os.path.expanduser("~"), ".config", app_name)
-        self.data_dir: str = _data_dir()
+        self.data_dir: str = data_dir or _data_dir()
         try:
             os.makedirs(self.data_dir, exist_ok=True)
         except Exception:
@@ -50,9 +539,30 @@ class PromptGenerator:
         old_used = os.path.join(base_dir, "used_values.json")
         self.templates_file: str = os.path.join(self.data_dir, "templates.json")
         self.settings_file: str = os.path.join(self.data_dir, "settings.json")
-        self.current_product_type: Optional[str] = None
         self.used_values_file: str = os.path.join(self.data_dir, "used_values.json")
-        self.used_values: Dict[str, List[str]] = {}
+        self.library_cache_file: str = os.path.join(self.data_dir, "library_cache.pkl")
+        # 可选的 SQLite 存储：启用后设置、模板预设与已用记录改为读写数据库，变量库取值同步镜像到数据库
+        self.store_file: str = os.path.join(self.data_dir, self.STORE_FILE_NAME)
+        # 已合并到内存的最后一条已用事件 id（SQLite 存储）
+        self._store_event_id: int = 0
+        # 变量库来源：已加载的文件（按顺序）、各文件的工作表解析结果与文件状态（大小、修改时间），
+        # 以及按需构建的“字段 -> 取值 -> 出处”索引
+        self.library_sources: List[str] = []
+        self._sources: Dict[str, List[LibrarySource]] = {}
+        self._source_keys: Dict[str, Tuple[int, int]] = {}
+        self._source_index: Dict[str, Dict[str, List[Tuple[str, str, int]]]] = {}
+        # 热重载轮询中发现、尚待确认写入完成的文件状态
+        self._pending_source_keys: Dict[str, Tuple[int, int]] = {}
+        # 不同来源同名字段的处理方式：merge 合并，namespace 按文件名区分
+        self.library_merge_mode: str = "merge"
+        # 启动时自动加载的变量库文件
+        self.library_paths: List[str] = []
+        self._journal_entries: int = 0
+        # 已合并到内存的日志字节数与快照文件状态，用于发现其他进程写入的已用记录
+        self._journal_offset: int = 0
+        self._snapshot_key: Optional[Tuple[int, int]] = None
+        # 已合并到内存的模板版本记录日志字节数
+        self._template_history_offset: int = 0
         self.result_font_size: int = 14
         self.current_template_override: Optional[str] = None
         self.current_preset_name: Optional[str] = None
@@ -68,10 +578,16 @@ class PromptGenerator:
         self.custom_settings_file_path: Optional[str] = None
         self.custom_templates_file_path: Optional[str] = None
         self.custom_used_values_file_path: Optional[str] = None
+        if os.path.exists(self.store_file):
+            with timing.phase("PromptGenerator: 打开 SQLite 存储"):
+                self._open_store()
         self.load_default_actions()
-        self.load_settings()
-        self.load_template_presets()
-        self.load_used_values()
+        with timing.phase("PromptGenerator: 加载设置"):
+            self.load_settings()
+        with timing.phase("PromptGenerator: 加载模板预设"):
+            self.load_template_presets()
+        with timing.phase("PromptGenerator: 加载已用记录"):
+            self.load_used_values()
         # 迁移旧文件至持久化目录（仅在新路径不存在且旧路径存在时）
         try:
             if (not os.path.exists(self.templates_file)) and os.path.exists(old_templates):
@@ -91,42 +607,653 @@ class PromptGenerator:
                     json.dump(data, fp, ensure_ascii=False, indent=2)
         except Exception:
             pass
-        if self.last_library_path and os.path.exists(self.last_library_path):
+        startup_paths = [p for p in self.get_library_paths() if os.path.exists(p)]
+        if load_library and startup_paths:
             try:
-                self.load_action_library_from_file(self.last_library_path)
+                with timing.phase("PromptGenerator: 加载变量库"):
+                    self.load_library_sources(startup_paths)
             except Exception:
                 pass
     
+    def _init_render_state(self) -> None:
+        """声明生成、渲染所需的全部内存状态（不涉及任何文件）；__init__ 与批量子进程的生成器共用"""
+        self.action_library: Dict[str, List[str]] = {}
+        self.value_library: Dict[str, InternedColumn] = {}
+        # 字段取值的抽样权重（与 value_library 中该字段的取值一一对应），只包含有权重列的字段
+        self.value_weights: Dict[str, List[float]] = {}
+        self._alias_tables: Dict[str, AliasTable] = {}
+        self.template: str = self.DEFAULT_TEMPLATE
+        self.matching_mode: str = "random"
+        self.field_indices: Dict[str, int] = {}
+        # 穷举模式下每个模板的组合游标
+        self.combination_indices: Dict[str, int] = {}
+        # 非用完即删字段的“近 K 个不重复”窗口大小（随机模式生效），以及运行期的近期取值窗口
+        self.recency_windows: Dict[str, int] = {}
+        self._recent: Dict[str, RecencyWindow] = {}
+        self.delete_on_use_fields: List[str] = []
+        self.template_presets: List[Dict[str, Any]] = []
+        # 随机模式使用的随机数生成器；seed 为最近一次 set_seed 的种子（None 表示未指定）
+        self.rng = random.Random()
+        self.seed: Optional[int] = None
+        self._library_fingerprint: Optional[str] = None
+        self._compiled_templates: Dict[str, CompiledTemplate] = {}
+        # 用完即删字段的剩余值池与已用位图（均由 value_library/used_values 派生）
+        self._pools: Dict[str, RemainingPool] = {}
+        self._used_bits: Dict[str, UsedBitset] = {}
+        # 变量库与已用记录的变更计数，生成会话据此判断自己的派生缓存是否过期；提交会话时加锁
+        self._library_version: int = 0
+        self._used_version: int = 0
+        self._commit_lock = threading.Lock()
+        # 模板预设的版本历史（全文 + delta）与尚未保存的渲染次数增量
+        self._template_history: Optional[TemplateHistory] = TemplateHistory()
+        self._render_pending: Dict[int, int] = {}
+        self._render_pending_total: int = 0
+        self.current_product_type: Optional[str] = None
+        self.used_values: Dict[str, List[str]] = {}
+        # 按下标保存、但变量库尚未加载（或缺少该字段）而暂未解码的已用记录
+        self._encoded_used: Dict[str, Dict[str, Any]] = {}
+        # 可选的 SQLite 存储（见 enable_sqlite_store）；渲染前合并其他进程的已用记录时会用到
+        self._store: Optional[Any] = None
+        # 已用记录的线程锁（可重入）；当前线程是否已持有跨进程文件锁记在线程局部变量中
+        self._used_rlock = threading.RLock()
+        self._used_lock_local = threading.local()
+        # 为 True 时不读写已用记录文件（批量子进程）
+        self._used_sync_disabled: bool = False
+
+    @classmethod
+    def _for_batch_worker(cls, state: Dict[str, Any]) -> "PromptGenerator":
+        """多进程批量生成的子进程生成器：只有渲染状态，不读写任何文件"""
+        gen = cls.__new__(cls)
+        gen._init_render_state()
+        gen.value_library = state["value_library"]
+        gen.value_weights = state["value_weights"]
+        gen.matching_mode = state["matching_mode"]
+        gen.delete_on_use_fields = state["delete_on_use_fields"]
+        gen.current_product_type = state["current_product_type"]
+        gen.recency_windows = state["recency_windows"]
+        gen.template = ""
+        # 不合并已用记录文件，渲染次数由主进程统计
+        gen._used_sync_disabled = True
+        gen._template_history = None
+        return gen
+
     def load_default_actions(self) -> None:
         self.action_library = {}
         self.value_library = {}
-    
-    def load_action_library_from_file(self, file_path: str) -> Tuple[bool, str]:
+        self.value_weights = {}
+        self.library_sources = []
+        self._sources = {}
+        self._source_keys = {}
+        self._on_library_changed()
+
+    def load_action_library_from_file(self, file_path: str, progress_callback: Optional[Callable[[int, int], None]] = None, use_cache: bool = True) -> Tuple[bool, str]:
+        """加载变量库 Excel：首行为字段名，每列的非空单元格为该字段的取值
+        progress_callback(已读行数, 总行数) 用于显示加载进度（总行数未知时为 0）
+        名为 "字段__weight" 的列为该字段同一行取值的抽样权重（可选，空白为 1）
+        读取文件中的全部工作表，并替换当前全部来源（同时加载多个文件见 load_library_sources）
+        use_cache 为 True 时，文件未变化（路径、大小、修改时间一致）则直接读取解析缓存
+        """
+        return self.load_library_sources([file_path], progress_callback, use_cache)
+
+    def load_library_sources(self, file_paths: List[str], progress_callback: Optional[Callable[[int, int], None]] = None, use_cache: bool = True) -> Tuple[bool, str]:
+        """从多个 Excel 文件加载变量库（每个文件读取全部工作表），替换当前的来源列表
+        已加载且未变化的文件直接复用，只解析新增或变化的文件，并只重建它们涉及的字段。
+        不同来源的同名字段按 library_merge_mode 处理：merge 合并为一个字段（跨来源重复的取值只保留首次出现），
+        namespace 按文件区分（字段名为 "文件名.字段"）。
+        """
         try:
-            if not os.path.exists(file_path):
-                raise FileNotFoundError(f"文件不存在: {file_path}")
-            
-            ext = os.path.splitext(file_path)[1].lower()
-            if ext == ".xlsx":
-                df = pd.read_excel(file_path, engine="openpyxl")
-            elif ext == ".xls":
-                df = pd.read_excel(file_path, engine="xlrd")
-            else:
-                df = pd.read_excel(file_path)
-            
-            value_library: Dict[str, List[str]] = {}
-            for col in df.columns:
-                col_name = str(col).strip()
-                values = [str(v).strip() for v in df[col].dropna().tolist() if str(v).strip()]
-                if values:
-                    value_library[col_name] = values
-            
-            self.value_library = value_library
-            return True, f"成功加载占位符字段 {len(value_library)} 个"
-            
+            self._load_sources(file_paths, progress_callback, use_cache)
+            return True, f"成功加载占位符字段 {len(self.value_library)} 个"
+
         except Exception as e:
             return False, f"解析文件时出错: {str(e)}"
-    
+
+    def _load_sources(self, file_paths: List[str], progress_callback: Optional[Callable[[int, int], None]] = None, use_cache: bool = True) -> Optional[Dict[str, Tuple[int, int]]]:
+        """读取新增或变化的来源文件并合并，返回各重建字段的 (新增取值数, 删除取值数)；整体重建时返回 None"""
+        paths = list(dict.fromkeys(os.path.abspath(p) for p in file_paths))
+        loaded: Dict[str, List[LibrarySource]] = {}
+        keys: Dict[str, Tuple[int, int]] = {}
+        for path in paths:
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"文件不存在: {path}")
+            st = os.stat(path)
+            keys[path] = (st.st_size, st.st_mtime_ns)
+            if use_cache and path in self._sources and self._source_keys.get(path) == keys[path]:
+                # 同一文件已加载且未变化（如启动时 GUI 再次加载），无需重复解析
+                continue
+            parts = self._read_library_cache(path, st) if use_cache else None
+            if parts is None:
+                parts = self._parse_library_file(path, progress_callback)
+                self._write_library_cache(path, st, parts)
+            loaded[path] = parts
+        return self._apply_library_sources(paths, loaded, keys)
+
+    def reload_library_source(self, file_path: str, progress_callback: Optional[Callable[[int, int], None]] = None) -> Tuple[bool, str]:
+        """重新读取一个来源文件（尚未加载时追加为新来源），其余来源保持不变，只重建该文件涉及的字段"""
+        path = os.path.abspath(file_path)
+        paths = list(self.library_sources)
+        if path not in paths:
+            paths.append(path)
+        self._source_keys.pop(path, None)
+        try:
+            changes = self._load_sources(paths, progress_callback)
+            return True, f"成功加载占位符字段 {len(self.value_library)} 个" + self._describe_library_changes(changes)
+        except Exception as e:
+            return False, f"解析文件时出错: {str(e)}"
+
+    def remove_library_source(self, file_path: str) -> Tuple[bool, str]:
+        """移除一个来源文件，只重建该文件涉及的字段"""
+        path = os.path.abspath(file_path)
+        if path not in self.library_sources:
+            return False, f"变量库来源不存在: {file_path}"
+        return self.load_library_sources([p for p in self.library_sources if p != path])
+
+    def changed_library_sources(self) -> List[str]:
+        """轮询来源文件的大小与修改时间，返回已修改的文件
+        同一新状态需连续两次检查一致才算修改完成，避免读到正在保存、只写了一半的文件；暂时不存在的文件忽略
+        """
+        changed: List[str] = []
+        for path in self.library_sources:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            key = (st.st_size, st.st_mtime_ns)
+            if key == self._source_keys.get(path):
+                self._pending_source_keys.pop(path, None)
+            elif self._pending_source_keys.get(path) == key:
+                changed.append(path)
+            else:
+                self._pending_source_keys[path] = key
+        return changed
+
+    def reload_changed_library_sources(self) -> Dict[str, Tuple[int, int]]:
+        """热重载：重新读取已修改的来源文件，只把新增/删除的取值应用到变量库，返回 {字段: (新增数, 删除数)}
+        未修改时不做任何事；读取失败（如文件仍在写入）时保持原变量库，下次轮询再试
+        """
+        changed = self.changed_library_sources()
+        if not changed:
+            return {}
+        try:
+            changes = self._load_sources(self.library_sources)
+        except Exception:
+            return {}
+        for path in changed:
+            self._pending_source_keys.pop(path, None)
+        if changes is None:
+            return {field: (len(column.table), 0) for field, column in self.value_library.items()}
+        return {field: diff for field, diff in changes.items() if diff != (0, 0)}
+
+    @staticmethod
+    def _describe_library_changes(changes: Optional[Dict[str, Tuple[int, int]]]) -> str:
+        items = [f"{field} +{added}/-{removed}" for field, (added, removed) in (changes or {}).items() if added or removed]
+        return f"（{'，'.join(items)}）" if items else ""
+
+    def _apply_library_sources(self, paths: List[str], loaded: Dict[str, List[LibrarySource]], keys: Dict[str, Tuple[int, int]]) -> Optional[Dict[str, Tuple[int, int]]]:
+        """替换来源并增量合并：只有新增、变化或移除的来源所涉及的字段会重建"""
+        kept = [p for p in paths if p in self._sources and p not in loaded]
+        if kept != [p for p in self.library_sources if p in kept]:
+            # 未变化来源的先后顺序变了，合并结果（取值顺序与去重）可能全部改变
+            affected: Optional[Set[str]] = None
+        else:
+            affected = set()
+            for path in set(loaded) | (set(self._sources) - set(paths)):
+                for part in self._sources.get(path, []) + loaded.get(path, []):
+                    affected.update(self._merged_field_name(part, name) for name in part.library)
+        previous = {field: self.value_library.get(field) for field in affected} if affected is not None else None
+        self._sources = {p: loaded[p] if p in loaded else self._sources[p] for p in paths}
+        self._source_keys = keys
+        self.library_sources = paths
+        self._rebuild_library(affected)
+        if previous is None:
+            self._on_library_changed()
+            return None
+        return self._patch_library_fields(previous)
+
+    def _merged_field_name(self, part: LibrarySource, name: str) -> str:
+        if self.library_merge_mode == "namespace":
+            return f"{os.path.splitext(os.path.basename(part.path))[0]}.{name}"
+        return name
+
+    def _rebuild_library(self, fields: Optional[Set[str]] = None) -> None:
+        """按来源顺序重新合并字段；fields 为 None 时合并全部，否则其余字段直接沿用"""
+        members: Dict[str, List[Tuple[LibrarySource, str]]] = {}
+        for parts in self._sources.values():
+            for part in parts:
+                for name in part.library:
+                    members.setdefault(self._merged_field_name(part, name), []).append((part, name))
+        value_library: Dict[str, InternedColumn] = {}
+        value_weights: Dict[str, List[float]] = {}
+        for field, sources in members.items():
+            if fields is not None and field not in fields and field in self.value_library:
+                value_library[field] = self.value_library[field]
+                weights = self.value_weights.get(field)
+            else:
+                value_library[field], weights = self._merge_columns(sources)
+            if weights is not None:
+                value_weights[field] = weights
+        self.value_library = value_library
+        self.value_weights = value_weights
+
+    @staticmethod
+    def _merge_columns(sources: List[Tuple[LibrarySource, str]]) -> Tuple[InternedColumn, Optional[List[float]]]:
+        """合并多个来源的同名列：来源内的重复行保留，之前来源已有的取值（按哈希判断）跳过"""
+        if len(sources) == 1:
+            part, name = sources[0]
+            return part.library[name], part.weights.get(name)
+        column = InternedColumn()
+        has_weights = any(name in part.weights for part, name in sources)
+        weights: List[float] = []
+        for part, name in sources:
+            source_weights = part.weights.get(name)
+            prior = len(column.table)
+            for n, value in enumerate(part.library[name]):
+                i = column.index_of(value)
+                if i is not None and i < prior:
+                    continue
+                column.append(value)
+                if has_weights:
+                    weights.append(source_weights[n] if source_weights is not None else 1.0)
+        return column, (weights if has_weights else None)
+
+    def value_sources(self, field: str, value: str) -> List[Tuple[str, str, int]]:
+        """取值的出处 [(文件路径, 工作表, 行号), ...]，按来源顺序列出全部出现（含合并时被去重的）"""
+        index = self._source_index.get(field)
+        if index is None:
+            index = {}
+            for parts in self._sources.values():
+                for part in parts:
+                    for name, column in part.library.items():
+                        if self._merged_field_name(part, name) != field:
+                            continue
+                        for v, row in zip(column, part.rows.get(name, ())):
+                            index.setdefault(v, []).append((part.path, part.sheet, row))
+            self._source_index[field] = index
+        return list(index.get(value, ()))
+
+    def set_library_merge_mode(self, mode: str) -> None:
+        """设置不同来源同名字段的处理方式（merge / namespace），并按新方式重新合并已加载的来源"""
+        self.library_merge_mode = mode if mode in ("merge", "namespace") else "merge"
+        self.save_settings()
+        if self._sources:
+            self._rebuild_library()
+            self._on_library_changed()
+
+    @classmethod
+    def _parse_library_file(cls, file_path: str, progress_callback: Optional[Callable[[int, int], None]] = None) -> List[LibrarySource]:
+        """解析变量库文件的全部工作表，每个非空工作表为一个来源"""
+        ext = os.path.splitext(file_path)[1].lower()
+        if ext in (".xlsx", ".xlsm"):
+            return cls._read_xlsx_library(file_path, progress_callback)
+        # pandas 导入开销大，只在需要解析非 .xlsx 文件时才导入
+        import pandas as pd
+        if ext == ".xls":
+            frames = pd.read_excel(file_path, engine="xlrd", sheet_name=None)
+        else:
+            frames = pd.read_excel(file_path, sheet_name=None)
+        parts: List[LibrarySource] = []
+        total = sum(len(df) for df in frames.values())
+        done = 0
+        for sheet, df in frames.items():
+            value_library: Dict[str, InternedColumn] = {}
+            value_weights: Dict[str, List[float]] = {}
+            value_rows: Dict[str, array] = {}
+            columns = {str(col).strip(): col for col in df.columns}
+            for col_name, col in columns.items():
+                if col_name.endswith(cls.WEIGHT_COLUMN_SUFFIX):
+                    continue
+                weight_col = columns.get(col_name + cls.WEIGHT_COLUMN_SUFFIX)
+                raw_weights = df[weight_col].tolist() if weight_col is not None else None
+                values = []
+                weights = []
+                rows = array("I")
+                for row, v in enumerate(df[col].tolist()):
+                    if pd.isna(v):
+                        continue
+                    s = str(v).strip()
+                    if s:
+                        values.append(s)
+                        # 表头占第 1 行
+                        rows.append(row + 2)
+                        if raw_weights is not None:
+                            w = raw_weights[row]
+                            weights.append(_parse_weight(None if pd.isna(w) else w))
+                if values:
+                    value_library[col_name] = InternedColumn(values)
+                    value_rows[col_name] = rows
+                    if raw_weights is not None:
+                        value_weights[col_name] = weights
+            done += len(df)
+            if progress_callback:
+                progress_callback(done, total)
+            if value_library:
+                parts.append(LibrarySource(file_path, str(sheet), value_library, value_weights, value_rows))
+        return parts
+
+    @staticmethod
+    def _file_digest(file_path: str) -> str:
+        h = hashlib.sha1()
+        with open(file_path, "rb") as fp:
+            for chunk in iter(lambda: fp.read(1 << 20), b""):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def _load_library_cache_entries(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.library_cache_file, "rb") as fp:
+                data = pickle.load(fp)
+            if isinstance(data, dict) and data.get("version") == self.LIBRARY_CACHE_VERSION:
+                return data.get("entries") or {}
+        except Exception:
+            pass
+        return {}
+
+    def _read_library_cache(self, file_path: str, st: os.stat_result) -> Optional[List[LibrarySource]]:
+        """命中缓存时返回文件各工作表的解析结果，否则返回 None"""
+        path = os.path.abspath(file_path)
+        entry = self._load_library_cache_entries().get(path)
+        if not entry or entry.get("size") != st.st_size or entry.get("mtime_ns") != st.st_mtime_ns:
+            return None
+        if self.LIBRARY_CACHE_VERIFY_HASH and entry.get("sha1") != self._file_digest(file_path):
+            return None
+        parts = []
+        for sheet, library, weights, rows in entry.get("sheets", ()):
+            parts.append(LibrarySource(
+                path,
+                sheet,
+                {field: InternedColumn.from_parts(list(table), codes) for field, table, codes in library},
+                {field: list(values) for field, values in weights},
+                dict(rows),
+            ))
+        return parts
+
+    def _write_library_cache(self, file_path: str, st: os.stat_result, parts: List[LibrarySource]) -> None:
+        try:
+            entries = self._load_library_cache_entries()
+            path = os.path.abspath(file_path)
+            entries.pop(path, None)
+            # 只保留最近的若干个文件
+            while len(entries) >= self.LIBRARY_CACHE_MAX_ENTRIES:
+                entries.pop(next(iter(entries)))
+            entries[path] = {
+                "size": st.st_size,
+                "mtime_ns": st.st_mtime_ns,
+                "sha1": self._file_digest(file_path),
+                "sheets": tuple(
+                    (
+                        part.sheet,
+                        tuple((field, tuple(column.table), column.codes) for field, column in part.library.items()),
+                        tuple((field, tuple(values)) for field, values in part.weights.items()),
+                        tuple(part.rows.items()),
+                    )
+                    for part in parts
+                ),
+            }
+            tmp_path = self.library_cache_file + ".tmp"
+            with open(tmp_path, "wb") as fp:
+                pickle.dump({"version": self.LIBRARY_CACHE_VERSION, "entries": entries}, fp, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.library_cache_file)
+        except Exception:
+            pass
+
+    @classmethod
+    def _read_xlsx_library(cls, file_path: str, progress_callback: Optional[Callable[[int, int], None]] = None) -> List[LibrarySource]:
+        """以 openpyxl 只读模式逐行流式读取全部工作表，直接按列累积取值，不构建 DataFrame
+        相同文本只保留一个字符串对象，每列保存为去重后的取值表加下标数组，内存随不同取值数量增长而非表格大小
+        """
+        from openpyxl import load_workbook
+        wb = load_workbook(file_path, read_only=True, data_only=True)
+        parts: List[LibrarySource] = []
+        try:
+            total = sum(ws.max_row or 0 for ws in wb.worksheets)
+            interned: Dict[str, str] = {}
+            done = 0
+            for ws in wb.worksheets:
+                rows = ws.iter_rows(values_only=True)
+                header = next(rows, None) or ()
+                names: List[str] = []
+                columns: List[InternedColumn] = []
+                row_numbers: List[array] = []
+                seen_names: Dict[str, int] = {}
+
+                def add_column(raw: Any) -> None:
+                    # 列名规则与 pandas 保持一致：空表头为 "Unnamed: i"，重名追加 ".n"
+                    name = str(raw).strip() if raw is not None else f"Unnamed: {len(names)}"
+                    if name in seen_names:
+                        seen_names[name] += 1
+                        name = f"{name}.{seen_names[name]}"
+                    else:
+                        seen_names[name] = 0
+                    names.append(name)
+                    columns.append(InternedColumn())
+                    row_numbers.append(array("I"))
+
+                for raw in header:
+                    add_column(raw)
+                # 取值列序号 -> 对应权重列序号；权重按行与非空取值对齐
+                suffix = cls.WEIGHT_COLUMN_SUFFIX
+                index_of = {name: i for i, name in enumerate(names)}
+                weight_of: Dict[int, int] = {}
+                for wi, name in enumerate(names):
+                    if name.endswith(suffix) and name[:-len(suffix)] in index_of:
+                        weight_of[index_of[name[:-len(suffix)]]] = wi
+                weights: Dict[int, List[float]] = {vi: [] for vi in weight_of}
+                line = 1
+                done += 1
+                for row in rows:
+                    line += 1
+                    done += 1
+                    for i, v in enumerate(row):
+                        if v is None:
+                            continue
+                        s = str(v).strip()
+                        if not s:
+                            continue
+                        while i >= len(columns):
+                            add_column(None)
+                        columns[i].append(interned.setdefault(s, s))
+                        row_numbers[i].append(line)
+                        if weight_of and i in weight_of:
+                            wi = weight_of[i]
+                            weights[i].append(_parse_weight(row[wi] if wi < len(row) else None))
+                    if progress_callback and done % cls.LOAD_PROGRESS_STEP == 0:
+                        progress_callback(done, total)
+                value_library = {name: col for name, col in zip(names, columns) if col and not name.endswith(suffix)}
+                if value_library:
+                    parts.append(LibrarySource(
+                        file_path,
+                        ws.title,
+                        value_library,
+                        {names[vi]: w for vi, w in weights.items() if names[vi] in value_library},
+                        {name: numbers for name, numbers in zip(names, row_numbers) if name in value_library},
+                    ))
+            if progress_callback:
+                progress_callback(done, max(total, done))
+        finally:
+            wb.close()
+        return parts
+
+    def set_value_library(self, value_library: Dict[str, Sequence], value_weights: Optional[Dict[str, List[float]]] = None) -> None:
+        """直接设置变量库（不经过 Excel），如脚本或基准测试构造的数据
+        value_weights 可选，为各字段取值的抽样权重（长度须与取值一致）
+        """
+        self.value_library = {str(k): v if isinstance(v, InternedColumn) else InternedColumn(v) for k, v in value_library.items() if v}
+        self.value_weights = {}
+        for field, weights in (value_weights or {}).items():
+            field = str(field)
+            if field in self.value_library:
+                if len(weights) != len(self.value_library[field]):
+                    raise ValueError(f"字段 '{field}' 的权重数量与取值数量不一致")
+                self.value_weights[field] = [max(0.0, float(w)) for w in weights]
+        self.library_sources = []
+        self._sources = {}
+        self._source_keys = {}
+        self._on_library_changed()
+
+    def _on_library_changed(self) -> None:
+        """变量库内容变化后丢弃由其派生的缓存，并用新变量库解码/复用已用记录"""
+        self._library_version += 1
+        self._resolve_used_values()
+        self._library_fingerprint = None
+        self._alias_tables.clear()
+        self._recent.clear()
+        self._source_index.clear()
+        self._invalidate_pools()
+        self._sync_store_library()
+
+    def _patch_library_fields(self, previous: Dict[str, Optional[InternedColumn]]) -> Dict[str, Tuple[int, int]]:
+        """增量应用部分字段的变化：对比新旧取值表，只把新增/删除的取值应用到剩余值池，返回 {字段: (新增数, 删除数)}
+        已用位图按新取值表重建，曾用过、删除后又加回来的值仍算已用；未涉及的字段的派生缓存保持不变
+        """
+        self._library_version += 1
+        self._used_version += 1
+        self._resolve_used_values()
+        self._library_fingerprint = None
+        changes: Dict[str, Tuple[int, int]] = {}
+        for field, old in previous.items():
+            new = self.value_library.get(field)
+            old_table = old.table if old is not None else []
+            new_table = new.table if new is not None else []
+            old_set = set(old_table)
+            new_set = set(new_table)
+            added = [v for v in new_table if v not in old_set]
+            removed = [v for v in old_table if v not in new_set]
+            changes[field] = (len(added), len(removed))
+            self._alias_tables.pop(field, None)
+            self._source_index.pop(field, None)
+            window = self._recent.get(field)
+            if window is not None and len(new_table) - 1 < window.size:
+                self._recent.pop(field, None)
+            pool = self._pools.get(field)
+            if new is None or field in self.value_weights or (pool is not None and pool.weights is not None):
+                self._invalidate_pools(field)
+                continue
+            if field in self._used_bits:
+                self._used_bits[field] = UsedBitset(new, self.used_values.get(field, []))
+            if pool is not None:
+                pool.patch(new_table, added, removed, self._used_lookup(field))
+        self._sync_store_library(set(previous))
+        return changes
+
+    def _open_store(self) -> bool:
+        """打开（不存在时创建）SQLite 存储；sqlite3 只在启用时才导入"""
+        try:
+            from sqlite_store import SQLiteStore
+            self._store = SQLiteStore(self.store_file)
+            return True
+        except Exception:
+            self._store = None
+            return False
+
+    def _sync_store_library(self, fields: Optional[Set[str]] = None) -> None:
+        """把变量库取值镜像到 SQLite 存储（取值表与权重未变的字段跳过）；fields 为 None 时同步全部字段"""
+        if self._store is None:
+            return
+        try:
+            if fields is None:
+                if not self.value_library:
+                    # 变量库尚未加载（启动时的空库）时不清除数据库中的取值
+                    return
+                self._store.remove_fields(set(self._store.library_fields()) - set(self.value_library))
+                fields = set(self.value_library)
+            removed = []
+            for field in fields:
+                column = self.value_library.get(field)
+                if column is None:
+                    removed.append(field)
+                    continue
+                weight_map = self._weight_map(field)
+                weights = [weight_map.get(v, 1.0) for v in column.table] if weight_map is not None else None
+                key = column.digest()
+                if weights is not None:
+                    key += ":" + hashlib.sha1(json.dumps(weights).encode("utf-8")).hexdigest()[:12]
+                self._store.sync_field(field, column.table, key, weights)
+            if removed:
+                self._store.remove_fields(removed)
+        except Exception:
+            pass
+
+    def _weight_map(self, field: str) -> Optional[Dict[str, float]]:
+        """字段取值 -> 权重（重复取值以首次出现的权重为准）；字段无权重列时返回 None"""
+        weights = self.value_weights.get(field)
+        if weights is None:
+            return None
+        mapping: Dict[str, float] = {}
+        for value, weight in zip(self.value_library.get(field, []), weights):
+            mapping.setdefault(value, weight)
+        return mapping
+
+    def _distinct_values(self, field: str) -> List[str]:
+        """字段去重后的取值（保持原始顺序）"""
+        column = self.value_library.get(field)
+        return column.table if column is not None else []
+
+    def _recency_window(self, field: str) -> Optional[RecencyWindow]:
+        """字段的近期取值窗口；未设置时返回 None。窗口大小不超过不同取值数减一，保证总有可选值"""
+        window = self._recent.get(field)
+        if window is None:
+            size = min(self.recency_windows.get(field, 0), len(self._distinct_values(field)) - 1)
+            if size <= 0:
+                return None
+            window = self._recent[field] = RecencyWindow(size)
+        return window
+
+    def _choose_recent(self, field: str, values: List[str], window: RecencyWindow) -> str:
+        """随机抽取一个不在近期窗口中的值并记入窗口
+        先拒绝抽样（窗口远小于取值数时期望 O(1)），连续多次落入窗口才退回筛选候选值
+        """
+        for _ in range(self.RECENCY_MAX_REJECTIONS):
+            rep = self._choose(field, values)
+            if rep not in window:
+                break
+        else:
+            candidates = [v for v in self._distinct_values(field) if v not in window]
+            weight_map = self._weight_map(field)
+            weights = [weight_map.get(v, 1.0) for v in candidates] if weight_map else None
+            if weights and sum(weights) > 0:
+                rep = self.rng.choices(candidates, weights=weights)[0]
+            else:
+                rep = self.rng.choice(candidates)
+        window.push(rep)
+        return rep
+
+    def set_recency_windows(self, windows: Dict[str, int]) -> None:
+        """设置各字段“近 K 个不重复”的 K（0 或缺省表示不限制）"""
+        self.recency_windows = {str(k): int(v) for k, v in (windows or {}).items() if int(v) > 0}
+        self._recent.clear()
+        self.save_settings()
+
+    def _choose(self, field: str, values: List[str]) -> str:
+        """随机模式下从字段全部取值中抽取一个：有权重时查别名表（O(1)），否则均匀抽取"""
+        if field not in self.value_weights:
+            return self.rng.choice(values)
+        table = self._alias_tables.get(field)
+        if table is None:
+            table = self._alias_tables[field] = AliasTable(values, self.value_weights[field])
+        if table.total <= 0:
+            return self.rng.choice(values)
+        return table.sample(self.rng)
+
+    def library_fingerprint(self) -> str:
+        """变量库内容指纹（字段名、取值及其顺序），与种子、模板一起即可复现生成结果"""
+        if self._library_fingerprint is None:
+            h = hashlib.sha1()
+            for field, values in self.value_library.items():
+                h.update(field.encode("utf-8") + b"\x00")
+                for v in values:
+                    h.update(str(v).encode("utf-8") + b"\x01")
+                h.update(b"\x02")
+            self._library_fingerprint = h.hexdigest()
+        return self._library_fingerprint
+
+    def set_seed(self, seed: Optional[int] = None) -> int:
+        """设置随机种子并返回；seed 为 None 时随机生成一个（同样会被记录，便于事后复现）"""
+        if seed is None:
+            seed = random.SystemRandom().randrange(1 << 32)
+        self.seed = int(seed)
+        self.rng.seed(self.seed)
+        return self.seed
+
     def get_product_types(self) -> List[str]:
         values = self.value_library.get("产品类型", [])
         return [v for v in values if str(v).strip()]
@@ -177,9 +1304,19 @@ class PromptGenerator:
 
     def clear_used_values(self, field: str) -> None:
         """清除指定字段的已用记录"""
-        if field in self.used_values:
-            self.used_values[field] = []
-            self.save_used_values()
+        with self._used_values_lock():
+            if field in self.used_values:
+                self._clear_used_in_memory(field)
+                self._append_used_journal([{"op": "clear", "field": field, "ts": datetime.now().isoformat(timespec="seconds")}])
+
+    def _clear_used_in_memory(self, field: str) -> None:
+        self.used_values[field] = []
+        self._encoded_used.pop(field, None)
+        bits = self._used_bits.get(field)
+        if bits is not None:
+            bits.clear()
+        self._pools.pop(field, None)
+        self._used_version += 1
 
     def generate_prompt_with_spans(self, product_type: str, atmosphere: Optional[str] = None, custom_action: Optional[str] = None, selected_marker_values: Optional[Dict[str, str]] = None, template_str: Optional[str] = None) -> Tuple[str, List[Dict[str, Any]]]:
         """生成提示词，并返回替换片段区间用于高亮显示
@@ -192,27 +1329,107 @@ class PromptGenerator:
             selected_action = actions[0] if actions else ""
 
         template = template_str if template_str else self.template
+        if self.delete_on_use_fields:
+            self.refresh_used_values()
+        if self.matching_mode == "exhaustive":
+            # 穷举模式：取该模板的下一个组合作为固定取值，到末尾后从头开始
+            space = self.combination_space(template, selected_marker_values)
+            index = self.combination_indices.get(template, 0)
+            if index >= space.count:
+                index = 0
+            selected_marker_values = dict(selected_marker_values or {}, **space[index])
+            self.combination_indices[template] = index + 1
         current_product_value = None
         if selected_marker_values:
             current_product_value = selected_marker_values.get("产品") or selected_marker_values.get("产品类型")
         if not current_product_value:
             current_product_value = self.current_product_type
+        compiled = self.compile_template(template)
+        return self._render_with_spans(compiled, actions, selected_action, selected_marker_values, current_product_value, self._pool)
+
+    def combination_space(self, template: str, selected_marker_values: Optional[Dict[str, str]] = None) -> CombinationSpace:
+        """模板的穷举组合空间：模板中出现在变量库里、且未被固定取值的字段（按首次出现顺序），
+        每个字段取其全部去重后的值。穷举遍历完整组合空间，不受用完即删和已用记录影响。
+        """
+        axes: List[Tuple[str, List[str]]] = []
+        for marker in self.compile_template(template).markers:
+            if selected_marker_values and marker in selected_marker_values:
+                continue
+            values = self._distinct_values(marker)
+            if values:
+                axes.append((marker, values))
+        return CombinationSpace(axes)
+
+    def count_combinations(self, template: str, selected_marker_values: Optional[Dict[str, str]] = None) -> int:
+        """模板全部组合的数量（不展开组合）"""
+        return self.combination_space(template, selected_marker_values).count
+
+    def render_combination(self, template: str, index: int, selected_marker_values: Optional[Dict[str, str]] = None) -> Tuple[str, List[Dict[str, Any]]]:
+        """直接渲染第 index 个组合（按进制换算定位，无需遍历前面的组合）"""
+        assignment = self.combination_space(template, selected_marker_values)[index]
+        return self._render_combination(self.compile_template(template), self.get_actions_for_product(""), assignment, selected_marker_values)
+
+    def iter_combinations(self, template: str, start: int = 0, stop: Optional[int] = None, selected_marker_values: Optional[Dict[str, str]] = None) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+        """惰性渲染第 start ~ stop-1 个组合（stop 省略时到最后一个），不会展开整个组合空间"""
+        compiled = self.compile_template(template)
+        actions = self.get_actions_for_product("")
+        for assignment in self.combination_space(template, selected_marker_values).iter_from(start, stop):
+            yield self._render_combination(compiled, actions, assignment, selected_marker_values)
+
+    def _render_combination(self, compiled: CompiledTemplate, actions: List[str], assignment: Dict[str, str], selected_marker_values: Optional[Dict[str, str]]) -> Tuple[str, List[Dict[str, Any]]]:
+        selected = dict(selected_marker_values or {}, **assignment)
+        current_product_value = selected.get("产品") or selected.get("产品类型") or self.current_product_type
+        return self._render_with_spans(compiled, actions, actions[0] if actions else "", selected, current_product_value, self._pool)
+
+    def _used_lookup(self, field: str) -> UsedBitset:
+        """字段已用值的位图镜像（与 used_values 列表同步），用于 O(1) 判重与剩余计数"""
+        lookup = self._used_bits.get(field)
+        if lookup is None:
+            lookup = UsedBitset(self.value_library.get(field) or InternedColumn(), self.used_values.get(field, []))
+            self._used_bits[field] = lookup
+        return lookup
+
+    def _pool(self, field: str) -> RemainingPool:
+        """取得用完即删字段的剩余值池（首次访问时构建，之后随标记已用增量维护）"""
+        pool = self._pools.get(field)
+        if pool is None:
+            pool = RemainingPool(self.value_library.get(field, []), self._used_lookup(field), self._weight_map(field))
+            self._pools[field] = pool
+        return pool
+
+    def _drawable_count(self, pool: RemainingPool) -> int:
+        """剩余值池中还能抽取的值个数：随机抽取时不计权重为 0 的值"""
+        return len(pool) if self.matching_mode == "sequential" else pool.live
+
+    def _invalidate_pools(self, field: Optional[str] = None) -> None:
+        """变量库或已用记录整体变化时丢弃剩余值池与已用位图；指定字段时只丢弃该字段"""
+        self._used_version += 1
+        if field is None:
+            self._pools.clear()
+            self._used_bits.clear()
+        else:
+            self._pools.pop(field, None)
+            self._used_bits.pop(field, None)
+
+    def _render_with_spans(self, compiled: CompiledTemplate, actions: List[str], selected_action: str, selected_marker_values: Optional[Dict[str, str]], current_product_value: Optional[str], pool_getter: Callable[[str], RemainingPool]) -> Tuple[str, List[Dict[str, Any]]]:
+        """按编译后的模板渲染一条提示词；pool_getter 返回用完即删字段的剩余值池"""
+        self._count_render(compiled.source)
+        # 本条已从各用完即删字段抽取的值：同一字段多次出现时取互不相同的值，每次出现各消耗一个取值
+        drawn: Dict[str, Set[str]] = {}
         spans: List[Dict[str, Any]] = []
         output_parts: List[str] = []
-        idx = 0
-        for m in re.finditer(r"\{([^}]*)\}", template):
-            start, end = m.span()
-            marker = m.group(1)
+        pos = 0
+        for literal, marker, raw in compiled.segments:
             # 先添加占位符前的文本
-            output_parts.append(template[idx:start])
+            output_parts.append(literal)
+            pos += len(literal)
             # 计算替换值（优先使用外部指定 selected_marker_values）
             if selected_marker_values and marker in selected_marker_values:
                 rep = selected_marker_values[marker]
             elif marker in self.value_library:
                 values = self.value_library.get(marker, [])
                 if not values:
-                    rep = m.group(0)
-                used = set(self.used_values.get(marker, []))
+                    rep = raw
                 
                 # 计算可用池：从所有值中剔除已用值（如果是用完即删字段）
                 # 注意：即使用完即删未开启，随机模式下也尽量避免近期重复（可选优化，但这里严格遵循 delete_on_use_fields）
@@ -221,85 +1438,307 @@ class PromptGenerator:
                 # 修正：只有在 delete_on_use_fields 中时，才从池中剔除。
                 # 但为了防止随机重复，我们也可以维护一个临时已用列表，但目前先严格按用户配置。
                 
-                # 构建可用值池
+                # 用完即删字段：从剩余值池中抽取，抽取与耗尽判断均为 O(1)
                 if marker in self.delete_on_use_fields:
-                    pool = [v for v in values if v not in used]
-                else:
-                    pool = values
-
-                # 如果池为空，处理逻辑
-                if not pool:
-                    if marker in self.delete_on_use_fields:
+                    remaining = pool_getter(marker)
+                    taken = drawn.setdefault(marker, set())
+                    if self._drawable_count(remaining) <= len(taken):
                         raise ValueError(f"字段 '{marker}' 的可用值已耗尽。请在“设置用完即删字段”中清除已用记录，或添加新变量值。")
+                    if self.matching_mode == "sequential":
+                        rep, index = remaining.next_from(self.field_indices.get(marker, 0))
+                        while rep in taken:
+                            rep, index = remaining.next_from(index)
+                        self.field_indices[marker] = index
                     else:
-                        pool = values  # 兜底
-
-                if self.matching_mode == "sequential":
-                    idx_cur = self.field_indices.get(marker, 0)
-                    if idx_cur >= len(pool):
-                        idx_cur = 0
-                    rep = pool[idx_cur]
-                    self.field_indices[marker] = idx_cur + 1
+                        rep = remaining.choice(self.rng)
+                        while rep in taken:
+                            rep = remaining.choice(self.rng)
+                    taken.add(rep)
                 else:
-                    # 真正的随机：从池中随机抽取
-                    rep = random.choice(pool)
+                    pool = values
+                    if self.matching_mode == "sequential":
+                        idx_cur = self.field_indices.get(marker, 0)
+                        if idx_cur >= len(pool):
+                            idx_cur = 0
+                        rep = pool[idx_cur]
+                        self.field_indices[marker] = idx_cur + 1
+                    else:
+                        # 真正的随机：从池中随机抽取；设置了近期窗口的字段避开最近 K 个值
+                        window = self._recency_window(marker) if self.recency_windows else None
+                        rep = self._choose(marker, pool) if window is None else self._choose_recent(marker, pool, window)
 
             elif marker == "产品类型":
                 if current_product_value and str(current_product_value).strip():
                     rep = str(current_product_value).strip()
                 else:
-                    rep = m.group(0)
+                    rep = raw
             elif marker == "动作":
                 if selected_action:
-                    used = set(self.used_values.get("动作", []))
                     if "动作" in self.delete_on_use_fields:
                         # 仅当动作为用完即删时，才剔除已用值
-                        actions_pool = [a for a in actions if a not in used]
-                        if not actions_pool:
+                        actions_pool = pool_getter("动作")
+                        if not self._drawable_count(actions_pool):
                             raise ValueError(f"字段 '动作' 的可用值已耗尽。请在“设置用完即删字段”中清除已用记录，或添加新变量值。")
+                        if selected_action in actions_pool:
+                            rep = selected_action
+                        else:
+                            # 如果选定动作已被用过且需删除，则随机选一个
+                            rep = actions_pool.choice(self.rng) if self.matching_mode == "random" else actions_pool.next_from(0)[0]
                     else:
-                        actions_pool = actions
-
-                    if selected_action in actions_pool:
-                         rep = selected_action
-                    else:
-                        # 如果选定动作已被用过且需删除，则随机选一个
-                        rep = random.choice(actions_pool) if self.matching_mode == "random" else actions_pool[0]
+                        rep = selected_action
                 else:
-                    rep = m.group(0)
+                    rep = raw
             elif marker == "氛围":
                 if (selected_marker_values and selected_marker_values.get("氛围")):
                     rep = selected_marker_values.get("氛围")
                 elif "氛围" in self.value_library:
                     vals = self.value_library.get("氛围", [])
                     if not vals:
-                        rep = m.group(0)
+                        rep = raw
                     else:
-                        used = set(self.used_values.get("氛围", []))
                         if "氛围" in self.delete_on_use_fields:
-                            pool = [v for v in vals if v not in used]
-                            if not pool:
+                            remaining = pool_getter("氛围")
+                            if not self._drawable_count(remaining):
                                 raise ValueError(f"字段 '氛围' 的可用值已耗尽。请在“设置用完即删字段”中清除已用记录，或添加新变量值。")
+                            rep = remaining.choice(self.rng) if self.matching_mode == "random" else remaining.next_from(0)[0]
                         else:
-                            pool = vals
-                        
-                        rep = random.choice(pool) if self.matching_mode == "random" else pool[0]
+                            rep = self.rng.choice(vals) if self.matching_mode == "random" else vals[0]
                 else:
-                    rep = m.group(0)
+                    rep = raw
             else:
-                rep = m.group(0)
+                rep = raw
             # 记录替换片段的区间（基于输出文本的字符位置）
-            replaced_start_pos = sum(len(p) for p in output_parts)
             output_parts.append(rep)
-            replaced_end_pos = replaced_start_pos + len(rep)
-            spans.append({"start": replaced_start_pos, "end": replaced_end_pos, "marker": marker})
-            # 移动模板索引
-            idx = end
+            spans.append({"start": pos, "end": pos + len(rep), "marker": marker})
+            pos += len(rep)
         # 追加模板剩余部分
-        output_parts.append(template[idx:])
+        output_parts.append(compiled.tail)
         text = "".join(output_parts)
         return text, spans
 
+    def generate_batch(self, template_name: Optional[str], count: int, selected_marker_values: Optional[Dict[str, str]] = None, mark_used: bool = True) -> List[Tuple[str, List[Dict[str, Any]]]]:
+        """批量生成 count 条提示词，返回 [(文本, spans), ...]"""
+        return list(self.iter_batch(template_name, count, selected_marker_values, mark_used))
+
+    def iter_batch(self, template_name: Optional[str], count: int, selected_marker_values: Optional[Dict[str, str]] = None, mark_used: bool = True) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+        """逐条产出批量提示词（适合流式写文件）
+        - template_name 为空时使用当前模板，名称不存在时抛出 ValueError
+        - 用完即删字段在同一批次内不会重复出现；每次抽取都从剩余值池 O(1) 完成
+        - mark_used 为 True 时，批次结束（或中途耗尽）后把已产出的值一次性记为已用
+        - 剩余值不足 count 条时在生成任何一条之前抛出 ValueError，不消耗也不记录任何取值
+        """
+        if template_name:
+            template = self.get_template_by_name(template_name)
+            if template is None:
+                raise ValueError(f"模板预设不存在: {template_name}")
+        else:
+            template = self.template
+        capacity = self.remaining_capacity(template, selected_marker_values)
+        if capacity is not None and capacity < int(count):
+            raise ValueError(f"模板最多还能生成 {capacity} 条，不足 {int(count)} 条；请清除已用记录或添加新变量值")
+        return self._iter_template_batch(template, count, selected_marker_values, mark_used)
+
+    def _iter_template_batch(self, template: str, count: int, selected_marker_values: Optional[Dict[str, str]], mark_used: bool) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+        if self.matching_mode == "exhaustive":
+            yield from self._iter_exhaustive_batch(template, count, selected_marker_values)
+            return
+        if self.delete_on_use_fields:
+            self.refresh_used_values()
+        compiled = self.compile_template(template)
+        actions = self.get_actions_for_product("")
+        selected_action = actions[0] if actions else ""
+        current_product_value = None
+        if selected_marker_values:
+            current_product_value = selected_marker_values.get("产品") or selected_marker_values.get("产品类型")
+        if not current_product_value:
+            current_product_value = self.current_product_type
+        delete_fields = set(self.delete_on_use_fields)
+        # 不记录已用时，在剩余值池的副本上消耗，保证批次内不重复且不影响全局状态
+        batch_pools: Dict[str, RemainingPool] = {}
+
+        def pool_getter(field: str) -> RemainingPool:
+            if mark_used:
+                return self._pool(field)
+            pool = batch_pools.get(field)
+            if pool is None:
+                pool = self._pool(field).copy()
+                batch_pools[field] = pool
+            return pool
+
+        used_records: List[Dict[str, Any]] = []
+        try:
+            for _ in range(max(0, int(count))):
+                text, spans = self._render_with_spans(compiled, actions, selected_action, selected_marker_values, current_product_value, pool_getter)
+                if mark_used:
+                    used_records.extend(self._record_used_from_spans(text, spans))
+                else:
+                    for s in spans:
+                        marker = s["marker"]
+                        if marker in delete_fields:
+                            pool_getter(marker).discard(text[s["start"]:s["end"]])
+                yield text, spans
+        finally:
+            self._append_used_journal(used_records)
+
+    def _iter_exhaustive_batch(self, template: str, count: int, selected_marker_values: Optional[Dict[str, str]]) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+        """穷举模式批量生成：从模板游标处依次产生至多 count 个组合，到达最后一个组合即停止（不记为已用）"""
+        total = self.count_combinations(template, selected_marker_values)
+        index = self.combination_indices.get(template, 0)
+        if index >= total:
+            index = 0
+        try:
+            for item in self.iter_combinations(template, index, index + max(0, int(count)), selected_marker_values):
+                index += 1
+                yield item
+        finally:
+            self.combination_indices[template] = index if index < total else 0
+
+    def generate_batch_parallel(self, jobs: List[Tuple[str, int]], workers: Optional[int] = None, seed: Optional[int] = None, selected_marker_values: Optional[Dict[str, Dict[str, str]]] = None, mark_used: bool = True) -> List[Tuple[str, str, List[Dict[str, Any]]]]:
+        """多进程批量生成，返回 [(模板名, 文本, spans), ...]（顺序与 jobs 一致）"""
+        return list(self.iter_batch_parallel(jobs, workers, seed, selected_marker_values, mark_used))
+
+    def iter_batch_parallel(self, jobs: List[Tuple[str, int]], workers: Optional[int] = None, seed: Optional[int] = None, selected_marker_values: Optional[Dict[str, Dict[str, str]]] = None, mark_used: bool = True) -> Iterator[Tuple[str, str, List[Dict[str, Any]]]]:
+        """把大批量任务切分成分片，交给进程池并行渲染
+        - jobs 为 [(模板预设名, 条数), ...]；selected_marker_values 按模板名给出固定值
+        - 按 PARALLEL_SHARD_SIZE 条切分，每个分片使用由 seed 派生的独立随机数流；
+          相同 seed 与变量库下结果可复现，与 workers 数量无关
+        - 用完即删字段的剩余值预先按需求量切分给各分片，不会跨分片重复；剩余值不足时在启动前抛出 ValueError
+        - 顺序模式下各分片从预先计算好的游标处继续，整体结果与单进程顺序一致
+        - 穷举模式下各分片负责连续的组合序号区间，从模板游标处开始，到最后一个组合为止
+        - 全部分片完成后统一把消耗的值记为已用
+        """
+        if seed is None:
+            # 未指定时从生成器自身的随机数流派生，已调用 set_seed 时整批可复现
+            seed = self.rng.getrandbits(32)
+        workers = max(1, workers or os.cpu_count() or 1)
+        selected_marker_values = selected_marker_values or {}
+        sequential = self.matching_mode == "sequential"
+        exhaustive = self.matching_mode == "exhaustive"
+        delete_fields = set(self.delete_on_use_fields)
+        if delete_fields and not exhaustive:
+            self.refresh_used_values()
+        # 穷举模式：各模板的组合游标与组合总数
+        combo_cursors: Dict[str, int] = {}
+        combo_totals: Dict[str, int] = {}
+        master_rng = random.Random(f"{seed}:partition")
+
+        # 1. 切分分片并统计每个分片对各字段的抽取次数
+        shards: List[Dict[str, Any]] = []
+        needed_fields: Set[str] = set()
+        for name, count in jobs:
+            template = self.get_template_by_name(name)
+            if template is None:
+                raise ValueError(f"模板预设不存在: {name}")
+            sel = selected_marker_values.get(name) or None
+            draws: Dict[str, int] = {}
+            for _, marker, _ in self.compile_template(template).segments:
+                if marker in self.value_library and not (sel and marker in sel):
+                    draws[marker] = draws.get(marker, 0) + 1
+            needed_fields.update(draws)
+            count = max(0, int(count))
+            if exhaustive:
+                total = combo_totals[template] = self.count_combinations(template, sel)
+                cursor = combo_cursors.get(template, self.combination_indices.get(template, 0))
+                if cursor >= total:
+                    cursor = 0
+                count = min(count, total - cursor)
+                combo_cursors[template] = cursor + count
+            chunk = self.PARALLEL_SHARD_SIZE
+            for start in range(0, count, chunk):
+                n = min(chunk, count - start)
+                shard = {"name": name, "template": template, "count": n, "selected": sel,
+                         "draws": {f: d * n for f, d in draws.items()}}
+                if exhaustive:
+                    shard["combination_start"] = cursor + start
+                shards.append(shard)
+
+        # 2. 为用完即删字段分配互不重叠的剩余值切片；非删除字段在顺序模式下计算各分片起始游标
+        #    （穷举模式各分片按组合序号区间划分，无需分配）
+        final_indices: Dict[str, int] = {}
+        for field in ([] if exhaustive else sorted(needed_fields)):
+            demands = [s["draws"].get(field, 0) for s in shards]
+            if field in delete_fields:
+                pool = self._pool(field)
+                total = sum(demands)
+                if sequential:
+                    start = self.field_indices.get(field, 0) % max(1, len(pool.order))
+                    remaining = [v for v in pool.order[start:] + pool.order[:start] if v in pool]
+                else:
+                    remaining = [v for v in pool.order if v in pool]
+                    if pool.weights is not None:
+                        # 权重为 0 的值不抽取
+                        remaining = [v for v in remaining if pool.weights.get(v, 1.0) > 0]
+                    if pool.weights is not None and total < len(remaining):
+                        # 按权重无放回地选出本批次要用的值（Efraimidis-Spirakis 键），再打乱分给各分片
+                        keys: Dict[str, float] = {}
+                        for v in remaining:
+                            keys[v] = master_rng.random() ** (1.0 / pool.weights.get(v, 1.0))
+                        remaining = sorted(remaining, key=keys.__getitem__, reverse=True)[:total]
+                    master_rng.shuffle(remaining)
+                if total > len(remaining):
+                    raise ValueError(f"字段 '{field}' 剩余 {len(remaining)} 个可用值，不足以生成本批次（最多需要 {total} 个）。请清除已用记录或添加新变量值。")
+                offset = 0
+                for shard, demand in zip(shards, demands):
+                    if demand:
+                        shard.setdefault("pools", {})[field] = remaining[offset:offset + demand]
+                        offset += demand
+            elif sequential:
+                cursor = self.field_indices.get(field, 0)
+                n = len(self.value_library[field])
+                for shard, demand in zip(shards, demands):
+                    if demand:
+                        shard.setdefault("field_indices", {})[field] = cursor % n
+                        cursor += demand
+                final_indices[field] = cursor % n
+
+        for i, shard in enumerate(shards):
+            shard["seed"] = f"{seed}:{i}"
+            shard.pop("draws")
+
+        # 3. 进程池渲染（变量库只在每个进程初始化时传一次）
+        state = {
+            "value_library": {f: self.value_library[f] for f in needed_fields},
+            "value_weights": {f: self.value_weights[f] for f in needed_fields if f in self.value_weights},
+            "matching_mode": self.matching_mode,
+            "delete_on_use_fields": list(self.delete_on_use_fields),
+            "recency_windows": dict(self.recency_windows),
+            "current_product_type": self.current_product_type,
+        }
+        used_records: List[Dict[str, Any]] = []
+        last_used: Dict[str, str] = {}
+        try:
+            if workers == 1 or len(shards) <= 1:
+                _init_batch_worker(state)
+                results: Iterable[List[Tuple[str, List[Dict[str, Any]]]]] = map(_render_batch_shard, shards)
+                executor = None
+            else:
+                executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker, initargs=(state,))
+                results = executor.map(_render_batch_shard, shards)
+            try:
+                # 4. 合并：按分片顺序产出结果，消耗的值最后一次性记为已用
+                for shard, shard_results in zip(shards, results):
+                    self._count_render(shard["template"], len(shard_results))
+                    for text, spans in shard_results:
+                        for s in spans:
+                            if s["marker"] in delete_fields:
+                                last_used[s["marker"]] = text[s["start"]:s["end"]]
+                        if mark_used and not exhaustive:
+                            used_records.extend(self._record_used_from_spans(text, spans))
+                        yield shard["name"], text, spans
+            finally:
+                if executor is not None:
+                    executor.shutdown(cancel_futures=True)
+        finally:
+            self._append_used_journal(used_records)
+            for template, cursor in combo_cursors.items():
+                self.combination_indices[template] = cursor if cursor < combo_totals[template] else 0
+            if sequential:
+                self.field_indices.update(final_indices)
+                for field, value in last_used.items():
+                    order = self._pool(field).order
+                    if value in order:
+                        self.field_indices[field] = order.index(value) + 1
+
     def generate_preview_with_spans(self, product_type: Optional[str] = None, selected_marker_values: Optional[Dict[str, str]] = None, template_str: Optional[str] = None) -> Tuple[str, List[Dict[str, Any]]]:
         template = template_str if template_str else self.template
         current_product_value = None
@@ -307,13 +1746,13 @@ class PromptGenerator:
             current_product_value = selected_marker_values.get("产品") or selected_marker_values.get("产品类型")
         if not current_product_value:
             current_product_value = product_type or self.current_product_type
+        compiled = self.compile_template(template)
         spans: List[Dict[str, Any]] = []
         output_parts: List[str] = []
-        idx = 0
-        for m in re.finditer(r"\{([^}]*)\}", template):
-            start, end = m.span()
-            marker = m.group(1)
-            output_parts.append(template[idx:start])
+        pos = 0
+        for literal, marker, raw in compiled.segments:
+            output_parts.append(literal)
+            pos += len(literal)
             rep: Optional[str] = None
             if marker in self.value_library:
                 values = self.value_library.get(marker, [])
@@ -324,7 +1763,7 @@ class PromptGenerator:
                             i = 0
                         rep = values[i]
                     else:
-                        rep = random.choice(values)
+                        rep = self._choose(marker, values)
             elif marker in ("产品", "产品类型"):
                 if current_product_value and str(current_product_value).strip():
                     rep = str(current_product_value).strip()
@@ -334,27 +1773,42 @@ class PromptGenerator:
                     if self.matching_mode == "sequential":
                         rep = actions[0]
                     else:
-                        rep = random.choice(actions)
+                        rep = self.rng.choice(actions)
             elif selected_marker_values and marker in selected_marker_values:
                 val = selected_marker_values.get(marker)
                 if val:
                     rep = val
-            replaced_start_pos = sum(len(p) for p in output_parts)
             if rep is None:
-                output_parts.append(m.group(0))
-                replaced_end_pos = replaced_start_pos + len(m.group(0))
+                output_parts.append(raw)
+                pos += len(raw)
             else:
                 output_parts.append(rep)
-                replaced_end_pos = replaced_start_pos + len(rep)
-                spans.append({"start": replaced_start_pos, "end": replaced_end_pos, "marker": marker})
-            idx = end
-        output_parts.append(template[idx:])
+                spans.append({"start": pos, "end": pos + len(rep), "marker": marker})
+                pos += len(rep)
+        output_parts.append(compiled.tail)
         text = "".join(output_parts)
         return text, spans
     
     def extract_markers(self, template: str) -> List[str]:
         """从模板中提取所有标记，如 {产品}、{动作} 等"""
-        return list(set(re.findall(r'\{([^}]*)\}', template)))
+        return list(self.compile_template(template).markers)
+
+    def compile_template(self, template: str) -> CompiledTemplate:
+        """获取模板的编译结果（带缓存，模板内容不变时只解析一次）"""
+        compiled = self._compiled_templates.get(template)
+        if compiled is None:
+            if len(self._compiled_templates) >= self.COMPILED_CACHE_LIMIT:
+                self._compiled_templates.clear()
+            compiled = CompiledTemplate(template)
+            self._compiled_templates[template] = compiled
+        return compiled
+
+    def invalidate_compiled_template(self, template: Optional[str] = None) -> None:
+        """使编译缓存失效；不指定模板时清空全部缓存"""
+        if template is None:
+            self._compiled_templates.clear()
+        else:
+            self._compiled_templates.pop(template, None)
     
     def save_prompt_to_file(self, prompt: str, file_path: str) -> Tuple[bool, str]:
         """保存提示词到文件"""
@@ -366,6 +1820,8 @@ class PromptGenerator:
             return False, f"保存文件失败: {str(e)}"
     
     def set_template(self, template: str) -> None:
+        if self.template != template:
+            self.invalidate_compiled_template(self.template)
         self.template = template
         self.current_template_override = template
         self.save_settings()
@@ -375,7 +1831,7 @@ class PromptGenerator:
         return self.template
 
     def set_matching_mode(self, mode: str) -> None:
-        self.matching_mode = mode if mode in ("random", "sequential") else "random"
+        self.matching_mode = mode if mode in ("random", "sequential", "exhaustive") else "random"
         self.save_settings()
 
     def set_delete_on_use_fields(self, fields: List[str]) -> None:
@@ -383,32 +1839,265 @@ class PromptGenerator:
         self.save_settings()
 
     def get_empty_selected_fields(self) -> List[str]:
+        """没有取值或取值已全部用完的用完即删字段"""
         empty = []
         for f in self.delete_on_use_fields:
-            if not self.value_library.get(f):
+            if not self.value_library.get(f) or self.remaining_values(f) == 0:
                 empty.append(f)
         return empty
 
+    def remaining_values(self, field: str) -> int:
+        """用完即删字段中尚未用过的取值个数（由已用位图的计数直接得出，O(1)；先合并其他进程的记录）"""
+        self.refresh_used_values()
+        return self._used_lookup(field).remaining
+
+    def available_values(self, field: str) -> int:
+        """用完即删字段还能抽取的取值个数：随机模式下不计权重为 0 的值（“0 表示不抽取”），其余同 remaining_values"""
+        if self.matching_mode == "random" and field in self.value_weights:
+            self.refresh_used_values()
+            return self._pool(field).live
+        return self.remaining_values(field)
+
+    def unused_values(self, field: str) -> List[str]:
+        """字段中尚未用过的取值（按变量库顺序）；启用 SQLite 存储时为一次数据库索引查询"""
+        if self._store is not None:
+            self.refresh_used_values()
+            try:
+                return self._store.unused_values(field)
+            except Exception:
+                pass
+        column = self.value_library.get(field)
+        if column is None:
+            return []
+        used = self._used_lookup(field)
+        return [v for i, v in enumerate(column.table) if not used.has_index(i)]
+
+    def remaining_capacity(self, template: str, selected_marker_values: Optional[Dict[str, str]] = None) -> Optional[int]:
+        """模板在任一用完即删字段耗尽前至少还能生成多少条提示词（假设每条生成后都记为已用）
+        同一字段在模板中出现 k 次时每条抽取 k 个互不相同的取值，因此按 floor(可抽取的剩余 / k) 取各字段最小值；
+        返回 None 表示不受限（模板不含用完即删字段，或为穷举模式）。
+        """
+        occurrences = self.draw_demand(template, selected_marker_values)
+        if not occurrences:
+            return None
+        return min(self.available_values(marker) // k for marker, k in occurrences.items())
+
+    def draw_demand(self, template: str, selected_marker_values: Optional[Dict[str, str]] = None) -> Dict[str, int]:
+        """模板每生成一条要从各用完即删字段抽取的取值个数 {字段: k}；已指定取值的字段与穷举模式不计入"""
+        if self.matching_mode == "exhaustive":
+            return {}
+        self.refresh_used_values()
+        compiled = self.compile_template(template)
+        occurrences: Dict[str, int] = {}
+        for _, marker, _ in compiled.segments:
+            if marker in self.delete_on_use_fields and marker in self.value_library:
+                if not (selected_marker_values and marker in selected_marker_values):
+                    occurrences[marker] = occurrences.get(marker, 0) + 1
+        return occurrences
+
     def load_template_presets(self) -> None:
+        self.flush()
+        self.invalidate_compiled_template()
+        self._load_template_history()
         try:
-            if os.path.exists(self.templates_file):
+            if self._store is not None:
+                self.template_presets = self._store.load_templates()
+            elif os.path.exists(self.templates_file):
                 with open(self.templates_file, "r", encoding="utf-8") as fp:
                     self.template_presets = json.load(fp) or []
             if not self.template_presets:
                 self.template_presets = [{"name": "默认模板", "template": self.DEFAULT_TEMPLATE, "time": datetime.now().isoformat()}]
         except Exception:
             self.template_presets = [{"name": "默认模板", "template": self.DEFAULT_TEMPLATE, "time": datetime.now().isoformat()}]
+        self._sync_template_versions()
 
-    def save_template_preset(self, name: str, template: str) -> None:
-        preset = {"name": name, "template": template, "time": datetime.now().isoformat()}
-        self.template_presets.append(preset)
+    @property
+    def templates_history_file(self) -> str:
+        """模板版本记录（每行一条 JSON，只追加），与 templates.json 同目录"""
+        return os.path.splitext(self.templates_file)[0] + ".versions.log"
+
+    @property
+    def templates_renders_file(self) -> str:
+        """各模板版本的渲染次数"""
+        return os.path.splitext(self.templates_file)[0] + ".renders.json"
+
+    @property
+    def templates_lock_file(self) -> str:
+        """多个程序实例共享数据目录时，追加模板版本记录前加锁的文件（保证记录 id 不重复）"""
+        if self._store is not None:
+            return os.path.splitext(self.store_file)[0] + ".templates.lock"
+        return os.path.splitext(self.templates_file)[0] + ".lock"
+
+    def _read_template_history_log(self, offset: int) -> Tuple[List[Dict[str, Any]], int]:
+        """从 offset 处读取版本记录日志，返回 (记录, 已读取的字节数)；末尾不完整的行留到下次读取"""
+        records: List[Dict[str, Any]] = []
+        path = self.templates_history_file
+        if not os.path.exists(path):
+            return records, 0
+        if os.path.getsize(path) < offset:
+            # 日志被替换过，重新读取（已有的记录按 id 去重）
+            offset = 0
+        with open(path, "rb") as fp:
+            fp.seek(offset)
+            for line in fp:
+                if not line.endswith(b"\n"):
+                    break
+                offset += len(line)
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # 写入中断留下的半行，跳过
+                    continue
+        return records, offset
+
+    def _load_template_history(self) -> None:
+        records: List[Dict[str, Any]] = []
+        counts: Dict[int, int] = {}
+        self._template_history_offset = 0
+        try:
+            if self._store is not None:
+                records, counts = self._store.load_template_history()
+            else:
+                records, self._template_history_offset = self._read_template_history_log(0)
+                if os.path.exists(self.templates_renders_file):
+                    with open(self.templates_renders_file, "r", encoding="utf-8") as fp:
+                        counts = {int(k): int(v) for k, v in (json.load(fp) or {}).items()}
+        except Exception:
+            pass
+        # 损坏的记录（如缺少父版本）单独跳过；templates.json 保存了各预设的全文，不会因此丢失预设
+        self._template_history = TemplateHistory(records)
+        self._template_history.render_counts = counts
+        self._render_pending = {}
+        self._render_pending_total = 0
+
+    @contextmanager
+    def _template_history_lock(self) -> Iterator[None]:
+        """持有模板版本记录的跨进程锁，并先合并其他程序实例追加的记录，之后分配的记录 id 不会与它们重复"""
+        with file_lock(self.templates_lock_file):
+            try:
+                if self._store is not None:
+                    records = self._store.template_history_after(self._template_history.last_id)
+                else:
+                    records, self._template_history_offset = self._read_template_history_log(self._template_history_offset)
+                self._template_history.add(records)
+            except Exception:
+                pass
+            yield
+
+    def _sync_template_versions(self) -> None:
+        """确定每个预设的版本：只引用版本的预设（旧版 templates.json）从历史中取出全文；
+        带全文且与最新版本不同的预设（旧格式文件、外部修改）追加为新版本。同名的后续预设不参与版本记录
+        """
+        with self._template_history_lock():
+            history = self._template_history
+            records: List[Dict[str, Any]] = []
+            seen: Set[str] = set()
+            for p in self.template_presets:
+                name = str(p.get("name", ""))
+                if p.get("template") is None:
+                    p["template"] = history.checkout(name) or ""
+                if name in seen:
+                    continue
+                seen.add(name)
+                record = history.commit(name, p["template"], p.get("time"))
+                if record is not None:
+                    records.append(record)
+                p["version"] = len(history.versions.get(name, []))
+            self._append_template_history(records)
+
+    def _append_template_history(self, records: List[Dict[str, Any]]) -> None:
+        """持久化新的版本记录（须持有模板锁）：只追加，不重写已有记录"""
+        if not records:
+            return
         try:
-            with open(self.templates_file, "w", encoding="utf-8") as fp:
-                json.dump(self.template_presets, fp, ensure_ascii=False, indent=2)
+            if self._store is not None:
+                self._store.append_template_history(records)
+            else:
+                with open(self.templates_history_file, "ab") as fp:
+                    if fp.tell() > self._template_history_offset:
+                        # 末尾是写入中断留下的半行，另起一行
+                        fp.write(b"\n")
+                    fp.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records).encode("utf-8"))
+                    self._template_history_offset = fp.tell()
         except Exception:
             pass
+
+    def _commit_template_version(self, name: str, template: str, time: Optional[str] = None) -> int:
+        """为预设记录一个新版本（与最新版本相同时不记录），返回其当前版本号"""
+        with self._template_history_lock():
+            record = self._template_history.commit(name, template, time)
+            if record is not None:
+                self._append_template_history([record])
+            return len(self._template_history.versions.get(name, []))
+
+    def _save_template_presets(self) -> None:
+        """保存模板预设：SQLite 存储只写入变化的行；JSON 存储时 templates.json 仍保存每个预设的全文，
+        每次保存整体重写（预设数量很多时写入量随之增长）。只有 templates.versions.log 中的历史版本按差异存储。
+        """
+        if self._store is not None:
+            try:
+                self._store.save_templates(self.template_presets)
+            except Exception:
+                pass
+            return
+        # 有意保存各预设的全文与版本号而非只存版本引用：版本记录日志损坏时预设本身不受影响
+        data = [{"name": p.get("name"), "template": p.get("template"), "version": p.get("version"), "time": p.get("time")} for p in self.template_presets]
+        self._writer.schedule(self.templates_file, data)
+
+    def save_template_preset(self, name: str, template: str) -> None:
+        """保存为新预设；同名预设已存在时作为它的新版本保存"""
+        if self.preset_name_exists(name):
+            self.update_template_preset(name, template)
+            return
+        now = datetime.now().isoformat()
+        preset = {"name": name, "template": template, "time": now, "version": self._commit_template_version(name, template, now)}
+        self.template_presets.append(preset)
+        self._save_template_presets()
         self.save_settings(current_preset=name)
 
+    def template_versions(self, name: str) -> List[Dict[str, Any]]:
+        """预设的版本列表（从旧到新）：version、time、kind（full / delta）、stored_size（存储的字符数）、renders（渲染次数）"""
+        return self._template_history.describe(name)
+
+    def checkout_template_version(self, name: str, version: Optional[int] = None) -> Optional[str]:
+        """取出预设某个版本的全文（省略 version 为最新版本）"""
+        return self._template_history.checkout(name, version)
+
+    def restore_template_version(self, name: str, version: int) -> bool:
+        """把预设恢复为某个历史版本的内容（记录为一个新版本）"""
+        text = self.checkout_template_version(name, version)
+        if text is None:
+            return False
+        return self.update_template_preset(name, text)
+
+    def _count_render(self, template: str, n: int = 1) -> None:
+        """模板为某个预设的最新版本时累加其渲染次数，每累计 RENDER_COUNT_SAVE_EVERY 次保存一次"""
+        history = self._template_history
+        if history is None:
+            return
+        rid = history.count_render(template, n)
+        if rid is None:
+            return
+        self._render_pending[rid] = self._render_pending.get(rid, 0) + n
+        self._render_pending_total += n
+        if self._render_pending_total >= self.RENDER_COUNT_SAVE_EVERY:
+            self._save_render_counts()
+
+    def _save_render_counts(self) -> None:
+        if not self._render_pending:
+            return
+        pending = self._render_pending
+        self._render_pending = {}
+        self._render_pending_total = 0
+        if self._store is not None:
+            # 数据库按增量累加，多个程序实例的计数不会互相覆盖
+            try:
+                self._store.add_render_counts(pending)
+            except Exception:
+                pass
+            return
+        self._writer.schedule(self.templates_renders_file, {str(k): v for k, v in self._template_history.render_counts.items()})
+
     def list_template_names(self) -> List[str]:
         return [p.get("name", "") for p in self.template_presets]
 
@@ -438,16 +2127,14 @@ class PromptGenerator:
         updated = False
         for p in self.template_presets:
             if p.get("name") == name:
+                self.invalidate_compiled_template(p.get("template"))
                 p["template"] = template
                 p["time"] = datetime.now().isoformat()
+                p["version"] = self._commit_template_version(name, template, p["time"])
                 updated = True
                 break
         if updated:
-            try:
-                with open(self.templates_file, "w", encoding="utf-8") as fp:
-                    json.dump(self.template_presets, fp, ensure_ascii=False, indent=2)
-            except Exception:
-                pass
+            self._save_template_presets()
             self.set_current_preset(name)
         return updated
 
@@ -465,6 +2152,58 @@ class PromptGenerator:
             self.load_used_values()
         self.save_settings()
 
+    def enable_sqlite_store(self) -> Tuple[bool, str]:
+        """启用 SQLite 存储：在数据目录创建 prompt.sqlite3，并导入当前的设置、模板预设、变量库取值与已用记录
+        之后启动时自动使用数据库；原 JSON 文件保留不动，可用 export_json_files 重新导出
+        """
+        if self._store is not None:
+            return True, f"已在使用 SQLite 存储: {self.store_file}"
+        self.flush()
+        if not self._open_store():
+            return False, f"无法创建 SQLite 存储: {self.store_file}"
+        try:
+            if not self._store.is_empty():
+                # 数据库中已有数据（之前启用过）：以数据库为准重新读取
+                self.load_settings()
+                self.load_template_presets()
+                self.load_used_values()
+                self._sync_store_library()
+                return True, f"已切换到现有的 SQLite 存储: {self.store_file}"
+            self._store.save_settings(self._settings_data(self.current_preset_name))
+            self._store.save_templates(self.template_presets)
+            history = self._template_history
+            self._store.append_template_history([history.records[i] for i in sorted(history.records)])
+            self._store.add_render_counts(dict(history.render_counts))
+            self._sync_store_library()
+            with self._used_values_lock():
+                records = [{"field": field, "value": v} for field, values in self.used_values.items() for v in values]
+                # 尚未解码的已用记录（变量库未加载，或当前变量库中没有的值）按内容哈希导入
+                for field, record in self._encoded_used.items():
+                    digests = list(record.get("digests") or []) + list(record.get("unresolved") or [])
+                    records.extend({"field": field, "digest": d} for d in dict.fromkeys(digests))
+                self._store_event_id = self._store.append_usage(records)
+        except Exception as e:
+            self._store.close()
+            self._store = None
+            try:
+                os.remove(self.store_file)
+            except OSError:
+                pass
+            return False, f"导入 SQLite 存储失败: {str(e)}"
+        return True, f"已启用 SQLite 存储: {self.store_file}"
+
+    def export_json_files(self, directory: Optional[str] = None) -> Tuple[bool, str]:
+        """把当前的设置、模板预设与已用记录导出为 settings.json / templates.json / used_values.json（默认导出到数据目录）"""
+        directory = directory or self.data_dir
+        try:
+            self.refresh_used_values()
+            write_json_atomic(os.path.join(directory, "settings.json"), self._settings_data(self.current_preset_name))
+            write_json_atomic(os.path.join(directory, "templates.json"), [dict(p) for p in self.template_presets])
+            write_json_atomic(os.path.join(directory, "used_values.json"), self._encode_used_values(), indent=None)
+        except Exception as e:
+            return False, f"导出失败: {str(e)}"
+        return True, f"已导出到: {directory}"
+
     def delete_template_preset(self, name: str) -> bool:
         idx = None
         for i, p in enumerate(self.template_presets):
@@ -473,21 +2212,20 @@ class PromptGenerator:
                 break
         if idx is None:
             return False
-        self.template_presets.pop(idx)
-        try:
-            with open(self.templates_file, "w", encoding="utf-8") as fp:
-                json.dump(self.template_presets, fp, ensure_ascii=False, indent=2)
-        except Exception:
-            pass
+        removed = self.template_presets.pop(idx)
+        self.invalidate_compiled_template(removed.get("template"))
+        self._save_template_presets()
         return True
 
     def load_settings(self) -> None:
+        self.flush()
         try:
-            if os.path.exists(self.settings_file):
-                with open(self.settings_file, "r", encoding="utf-8") as fp:
-                    data = json.load(fp)
+            data = self._read_settings_data()
+            if data:
                 self.matching_mode = data.get("matching_mode", self.matching_mode)
                 self.delete_on_use_fields = data.get("delete_on_use_fields", self.delete_on_use_fields)
+                self.recency_windows = data.get("recency_windows", self.recency_windows) or {}
+                self._recent.clear()
                 current_preset = data.get("current_preset")
                 self.current_template_override = data.get("current_template_override", self.current_template_override)
                 self.current_preset_name = current_preset
@@ -512,6 +2250,9 @@ class PromptGenerator:
                 self.current_product_type = data.get("current_product_type", self.current_product_type)
                 self.result_font_size = int(data.get("result_font_size", self.result_font_size))
                 self.last_library_path = data.get("last_library_path", self.last_library_path)
+                self.library_paths = list(data.get("library_paths") or [])
+                if data.get("library_merge_mode") in ("merge", "namespace"):
+                    self.library_merge_mode = data["library_merge_mode"]
                 self.selected_custom_param = data.get("selected_custom_param", self.selected_custom_param)
                 self.selected_custom_value = data.get("selected_custom_value", self.selected_custom_value)
                 self.custom_params_map = data.get("custom_params_map", self.custom_params_map) or {}
@@ -520,16 +2261,43 @@ class PromptGenerator:
         except Exception:
             pass
 
+    def _read_settings_data(self) -> Optional[Dict[str, Any]]:
+        if self._store is not None:
+            return self._store.load_settings()
+        if os.path.exists(self.settings_file):
+            with open(self.settings_file, "r", encoding="utf-8") as fp:
+                return json.load(fp)
+        return None
+
     def save_settings(self, current_preset: Optional[str] = None) -> None:
+        data = self._settings_data(current_preset)
+        if self._store is not None:
+            # SQLite 存储只写入变化的键，为一个小事务，直接写入
+            try:
+                self._store.save_settings(data)
+            except Exception:
+                pass
+            return
+        # 延迟合并写入：短时间内的多次保存只落盘最后一次
+        self._writer.schedule(self.settings_file, data)
+        default_settings_path = os.path.join(self.data_dir, "settings.json")
+        if os.path.abspath(default_settings_path) != os.path.abspath(self.settings_file):
+            self._writer.schedule(default_settings_path, data)
+
+    def _settings_data(self, current_preset: Optional[str] = None) -> Dict[str, Any]:
+        """当前设置的快照：列表与字典均为副本，延迟写入线程序列化时不受其他线程后续修改的影响"""
         data = {
             "matching_mode": self.matching_mode,
-            "delete_on_use_fields": self.delete_on_use_fields,
+            "delete_on_use_fields": list(self.delete_on_use_fields),
+            "recency_windows": dict(self.recency_windows),
             "current_product_type": self.current_product_type,
             "result_font_size": self.result_font_size,
             "last_library_path": self.last_library_path,
+            "library_paths": list(self.library_paths),
+            "library_merge_mode": self.library_merge_mode,
             "selected_custom_param": self.selected_custom_param,
             "selected_custom_value": self.selected_custom_value,
-            "custom_params_map": self.custom_params_map,
+            "custom_params_map": dict(self.custom_params_map),
             "current_template_override": self.current_template_override,
             "last_preset_1": self.last_preset_1,
             "last_preset_2": self.last_preset_2,
@@ -541,18 +2309,7 @@ class PromptGenerator:
         }
         if current_preset:
             data["current_preset"] = current_preset
-        try:
-            with open(self.settings_file, "w", encoding="utf-8") as fp:
-                json.dump(data, fp, ensure_ascii=False, indent=2)
-            default_settings_path = os.path.join(self.data_dir, "settings.json")
-            if os.path.abspath(default_settings_path) != os.path.abspath(self.settings_file):
-                try:
-                    with open(default_settings_path, "w", encoding="utf-8") as fp2:
-                        json.dump(data, fp2, ensure_ascii=False, indent=2)
-                except Exception:
-                    pass
-        except Exception:
-            pass
+        return data
 
     def set_current_product_type(self, value: Optional[str]) -> None:
         self.current_product_type = value
@@ -581,24 +2338,358 @@ class PromptGenerator:
             return self.last_preset_2
         return "默认模板"
 
+    @property
+    def used_values_journal_file(self) -> str:
+        """已用记录的追加日志（每行一条 JSON 记录），与快照文件同目录"""
+        return os.path.splitext(self.used_values_file)[0] + ".log"
+
+    @property
+    def used_values_history_file(self) -> str:
+        """压缩时归档的历史日志，作为“何时用了哪个值”的审计记录"""
+        return os.path.splitext(self.used_values_file)[0] + ".history.log"
+
+    @property
+    def used_values_lock_file(self) -> str:
+        """多个程序实例共享同一数据目录时，读写已用记录前加锁的文件"""
+        return os.path.splitext(self.used_values_file)[0] + ".lock"
+
+    @contextmanager
+    def _used_values_lock(self) -> Iterator[None]:
+        """持有已用记录的跨进程锁，并先合并其他进程写入的记录
+        同一线程内可重入；其他线程（如界面主线程与后台线程）在此等待，不会在持有期间修改已用记录
+        """
+        if self._used_sync_disabled:
+            yield
+            return
+        with self._used_rlock:
+            if getattr(self._used_lock_local, "held", False):
+                yield
+                return
+            with file_lock(self.used_values_lock_file):
+                self._used_lock_local.held = True
+                try:
+                    self._merge_used_journal()
+                    yield
+                finally:
+                    self._used_lock_local.held = False
+
     def load_used_values(self) -> None:
+        """读取快照文件，再按顺序重放追加日志"""
+        self.flush()
+        with self._used_values_lock():
+            self._load_used_values_locked()
+
+    def _load_used_values_locked(self) -> None:
+        self._invalidate_pools()
+        if self._store is not None:
+            self._encoded_used = {}
+            self._journal_entries = 0
+            try:
+                self.used_values, self._store_event_id = self._store.load_used()
+                self._encoded_used = {field: {"unresolved": digests} for field, digests in self._store.unresolved_used().items()}
+            except Exception:
+                self.used_values = {}
+            self._resolve_used_values()
+            return
+        self._snapshot_key = _file_key(self.used_values_file)
         try:
             if os.path.exists(self.used_values_file):
                 with open(self.used_values_file, "r", encoding="utf-8") as fp:
-                    self.used_values = json.load(fp) or {}
+                    self.used_values, self._encoded_used = self._split_used_snapshot(json.load(fp) or {})
+            else:
+                self.used_values, self._encoded_used = {}, {}
         except Exception:
-            self.used_values = {}
+            self.used_values, self._encoded_used = {}, {}
+        self._journal_entries, self._journal_offset = self._replay_used_journal()
+        self._resolve_used_values()
+
+    def _merge_used_journal(self) -> None:
+        """合并其他进程写入的已用记录（须持有锁）：快照被其他进程压缩过时整体重新加载，否则只读取日志新增的部分"""
+        if self._store is not None:
+            self._merge_store_events()
+            return
+        if _file_key(self.used_values_file) != self._snapshot_key:
+            self._load_used_values_locked()
+            return
+        path = self.used_values_journal_file
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            size = 0
+        if size == self._journal_offset:
+            return
+        if size < self._journal_offset:
+            self._load_used_values_locked()
+            return
+        try:
+            with open(path, "rb") as fp:
+                fp.seek(self._journal_offset)
+                data = fp.read()
+        except OSError:
+            return
+        # 只处理完整的行，正在写入的半行留到下次
+        end = data.rfind(b"\n") + 1
+        self._journal_offset += end
+        for line in data[:end].splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            field = record.get("field")
+            if not field:
+                continue
+            self._journal_entries += 1
+            if record.get("op") == "clear":
+                self._clear_used_in_memory(field)
+            elif record.get("value"):
+                self._add_used(field, record["value"])
+        self._used_version += 1
+
+    def _merge_store_events(self) -> None:
+        """合并 SQLite 存储中其他进程新写入的已用事件"""
+        try:
+            events = self._store.events_after(self._store_event_id)
+        except Exception:
+            return
+        for event in events:
+            self._store_event_id = event["id"]
+            if event["op"] == "clear":
+                self._clear_used_in_memory(event["field"])
+            elif event["value"]:
+                self._add_used(event["field"], event["value"])
+        if events:
+            self._used_version += 1
+
+    def refresh_used_values(self) -> None:
+        """若其他进程修改过已用记录（日志或快照的大小、修改时间变化），加锁合并；未变化时只需两次 stat"""
+        if self._used_sync_disabled or getattr(self._used_lock_local, "held", False):
+            return
+        if self._store is not None:
+            try:
+                if self._store.last_event_id() == self._store_event_id:
+                    return
+            except Exception:
+                return
+            with self._used_values_lock():
+                pass
+            return
+        try:
+            size = os.path.getsize(self.used_values_journal_file)
+        except OSError:
+            size = 0
+        if size == self._journal_offset and _file_key(self.used_values_file) == self._snapshot_key:
+            return
+        with self._used_values_lock():
+            pass
+
+    @classmethod
+    def _split_used_snapshot(cls, data: Any) -> Tuple[Dict[str, List[str]], Dict[str, Dict[str, Any]]]:
+        """解析快照：返回 (以文本保存的已用值, 以下标保存待解码的记录)；兼容旧版 {字段: [值, ...]} 格式"""
+        used: Dict[str, List[str]] = {}
+        encoded: Dict[str, Dict[str, Any]] = {}
+        if isinstance(data, dict) and data.get("version") == cls.USED_VALUES_FORMAT_VERSION:
+            for field, record in (data.get("fields") or {}).items():
+                if not isinstance(record, dict):
+                    continue
+                used[field] = [v for v in record.get("values") or [] if isinstance(v, str)]
+                if record.get("indices") or record.get("unresolved"):
+                    encoded[field] = {k: record[k] for k in ("table_sha1", "indices", "digests", "unresolved") if k in record}
+        elif isinstance(data, dict):
+            used = {k: list(v) for k, v in data.items() if isinstance(v, list)}
+        return used, encoded
+
+    @staticmethod
+    def _decode_used_record(record: Dict[str, Any], column: InternedColumn) -> Tuple[List[str], List[str]]:
+        """返回 (解码出的已用值, 当前变量库中找不到的取值哈希)"""
+        table = column.table
+        indices = record.get("indices") or []
+        wanted = list(record.get("unresolved") or [])
+        decoded: List[str] = []
+        if record.get("table_sha1") == column.digest():
+            decoded = [table[i] for i in indices if isinstance(i, int) and 0 <= i < len(table)]
+        else:
+            # 变量库已变化：按取值哈希重新定位
+            wanted = list(record.get("digests") or []) + wanted
+        if not wanted:
+            return decoded, []
+        wanted_set = set(wanted)
+        by_digest: Dict[str, str] = {}
+        for v in table:
+            d = _value_digest(v)
+            if d in wanted_set:
+                by_digest.setdefault(d, v)
+        decoded.extend(by_digest[d] for d in wanted if d in by_digest)
+        # 当前变量库中没有的值（可能只是加载了另一个版本的变量库）保留哈希，换回原变量库时仍计为已用
+        return decoded, list(dict.fromkeys(d for d in wanted if d not in by_digest))
+
+    def _resolve_used_values(self) -> None:
+        """用当前变量库解码暂存的下标记录，并让已用值与变量库共享同一字符串对象（不重复占用内存）"""
+        for field in list(self._encoded_used):
+            column = self.value_library.get(field)
+            if column is None:
+                continue
+            decoded, unresolved = self._decode_used_record(self._encoded_used.pop(field), column)
+            if unresolved:
+                self._encoded_used[field] = {"unresolved": unresolved}
+            self.used_values[field] = list(dict.fromkeys(decoded + self.used_values.get(field, [])))
+            self._invalidate_pools(field)
+        for field, values in self.used_values.items():
+            column = self.value_library.get(field)
+            if column is None or not values:
+                continue
+            table = column.table
+            index = column.index_map()
+            for n, v in enumerate(values):
+                i = index.get(v)
+                if i is not None:
+                    values[n] = table[i]
+
+    def _encode_used_values(self) -> Dict[str, Any]:
+        """生成快照：变量库中存在的值保存为 table 下标及其短哈希，其余（变量库未加载或已删除的值）保存原文"""
+        fields: Dict[str, Dict[str, Any]] = {}
+        for field, values in self.used_values.items():
+            pending = self._encoded_used.get(field) or {}
+            record: Dict[str, Any] = dict(pending)
+            column = self.value_library.get(field)
+            texts: List[str] = []
+            if column is not None:
+                index = column.index_map()
+                indices: List[int] = []
+                digests: List[str] = []
+                for v in values:
+                    i = index.get(v)
+                    if i is None:
+                        texts.append(v)
+                    else:
+                        indices.append(i)
+                        digests.append(_value_digest(v))
+                if indices:
+                    record = {"table_sha1": column.digest(), "indices": indices, "digests": digests}
+                    if pending.get("unresolved"):
+                        record["unresolved"] = list(pending["unresolved"])
+            else:
+                texts = list(values)
+            if texts:
+                record["values"] = texts
+            fields[field] = record
+        for field, record in self._encoded_used.items():
+            fields.setdefault(field, dict(record))
+        return {"version": self.USED_VALUES_FORMAT_VERSION, "fields": fields}
+
+    def _replay_used_journal(self) -> Tuple[int, int]:
+        """重放日志，返回 (记录条数, 已读取的字节数)"""
+        path = self.used_values_journal_file
+        if not os.path.exists(path):
+            return 0, 0
+        count = 0
+        offset = 0
+        lookups: Dict[str, Set[str]] = {}
+        try:
+            with open(path, "rb") as fp:
+                for line in fp:
+                    if not line.endswith(b"\n"):
+                        # 其他进程正在写入的半行，留到下次合并
+                        break
+                    offset += len(line)
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # 写入中断留下的半行，跳过
+                        continue
+                    field = record.get("field")
+                    if not field:
+                        continue
+                    count += 1
+                    if record.get("op") == "clear":
+                        self.used_values[field] = []
+                        self._encoded_used.pop(field, None)
+                        lookups[field] = set()
+                        continue
+                    value = record.get("value")
+                    seen = lookups.get(field)
+                    if seen is None:
+                        seen = set(self.used_values.get(field, []))
+                        lookups[field] = seen
+                    if value and value not in seen:
+                        seen.add(value)
+                        self.used_values.setdefault(field, []).append(value)
+        except Exception:
+            pass
+        return count, offset
+
+    def _append_used_journal(self, records: List[Dict[str, Any]]) -> None:
+        """把已用记录追加到日志末尾（与历史总量无关的 O(1) 写入），日志过长时压缩为快照"""
+        if not records:
+            return
+        self._used_version += 1
+        try:
+            with self._used_values_lock():
+                # 加锁时若因其他进程压缩而重新加载了快照，本批尚未写入的记录需在内存中重新应用
+                for r in records:
+                    if r.get("op") == "clear":
+                        self._clear_used_in_memory(r["field"])
+                    else:
+                        self._add_used(r["field"], r["value"])
+                if self._store is not None:
+                    self._store_event_id = self._store.append_usage(records)
+                    return
+                with open(self.used_values_journal_file, "ab") as fp:
+                    fp.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records).encode("utf-8"))
+                    self._journal_offset = fp.tell()
+            self._journal_entries += len(records)
+        except Exception:
+            # 日志不可写时退回整文件保存
+            self.save_used_values()
+            return
+        if self._journal_entries >= self.USED_JOURNAL_COMPACT_THRESHOLD:
+            self.save_used_values()
 
     def save_used_values(self) -> None:
+        """压缩：先合并其他进程的记录，再写入完整快照，然后把日志归档到历史文件并清空（全程持有锁）
+        启用 SQLite 存储时每条记录已在写入时提交，无需压缩
+        """
+        if self._store is not None:
+            return
+        with self._used_values_lock():
+            self._save_used_values_locked()
+
+    def _save_used_values_locked(self) -> None:
         try:
-            with open(self.used_values_file, "w", encoding="utf-8") as fp:
-                json.dump(self.used_values, fp, ensure_ascii=False, indent=2)
+            write_json_atomic(self.used_values_file, self._encode_used_values(), indent=None)
+        except Exception:
+            return
+        self._snapshot_key = _file_key(self.used_values_file)
+        journal = self.used_values_journal_file
+        try:
+            if os.path.exists(journal):
+                with open(journal, "r", encoding="utf-8") as src, open(self.used_values_history_file, "a", encoding="utf-8") as dst:
+                    shutil.copyfileobj(src, dst)
+                os.remove(journal)
         except Exception:
             pass
+        self._journal_entries = 0
+        self._journal_offset = 0
+
+    def flush(self) -> None:
+        """把延迟写入队列中尚未落盘的设置与模板立即写入文件"""
+        self._save_render_counts()
+        self._writer.flush()
+
     def set_last_library_path(self, path: Optional[str]) -> None:
-        self.last_library_path = path
+        self.set_library_paths([path] if path else [])
+
+    def set_library_paths(self, paths: List[str]) -> None:
+        """记录启动时自动加载的变量库文件（last_library_path 为其中第一个，兼容旧设置）"""
+        self.library_paths = list(paths)
+        self.last_library_path = self.library_paths[0] if self.library_paths else None
         self.save_settings()
 
+    def get_library_paths(self) -> List[str]:
+        """启动时自动加载的变量库文件；旧设置只有 last_library_path"""
+        if self.library_paths:
+            return list(self.library_paths)
+        return [self.last_library_path] if self.last_library_path else []
+
     def set_selected_custom_param(self, name: Optional[str], value: Optional[str]) -> None:
         self.selected_custom_param = name
         self.selected_custom_value = value
@@ -608,18 +2699,228 @@ class PromptGenerator:
         self.custom_params_map = dict(m or {})
         self.save_settings()
 
+    def _record_used_from_spans(self, text: str, spans: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """把 spans 中用完即删字段的值记入 used_values（不落盘），返回新增值对应的日志记录"""
+        records: List[Dict[str, Any]] = []
+        ts = datetime.now().isoformat(timespec="seconds")
+        for s in spans:
+            marker = s.get("marker")
+            if marker in self.delete_on_use_fields:
+                start = int(s.get("start", 0))
+                end = int(s.get("end", start))
+                val = text[start:end]
+                column = self.value_library.get(marker)
+                if column is not None:
+                    # 与变量库共享同一字符串对象
+                    i = column.index_of(val)
+                    if i is not None:
+                        val = column.table[i]
+                if val and self._add_used(marker, val):
+                    records.append({"field": marker, "value": val, "ts": ts})
+        return records
+
+    def new_session(self, seed: Optional[int] = None, template: Optional[str] = None, product_type: Optional[str] = None) -> "GenerationSession":
+        """创建独立的生成会话（游标、随机数、已用缓冲互不干扰），见 GenerationSession"""
+        return GenerationSession(self, seed, template, product_type)
+
+    def _add_used(self, field: str, value: str) -> bool:
+        """把一个值记为已用（同步已用位图与剩余值池），返回是否为新增"""
+        if not self._used_lookup(field).add(value):
+            return False
+        self.used_values.setdefault(field, []).append(value)
+        pool = self._pools.get(field)
+        if pool is not None:
+            pool.discard(value)
+        return True
+
     def mark_used_from_spans(self, text: str, spans: List[Dict[str, Any]]) -> None:
         try:
+            with self._used_values_lock():
+                self._append_used_journal(self._record_used_from_spans(text, spans))
+        except Exception:
+            pass
+
+    def claim_used_from_spans(self, text: str, spans: List[Dict[str, Any]]) -> int:
+        """与 mark_used_from_spans 相同，但在锁内先检查冲突：其中有值已被记为已用（其他调用方或程序实例抢先使用）时
+        整体不记录并抛出 ValueError；返回新记为已用的值个数
+        """
+        with self._used_values_lock():
+            conflicts = []
             for s in spans:
                 marker = s.get("marker")
                 if marker in self.delete_on_use_fields:
                     start = int(s.get("start", 0))
-                    end = int(s.get("end", start))
-                    val = text[start:end]
-                    arr = self.used_values.get(marker, [])
-                    if val and val not in arr:
-                        arr.append(val)
-                        self.used_values[marker] = arr
-            self.save_used_values()
-        except Exception:
-            pass
+                    value = text[start:int(s.get("end", start))]
+                    if value and value in self._used_lookup(marker):
+                        conflicts.append(f"{marker}={value[:20]}")
+            if conflicts:
+                raise ValueError("以下取值已被使用，本次未记录: " + ", ".join(conflicts))
+            records = self._record_used_from_spans(text, spans)
+            self._append_used_journal(records)
+        return len(records)
+
+
+class GenerationSession(PromptGenerator):
+    """独立的生成会话：共享所属生成器的变量库、权重、模板预设与编译缓存（只读），
+    自己持有顺序/穷举游标、随机数、近期窗口、剩余值池、当前模板与产品类型，以及待提交的已用记录。
+    多个会话（如界面的两个窗口、服务的多个调用方）互不影响各自的游标和已用集合；
+    会话内记为已用的值先缓存，commit() 时一次性写回生成器，与其他会话已提交的值冲突时整体不提交。
+    会话不读写任何文件（提交时由生成器写入已用记录日志）。
+    会话只声明自己持有的状态，其余属性（数据文件路径、设置、变更计数等）一律读取生成器，不会读到未初始化的值；
+    已用判断与剩余计数以生成器已提交的已用记录加上本会话待提交的值为准。
+    """
+
+    # 会话不加已用记录的文件锁（提交时由生成器加锁）
+    _used_sync_disabled = True
+
+    def __init__(self, generator: PromptGenerator, seed: Optional[int] = None, template: Optional[str] = None, product_type: Optional[str] = None) -> None:
+        # 不调用 PromptGenerator.__init__：共享状态通过下面的属性读取生成器
+        self.generator = generator
+        self.template = template or generator.template
+        self.current_product_type = product_type if product_type is not None else generator.current_product_type
+        self.field_indices: Dict[str, int] = dict(generator.field_indices)
+        self.combination_indices: Dict[str, int] = dict(generator.combination_indices)
+        self.rng = random.Random()
+        self.seed: Optional[int] = None
+        self.set_seed(seed)
+        self._recent: Dict[str, RecencyWindow] = {}
+        self._pools: Dict[str, RemainingPool] = {}
+        # 生成器已用位图的副本并加上本会话待提交的值
+        self._used_bits: Dict[str, UsedBitset] = {}
+        # 本会话已记为已用、尚未提交的值（字段 -> 值列表）与对应的日志记录
+        self.used_values: Dict[str, List[str]] = {}
+        self._pending_records: List[Dict[str, Any]] = []
+        self._seen_library_version = generator._library_version
+        self._seen_used_version = generator._used_version
+
+    # 与生成器共享的只读状态（生成器重新加载变量库、修改设置后会话立即生效）
+    value_library = property(lambda self: self.generator.value_library)
+    value_weights = property(lambda self: self.generator.value_weights)
+    _alias_tables = property(lambda self: self.generator._alias_tables)
+    template_presets = property(lambda self: self.generator.template_presets)
+    _compiled_templates = property(lambda self: self.generator._compiled_templates)
+    matching_mode = property(lambda self: self.generator.matching_mode)
+    delete_on_use_fields = property(lambda self: self.generator.delete_on_use_fields)
+    recency_windows = property(lambda self: self.generator.recency_windows)
+    _template_history = property(lambda self: self.generator._template_history)
+    _library_version = property(lambda self: self.generator._library_version)
+    _used_version = property(lambda self: self.generator._used_version)
+
+    def __getattr__(self, name: str) -> Any:
+        # 会话未声明的属性读取生成器
+        if name == "generator":
+            raise AttributeError(name)
+        return getattr(self.generator, name)
+
+    @property
+    def pending_count(self) -> int:
+        """待提交的已用记录条数"""
+        return len(self._pending_records)
+
+    def _check_generator_version(self) -> None:
+        """生成器的已用记录或变量库变化后（如其他会话提交）丢弃会话的剩余值池与已用位图，下次取用时重建"""
+        if self._seen_used_version != self.generator._used_version:
+            self._seen_used_version = self.generator._used_version
+            self._pools.clear()
+            self._used_bits.clear()
+
+    def _used_lookup(self, field: str) -> UsedBitset:
+        """生成器已用位图的副本加上本会话待提交的值（剩余计数、容量检查与判重均以此为准）"""
+        self._check_generator_version()
+        lookup = self._used_bits.get(field)
+        if lookup is None:
+            lookup = self.generator._used_lookup(field).copy()
+            for value in self.used_values.get(field, []):
+                lookup.add(value)
+            self._used_bits[field] = lookup
+        return lookup
+
+    def _pool(self, field: str) -> RemainingPool:
+        """会话自己的剩余值池：由生成器当前的已用状态构建并剔除本会话待提交的值"""
+        gen = self.generator
+        self._check_generator_version()
+        pool = self._pools.get(field)
+        if pool is None:
+            shared = gen._pools.get(field)
+            if shared is not None:
+                pool = shared.copy()
+                for value in self.used_values.get(field, []):
+                    pool.discard(value)
+            else:
+                pool = RemainingPool(gen.value_library.get(field, []), self._used_lookup(field), gen._weight_map(field))
+            self._pools[field] = pool
+        return pool
+
+    def _recency_window(self, field: str) -> Optional[RecencyWindow]:
+        if self._seen_library_version != self.generator._library_version:
+            self._seen_library_version = self.generator._library_version
+            self._recent.clear()
+        return super()._recency_window(field)
+
+    def _append_used_journal(self, records: List[Dict[str, Any]]) -> None:
+        """会话中记为已用的值先缓存，commit() 时再写回生成器"""
+        self._pending_records.extend(records)
+
+    def save_settings(self, current_preset: Optional[str] = None) -> None:
+        pass
+
+    def save_used_values(self) -> None:
+        pass
+
+    def flush(self) -> None:
+        pass
+
+    def _count_render(self, template: str, n: int = 1) -> None:
+        self.generator._count_render(template, n)
+
+    def unused_values(self, field: str) -> List[str]:
+        pending = set(self.used_values.get(field, []))
+        return [v for v in self.generator.unused_values(field) if v not in pending]
+
+    def clear_used_values(self, field: str) -> None:
+        """由生成器清除字段的已用记录，并丢弃本会话待提交的该字段记录"""
+        self._pending_records = [r for r in self._pending_records if r["field"] != field]
+        self.used_values.pop(field, None)
+        self._used_bits.pop(field, None)
+        self._pools.pop(field, None)
+        with self.generator._commit_lock:
+            self.generator.clear_used_values(field)
+
+    def refresh_used_values(self) -> None:
+        # 合并其他进程的记录会修改生成器状态，与提交互斥
+        with self.generator._commit_lock:
+            self.generator.refresh_used_values()
+
+    def commit(self) -> int:
+        """把待提交的已用记录一次性写回生成器（同一批日志），返回写入条数
+        若其中有值已被其他会话或生成器本身记为已用，则整体不提交并抛出 ValueError，可 rollback() 后重新生成
+        """
+        gen = self.generator
+        # 持有跨进程锁提交：其他程序实例已提交的值也会先合并进来参与冲突判断
+        with gen._commit_lock, gen._used_values_lock():
+            conflicts = [r for r in self._pending_records if r["value"] in gen._used_lookup(r["field"])]
+            if conflicts:
+                raise ValueError("以下取值已被其他会话使用，本次未提交: " + ", ".join(f"{r['field']}={r['value'][:20]}" for r in conflicts))
+            records = [r for r in self._pending_records if gen._add_used(r["field"], r["value"])]
+            gen._append_used_journal(records)
+        self._pending_records = []
+        self.used_values = {}
+        self._used_bits = {}
+        return len(records)
+
+    def rollback(self) -> None:
+        """放弃待提交的已用记录，这些值重新可用"""
+        self._pending_records = []
+        self.used_values = {}
+        self._used_bits = {}
+        self._pools.clear()
+
+    def __enter__(self) -> "GenerationSession":
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        """with 块正常结束时提交，出错时放弃"""
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
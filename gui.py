@@ -6,6 +6,12 @@ import os
 import platform
 import webbrowser
 from core import PromptGenerator
+from worker import BackgroundRunner
+
+# 匹配模式与下拉框显示文字
+MATCHING_MODE_LABELS = {"random": "随机", "sequential": "顺序", "exhaustive": "穷举"}
+# 变量库文件热重载的轮询间隔（毫秒）
+LIBRARY_WATCH_MS = 2000
 
 class PromptGeneratorGUI:
     """GUI界面实现，使用CustomTkinter"""
@@ -38,8 +44,15 @@ class PromptGeneratorGUI:
         except Exception as e:
             print(f"加载图标失败: {e}")
         
-        # 初始化核心生成器
-        self.generator = PromptGenerator()
+        # 初始化核心生成器（变量库在后台线程中加载，避免启动时界面卡住）
+        self.generator = PromptGenerator(load_library=False)
+        self.worker = BackgroundRunner(self.root)
+        self._load_task = None
+        self._watch_task = None
+        try:
+            self.root.bind("<Escape>", lambda e: self.cancel_library_load())
+        except Exception:
+            pass
 
         # 检查持久化文件
         missing_files = self.generator.check_persistence_files()
@@ -57,6 +70,7 @@ class PromptGeneratorGUI:
         
         # 加载初始数据
         self.load_initial_data()
+        self.root.after(LIBRARY_WATCH_MS, self._watch_library)
     
     def _create_section(self, parent, index):
         """创建单个生成区域"""
@@ -135,19 +149,27 @@ class PromptGeneratorGUI:
             
             tpl = self.generator.get_template_by_name(name)
             if tpl:
-                try:
-                    text, spans = self.generator.generate_preview_with_spans(
+                def on_preview(result):
+                    try:
+                        text, spans = result
+                        section = self.sections[index - 1]
+                        # 预览替换了结果框：之前生成的取值已不在框内，复制时不能再记为已用
+                        section['last_spans'] = []
+                        section['render_state'] = None
+                        self._render_result(section, text, spans, tpl)
+                        _update_count()
+                    except Exception as e:
+                        pass
+
+                # 变量库可能正在后台热重载，预览同样放到后台线程执行
+                self.worker.submit(
+                    lambda report: self.generator.generate_preview_with_spans(
                         product_type="",
                         selected_marker_values=None,
                         template_str=tpl
-                    )
-                    text_widget.delete("1.0", "end")
-                    text_widget.insert("1.0", text)
-                    for s in spans:
-                        text_widget.tag_add("placeholder", f"1.0+{s['start']}c", f"1.0+{s['end']}c")
-                    _update_count()
-                except Exception as e:
-                    pass
+                    ),
+                    on_done=on_preview,
+                )
 
         preset_combo.configure(command=on_preset_change)
 
@@ -160,6 +182,8 @@ class PromptGeneratorGUI:
             "copy_btn": copy_btn,
             "char_count_lbl": char_count_lbl,
             "last_spans": [],
+            "render_state": None,
+            "update_count_func": _update_count,
             "on_preset_change": on_preset_change
         }
 
@@ -222,15 +246,12 @@ class PromptGeneratorGUI:
             global_ctrl, 
             variable=self.match_var, 
             state="readonly", 
-            values=["随机", "顺序"], 
+            values=list(MATCHING_MODE_LABELS.values()), 
             width=100,
-            command=lambda v=None: self.generator.set_matching_mode("sequential" if self.match_var.get()=="顺序" else "random")
+            command=lambda v=None: self.generator.set_matching_mode(next((k for k, label in MATCHING_MODE_LABELS.items() if label == self.match_var.get()), "random"))
         )
         self.match_combo.pack(side="left", padx=5)
-        if getattr(self.generator, 'matching_mode', 'random') == 'sequential':
-            self.match_var.set("顺序")
-        else:
-            self.match_var.set("随机")
+        self.match_var.set(MATCHING_MODE_LABELS.get(getattr(self.generator, 'matching_mode', 'random'), "随机"))
 
         self.configure_custom_btn = ctk.CTkButton(global_ctrl, text="⚙️ 设置自定义参数", command=self.configure_custom_params, width=140)
         self.configure_custom_btn.pack(side="right", padx=10)
@@ -284,11 +305,24 @@ class PromptGeneratorGUI:
     
     def load_initial_data(self):
         """加载初始数据"""
-        # 自动加载上次变量库
-        if hasattr(self.generator, 'last_library_path') and self.generator.last_library_path and os.path.exists(self.generator.last_library_path):
-            self.generator.load_action_library_from_file(self.generator.last_library_path)
-            self.status_var.set(f"✓ 已加载上次变量库: {os.path.basename(self.generator.last_library_path)}")
+        # 自动加载上次变量库（后台进行，完成后刷新预览）
+        paths = [p for p in self.generator.get_library_paths() if os.path.exists(p)]
+        if paths:
+
+            def on_loaded(result):
+                success, message = result
+                if success:
+                    self.status_var.set(f"✓ 已加载上次变量库: {', '.join(os.path.basename(p) for p in paths)}")
+                    self._refresh_sections()
+                else:
+                    self.status_var.set(f"✗ {message}")
+
+            self._load_library_async(paths, on_loaded)
         
+        self._refresh_sections()
+
+    def _refresh_sections(self):
+        """刷新各窗口的模板下拉框并重新生成预览"""
         names = self.generator.list_template_names()
         
         for i, section in enumerate(self.sections):
@@ -308,30 +342,90 @@ class PromptGeneratorGUI:
                  section['preset_combo'].configure(values=[])
                  section['preset_var'].set("")
 
+    def _load_library_async(self, file_paths, on_loaded):
+        """在后台线程加载变量库（可同时加载多个文件），状态栏显示进度；新的加载会取消尚未完成的上一次加载"""
+        self.cancel_library_load(quiet=True)
+        name = ", ".join(os.path.basename(p) for p in file_paths)
+        self.status_var.set(f"正在加载变量库 {name}…（Esc 取消）")
+
+        def on_progress(done, total):
+            if total:
+                self.status_var.set(f"正在加载变量库 {name}: {done}/{total} 行（Esc 取消）")
+            else:
+                self.status_var.set(f"正在加载变量库 {name}: 已读 {done} 行（Esc 取消）")
+
+        def on_error(exc):
+            self.status_var.set(f"✗ 加载变量库失败: {exc}")
+
+        self._load_task = self.worker.submit(
+            lambda report: self.generator.load_library_sources(file_paths, progress_callback=report),
+            on_done=on_loaded,
+            on_error=on_error,
+            on_progress=on_progress,
+        )
+
+    def _watch_library(self):
+        """轮询变量库文件：被外部修改（如在 Excel 中保存）后在后台增量重新加载，界面不卡顿"""
+        try:
+            idle = (self._watch_task is None or self._watch_task.done()) and (self._load_task is None or self._load_task.done())
+            if idle and self.generator.library_sources:
+                self._watch_task = self.worker.submit(
+                    lambda report: self.generator.reload_changed_library_sources(),
+                    on_done=self._on_library_reloaded,
+                )
+        except Exception:
+            pass
+        finally:
+            self.root.after(LIBRARY_WATCH_MS, self._watch_library)
+
+    def _on_library_reloaded(self, changes):
+        if not changes:
+            return
+        summary = "，".join(f"{field} +{added}/-{removed}" for field, (added, removed) in changes.items())
+        # 不重新预览：结果框中可能是已生成但尚未复制的提示词
+        self.status_var.set(f"✓ 变量库文件已更新: {summary}")
+
+    def cancel_library_load(self, quiet=False):
+        """取消正在进行的变量库加载（原变量库保持不变）"""
+        task = self._load_task
+        self._load_task = None
+        if task is not None and not task.done():
+            task.cancel()
+            if not quiet:
+                self.status_var.set("✗ 已取消加载变量库")
+
     def upload_action_library(self):
         """上传动作库文件"""
-        file_path = filedialog.askopenfilename(
+        # 可多选：多个文件（如各季度的工作簿）的全部工作表合并为一个变量库
+        file_paths = list(filedialog.askopenfilenames(
             title="选择动作库文件",
             filetypes=[("Excel Files", "*.xlsx *.xls"), ("All Files", "*.*")]
-        )
+        ))
         
-        if not file_path:
+        if not file_paths:
             return
         
-        success, message = self.generator.load_action_library_from_file(file_path)
-        if success:
-            self.status_var.set(f"✓ {message} | 文件: {os.path.basename(file_path)}")
-            messagebox.showinfo("成功", message)
-            self.generator.set_last_library_path(file_path)
-            self.load_initial_data()
-        else:
-            self.status_var.set(f"✗ {message}")
-            messagebox.showerror("错误", message)
+        def on_loaded(result):
+            success, message = result
+            if success:
+                self.status_var.set(f"✓ {message} | 文件: {', '.join(os.path.basename(p) for p in file_paths)}")
+                messagebox.showinfo("成功", message)
+                self.generator.set_library_paths(file_paths)
+                self.load_initial_data()
+            else:
+                self.status_var.set(f"✗ {message}")
+                messagebox.showerror("错误", message)
+
+        self._load_library_async(file_paths, on_loaded)
     
     def clear_value_library(self):
-        self.generator.load_default_actions()
-        self.status_var.set("✓ 已清空变量库")
-        self.load_initial_data()
+        self.cancel_library_load(quiet=True)
+
+        def on_cleared(_):
+            self.status_var.set("✓ 已清空变量库")
+            self.load_initial_data()
+
+        self.worker.submit(lambda report: self.generator.load_default_actions(), on_done=on_cleared)
     
     def edit_template(self):
         """编辑模板"""
@@ -392,6 +486,32 @@ class PromptGeneratorGUI:
                 self.status_var.set(f"✓ 已加载预设内容: {name}")
         apply_btn = ctk.CTkButton(preset_frame, text="加载预设内容", command=apply_preset, width=100)
         apply_btn.pack(padx=0, pady=5)
+        def show_versions():
+            name = preset_var.get()
+            versions = self.generator.template_versions(name)
+            if not versions:
+                messagebox.showinfo("历史版本", "该预设暂无历史版本")
+                return
+            win = ctk.CTkToplevel(template_window)
+            win.title(f"历史版本 - {name}")
+            win.geometry("460x400")
+            frame = ctk.CTkScrollableFrame(win)
+            frame.pack(fill="both", expand=True, padx=10, pady=10)
+            for info in reversed(versions):
+                row = ctk.CTkFrame(frame)
+                row.pack(fill="x", pady=2)
+                label = f"v{info['version']}  {(info['time'] or '')[:19]}  渲染 {info['renders']} 次"
+                ctk.CTkLabel(row, text=label).pack(side="left", padx=4)
+                def load_version(v=info["version"]):
+                    tpl = self.generator.checkout_template_version(name, v)
+                    if tpl is not None:
+                        template_text.delete("1.0", "end")
+                        template_text.insert("1.0", tpl)
+                        self.status_var.set(f"✓ 已载入 {name} 的 v{v}，点击“更新选中预设”保存为新版本")
+                        win.destroy()
+                ctk.CTkButton(row, text="载入", width=60, command=load_version).pack(side="right", padx=4)
+        versions_btn = ctk.CTkButton(preset_frame, text="🕘 历史版本", command=show_versions, width=100)
+        versions_btn.pack(padx=0, pady=5)
 
         name_frame = ctk.CTkFrame(template_window)
         name_frame.pack(fill="x", padx=10, pady=5)
@@ -490,6 +610,54 @@ class PromptGeneratorGUI:
         )
         help_btn.pack(side="left", padx=5)
 
+    def _render_result(self, section, text, spans, template_str=None):
+        """把 (文本, spans) 写入结果框并高亮占位符
+        - 同一模板再次生成且用户未手动修改时，只替换值发生变化的片段
+        - 否则整体重写：文本与高亮标签通过一次 insert 调用完成（chars tagList chars tagList ...）
+        """
+        widget = section['text']
+        last = section.get('render_state')
+        if (
+            last is not None
+            and template_str is not None
+            and last['template'] == template_str
+            and not widget.edit_modified()
+            and self._same_layout(last['text'], last['spans'], text, spans)
+        ):
+            old_text = last['text']
+            # 从后往前替换，前面片段的字符偏移保持不变
+            for old, new in zip(reversed(last['spans']), reversed(spans)):
+                new_val = text[new['start']:new['end']]
+                if old_text[old['start']:old['end']] == new_val:
+                    continue
+                start = f"1.0+{old['start']}c"
+                widget.delete(start, f"1.0+{old['end']}c")
+                if new_val:
+                    widget.insert(start, new_val, ("placeholder",))
+        else:
+            chunks = []
+            pos = 0
+            for s in spans:
+                chunks.extend((text[pos:s['start']], (), text[s['start']:s['end']], ("placeholder",)))
+                pos = s['end']
+            chunks.extend((text[pos:], ()))
+            widget.delete("1.0", "end")
+            widget.insert("1.0", *chunks)
+        widget.edit_modified(False)
+        section['render_state'] = {'template': template_str, 'text': text, 'spans': spans}
+
+    @staticmethod
+    def _same_layout(old_text, old_spans, text, spans):
+        """两次渲染的占位符序列与占位符之间的固定文本完全一致时，才能按片段局部替换"""
+        if len(old_spans) != len(spans):
+            return False
+        old_pos = pos = 0
+        for old, new in zip(old_spans, spans):
+            if old['marker'] != new['marker'] or old_text[old_pos:old['start']] != text[pos:new['start']]:
+                return False
+            old_pos, pos = old['end'], new['end']
+        return old_text[old_pos:] == text[pos:]
+
     def _refresh_all_combos(self):
         names = self.generator.list_template_names()
         for section in self.sections:
@@ -515,16 +683,38 @@ class PromptGeneratorGUI:
                 if k in markers:
                     sel[k] = v
             
-            text, spans = self.generator.generate_prompt_with_spans(
-                product_type="",
-                selected_marker_values=sel or None,
-                template_str=template_str
+            # 每个窗口使用独立的生成会话：顺序游标、随机数和待提交的已用值互不干扰
+            session = section.get('session')
+            if session is None:
+                session = section['session'] = self.generator.new_session()
+            self.status_var.set(f"窗口 {index+1} 正在生成…")
+
+            def generate(report):
+                result = session.generate_prompt_with_spans(
+                    product_type="",
+                    selected_marker_values=sel or None,
+                    template_str=template_str
+                )
+                return result, session.get_empty_selected_fields()
+
+            self.worker.submit(
+                generate,
+                on_done=lambda done: self._show_generated(index, done[0], template_str, done[1]),
+                on_error=self._on_generate_error,
             )
-            
-            section['text'].delete("1.0", "end")
-            section['text'].insert("1.0", text)
-            for s in spans:
-                section['text'].tag_add("placeholder", f"1.0+{s['start']}c", f"1.0+{s['end']}c")
+        except Exception as e:
+            self._on_generate_error(e)
+
+    def _on_generate_error(self, e):
+        self.status_var.set(f"✗ 生成失败: {str(e)}")
+        messagebox.showerror("错误", f"生成提示词时出错:\n{str(e)}")
+
+    def _show_generated(self, index, result, template_str=None, empties=()):
+        """把后台生成的结果显示到对应窗口（在主线程中执行）；empties 为后台线程中检查出的已用完字段"""
+        try:
+            section = self.sections[index]
+            text, spans = result
+            self._render_result(section, text, spans, template_str)
             section['last_spans'] = spans
             
             if section.get('update_count_func'):
@@ -532,12 +722,10 @@ class PromptGeneratorGUI:
                 
             self.status_var.set(f"✓ 窗口 {index+1} 已生成提示词")
             
-            empties = self.generator.get_empty_selected_fields()
             if empties:
                 messagebox.showwarning("警告", "字段下没有值，请添加变量值: " + ", ".join(empties))
         except Exception as e:
-            self.status_var.set(f"✗ 生成失败: {str(e)}")
-            messagebox.showerror("错误", f"生成提示词时出错:\n{str(e)}")
+            self._on_generate_error(e)
 
     def configure_delete_fields(self):
         keys = sorted(list(self.generator.value_library.keys()))
@@ -550,13 +738,15 @@ class PromptGeneratorGUI:
         win.grab_set()
         
         # 说明标签
-        ctk.CTkLabel(win, text="勾选的字段在生成提示词后，其值会被记录并在下次生成时剔除，直到所有值用完。", wraplength=460).pack(pady=10)
+        ctk.CTkLabel(win, text="勾选的字段在生成提示词后，其值会被记录并在下次生成时剔除，直到所有值用完。\n未勾选的字段可填写“近 K 个不重复”：随机模式下不会抽到最近 K 次用过的值。", wraplength=460).pack(pady=10)
 
         frame = ctk.CTkScrollableFrame(win)
         frame.pack(fill="both", expand=True, padx=10, pady=5)
         
         checks = {}
+        windows = {}
         current = set(self.generator.delete_on_use_fields)
+        current_windows = self.generator.recency_windows
         
         for k in keys:
             row = ctk.CTkFrame(frame)
@@ -570,19 +760,38 @@ class PromptGeneratorGUI:
             # 清除记录按钮
             def clear_record(field=k):
                 if messagebox.askyesno("确认", f"确定要清除字段 '{field}' 的已用记录吗？\n清除后该字段的所有值将重新变为可用。"):
-                    self.generator.clear_used_values(field)
-                    messagebox.showinfo("成功", f"已清除 '{field}' 的使用记录")
+                    self.worker.submit(
+                        lambda report: self.generator.clear_used_values(field),
+                        on_done=lambda _: messagebox.showinfo("成功", f"已清除 '{field}' 的使用记录"),
+                    )
             
             btn_clear = ctk.CTkButton(row, text="清除记录", width=80, height=24, fg_color="#e74c3c", hover_color="#c0392b", command=clear_record)
             btn_clear.pack(side="right", padx=8)
 
-        btn = ctk.CTkButton(win, text="保存设置", command=lambda: self._save_delete_fields(win, checks))
+            window_var = tk.StringVar(value=str(current_windows.get(k, "")))
+            ctk.CTkEntry(row, textvariable=window_var, width=50, height=24, placeholder_text="K").pack(side="right", padx=2)
+            ctk.CTkLabel(row, text="近K个不重复").pack(side="right", padx=2)
+            windows[k] = window_var
+
+        btn = ctk.CTkButton(win, text="保存设置", command=lambda: self._save_delete_fields(win, checks, windows))
         btn.pack(pady=10)
 
-    def _save_delete_fields(self, win, checks):
+    def _save_delete_fields(self, win, checks, windows=None):
         selected = [k for k, v in checks.items() if v.get()]
-        self.generator.set_delete_on_use_fields(selected)
-        self.status_var.set("✓ 已更新用完即删字段")
+        sizes = None
+        if windows is not None:
+            sizes = {}
+            for k, var in windows.items():
+                text = var.get().strip()
+                if text.isdigit() and int(text) > 0:
+                    sizes[k] = int(text)
+
+        def apply(report):
+            self.generator.set_delete_on_use_fields(selected)
+            if sizes is not None:
+                self.generator.set_recency_windows(sizes)
+
+        self.worker.submit(apply, on_done=lambda _: self.status_var.set("✓ 已更新用完即删字段"))
         win.destroy()
 
     def _now_str(self):
@@ -608,11 +817,21 @@ class PromptGeneratorGUI:
             self.root.clipboard_append(prompt)
             self.root.update()  # 确保剪贴板更新
             
-            try:
-                spans = section.get('last_spans', []) or []
-                self.generator.mark_used_from_spans(prompt, spans)
-            except Exception:
-                pass
+            spans = section.get('last_spans', []) or []
+            session = section.get('session') or self.generator.new_session()
+
+            def mark_used(report):
+                session.mark_used_from_spans(prompt, spans)
+                try:
+                    session.commit()
+                except ValueError:
+                    session.rollback()
+                    raise
+
+            def on_conflict(e):
+                self.status_var.set(f"⚠ 窗口 {index+1} 的取值已被另一窗口使用，请重新生成")
+
+            self.worker.submit(mark_used, on_error=on_conflict)
             self.status_var.set(f"✓ 窗口 {index+1} 内容已复制")
             try:
                 self.status_bar.configure(text_color="#2ecc71")
@@ -771,7 +990,10 @@ class PromptGeneratorGUI:
 
     def _on_close(self):
         try:
+            self.cancel_library_load(quiet=True)
+            self.worker.shutdown()
             self.generator.save_settings()
+            self.generator.flush()
         except Exception:
             pass
         try:
@@ -1,7 +1,15 @@
-import customtkinter as ctk
-from gui import PromptGeneratorGUI
 import os
 import sys
+import timing
+
+if "--timing" in sys.argv:
+    sys.argv.remove("--timing")
+    timing.enable()
+
+with timing.phase("导入 customtkinter"):
+    import customtkinter as ctk
+with timing.phase("导入 gui/core"):
+    from gui import PromptGeneratorGUI
 
 def main() -> None:
     """程序主入口"""
@@ -15,13 +23,22 @@ def main() -> None:
                 pass
         
         # 创建主窗口
-        root = ctk.CTk()
+        with timing.phase("创建主窗口"):
+            root = ctk.CTk()
         
         # 设置窗口最小大小
         root.minsize(800, 600)
         
         # 创建应用
-        app = PromptGeneratorGUI(root)
+        with timing.phase("创建应用界面"):
+            app = PromptGeneratorGUI(root)
+        
+        # 首次绘制完成后输出启动耗时统计
+        if timing.is_enabled():
+            def _report_first_paint():
+                timing.mark("首次绘制窗口")
+                timing.report()
+            root.after_idle(_report_first_paint)
         
         # 运行主循环
         root.mainloop()
@@ -0,0 +1,120 @@
+"""持久化写入：原子写文件 + 延迟合并写入（write-behind）+ 跨进程文件锁
+
+界面上的每次设置变更、每次复制都会触发保存。WriteBehindStore 只记录“某文件需要写成什么内容”，
+在 delay 秒的时间窗口内多次保存同一文件只会落盘最后一次，写入在后台线程完成，
+不阻塞 Tk 主线程；程序退出前调用 flush() 把未写入的内容全部落盘。
+file_lock 为多个程序实例（如两台工作站共享同一文件夹）读写同一数据文件时提供互斥。
+"""
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None  # type: ignore[assignment]
+try:
+    import msvcrt
+except ImportError:  # POSIX
+    msvcrt = None  # type: ignore[assignment]
+
+
+def write_json_atomic(path: str, data: Any, indent: Optional[int] = 2) -> None:
+    """先写入同目录临时文件再重命名覆盖，避免写到一半崩溃导致文件损坏"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", suffix=".json", dir=directory)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as fp:
+            json.dump(data, fp, ensure_ascii=False, indent=indent)
+        os.replace(tmp_path, path)
+    except Exception:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+@contextmanager
+def file_lock(path: str) -> Iterator[None]:
+    """独占的跨进程建议锁（POSIX 为 flock，Windows 为 msvcrt.locking），阻塞直到获得；
+    锁随文件描述符关闭自动释放，进程崩溃不会留下死锁。两种机制都不可用或无法创建锁文件时不加锁。
+    """
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        fp = open(path, "a+b")
+    except OSError:
+        # 目录不可写，无法创建锁文件时不加锁
+        yield
+        return
+    try:
+        if fcntl is not None:
+            fcntl.flock(fp.fileno(), fcntl.LOCK_EX)
+        elif msvcrt is not None:
+            fp.seek(0)
+            while True:
+                try:
+                    # LK_LOCK 最多重试约 10 秒后报错，继续等待
+                    msvcrt.locking(fp.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+        yield
+    finally:
+        try:
+            if fcntl is not None:
+                fcntl.flock(fp.fileno(), fcntl.LOCK_UN)
+            elif msvcrt is not None:
+                fp.seek(0)
+                msvcrt.locking(fp.fileno(), msvcrt.LK_UNLCK, 1)
+        except OSError:
+            pass
+        fp.close()
+
+
+class WriteBehindStore:
+    """按文件路径合并的延迟写入器
+
+    schedule() 传入的数据应为快照（调用方之后不再修改），实际写入在计时器线程中进行。
+    """
+
+    def __init__(self, delay: float = 0.5) -> None:
+        self.delay = delay
+        self._pending: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        # 保证同一时刻只有一个线程在落盘，后取出的数据一定后写入
+        self._flush_lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+
+    def schedule(self, path: str, data: Any) -> None:
+        with self._lock:
+            self._pending[path] = data
+            if self._timer is None:
+                timer = threading.Timer(self.delay, self.flush)
+                timer.daemon = True
+                self._timer = timer
+                timer.start()
+
+    def has_pending(self, path: Optional[str] = None) -> bool:
+        with self._lock:
+            return bool(self._pending) if path is None else path in self._pending
+
+    def flush(self) -> None:
+        """立即写入所有待写内容"""
+        with self._flush_lock:
+            with self._lock:
+                pending = self._pending
+                self._pending = {}
+                timer = self._timer
+                self._timer = None
+            if timer is not None and timer is not threading.current_thread():
+                timer.cancel()
+            for path, data in pending.items():
+                try:
+                    write_json_atomic(path, data)
+                except Exception:
+                    pass
@@ -0,0 +1,411 @@
+"""本地 HTTP/JSON 生成服务
+
+启动时加载一次变量库与模板，之后所有请求复用同一个已预热的 PromptGenerator，
+供自动化脚本、出图流水线等调用，无需每次启动界面或重新解析 Excel。
+基于 asyncio 与标准库实现，不依赖 Web 框架。
+
+PromptGenerator 不是线程安全的：所有操作由唯一的所有者任务排队，按到达顺序逐个在同一个后台线程中执行，
+事件循环本身只负责收发请求，渲染期间仍可继续接收连接。
+
+用法示例：
+    python -m server
+    python -m server --port 8765 --library 模版.xlsx --seed 42
+
+接口（请求与响应均为 JSON）：
+    GET  /health                      服务状态、字段数、变量库指纹
+    GET  /templates                   模板预设名称列表
+    GET  /capacity?name=预设名         模板在用完即删字段耗尽前还能生成的条数
+    GET  /template-versions?name=预设名[&version=N]   预设的版本列表与各版本渲染次数；指定 version 时附带该版本全文
+    POST /render    {"name" | "template", "selected", "product_type", "mark_used"}   生成一条；mark_used 为 true 时在同一操作内记为已用
+    POST /preview   {"name" | "template", "selected", "product_type"}   预览（不抽取取值）
+    POST /batch     {"name", "count", "selected", "mark_used"}          批量生成，同批内用完即删字段不重复；剩余值不足时返回 409 且不消耗取值
+    POST /mark-used {"text", "spans"}                                   把 /render 的结果记为已用
+
+/render 不带 mark_used 时不预留取值，多个调用方可能拿到相同的值；之后 /mark-used 时若其中有值已被记为已用，
+整体不记录并返回 409，调用方应丢弃该结果重新生成。需要严格不重复时直接用 /render 的 mark_used。
+查询参数中的中文可直接以 UTF-8 发送，也可百分号编码；mark_used 等布尔参数可写作 true/false 或 1/0。
+"""
+import argparse
+import asyncio
+import json
+import signal
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from core import PromptGenerator
+
+# 请求体上限与单次批量生成的最大条数
+MAX_BODY_BYTES = 16 << 20
+MAX_BATCH_COUNT = 10000
+# 变量库文件热重载的轮询间隔（秒）
+LIBRARY_WATCH_SECONDS = 2.0
+
+STATUS_TEXT = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    409: "Conflict",
+    413: "Payload Too Large",
+    431: "Request Header Fields Too Large",
+    500: "Internal Server Error",
+}
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class GeneratorOwner:
+    """PromptGenerator 的唯一所有者：操作经队列串行执行，执行放在单线程池中，不阻塞事件循环"""
+
+    def __init__(self, generator: PromptGenerator) -> None:
+        self.generator = generator
+        self._queue: "asyncio.Queue[Tuple[Callable[..., Any], Tuple[Any, ...], asyncio.Future]]" = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prompt-owner")
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def call(self, func: Callable[..., Any], *args: Any) -> Any:
+        """提交 func(generator, *args)，等待按顺序执行完成后返回结果"""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((func, args, future))
+        return await future
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            func, args, future = await self._queue.get()
+            if future.cancelled():
+                continue
+            try:
+                result = await loop.run_in_executor(self._executor, func, self.generator, *args)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                continue
+            if not future.done():
+                future.set_result(result)
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._executor.shutdown(wait=True)
+        self.generator.flush()
+
+
+def _template_of(generator: PromptGenerator, payload: Dict[str, Any]) -> str:
+    """请求中的模板：template 为模板原文，name 为预设名称，都省略时使用当前模板"""
+    if payload.get("template"):
+        return str(payload["template"])
+    name = payload.get("name")
+    if name:
+        template = generator.get_template_by_name(str(name))
+        if template is None:
+            raise HTTPError(404, f"模板预设不存在: {name}")
+        return template
+    return generator.template
+
+
+def _selected(payload: Dict[str, Any]) -> Optional[Dict[str, str]]:
+    selected = payload.get("selected")
+    if selected is None:
+        return None
+    if not isinstance(selected, dict):
+        raise HTTPError(400, "selected 须为 {字段: 取值} 对象")
+    return {str(k): str(v) for k, v in selected.items()} or None
+
+
+def _flag(payload: Dict[str, Any], key: str, default: bool) -> bool:
+    """布尔参数：JSON 中的 true/false，或查询字符串中的 1/true/yes/on 与 0/false/no/off"""
+    value = payload.get(key)
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return bool(value)
+    text = str(value).strip().lower()
+    if text in ("1", "true", "yes", "on"):
+        return True
+    if text in ("0", "false", "no", "off", ""):
+        return False
+    raise HTTPError(400, f"{key} 须为布尔值")
+
+
+def _health(generator: PromptGenerator, payload: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "status": "ok",
+        "fields": len(generator.value_library),
+        "templates": len(generator.template_presets),
+        "matching_mode": generator.matching_mode,
+        "library": {"paths": generator.library_sources, "fingerprint": generator.library_fingerprint()},
+        "seed": generator.seed,
+    }
+
+
+def _templates(generator: PromptGenerator, payload: Dict[str, Any]) -> Dict[str, Any]:
+    return {"templates": generator.list_template_names()}
+
+
+def _capacity(generator: PromptGenerator, payload: Dict[str, Any]) -> Dict[str, Any]:
+    template = _template_of(generator, payload)
+    markers = generator.extract_markers(template)
+    return {
+        "capacity": generator.remaining_capacity(template, _selected(payload)),
+        "remaining": {f: generator.remaining_values(f) for f in markers if f in generator.delete_on_use_fields and f in generator.value_library},
+    }
+
+
+def _template_versions(generator: PromptGenerator, payload: Dict[str, Any]) -> Dict[str, Any]:
+    name = payload.get("name")
+    if not name or not generator.preset_name_exists(str(name)):
+        raise HTTPError(404, f"模板预设不存在: {name}")
+    result: Dict[str, Any] = {"name": name, "versions": generator.template_versions(str(name))}
+    if payload.get("version") is not None:
+        try:
+            version = int(payload["version"])
+        except (TypeError, ValueError):
+            raise HTTPError(400, "version 须为整数")
+        text = generator.checkout_template_version(str(name), version)
+        if text is None:
+            raise HTTPError(404, f"版本不存在: {version}")
+        result["template"] = text
+    return result
+
+
+def _render(generator: PromptGenerator, payload: Dict[str, Any]) -> Dict[str, Any]:
+    text, spans = generator.generate_prompt_with_spans(str(payload.get("product_type") or ""), selected_marker_values=_selected(payload), template_str=_template_of(generator, payload))
+    if _flag(payload, "mark_used", False):
+        # 在所有者任务内生成并记为已用，其他请求不会在两者之间取到相同的值
+        generator.claim_used_from_spans(text, spans)
+    return {"text": text, "spans": spans}
+
+
+def _preview(generator: PromptGenerator, payload: Dict[str, Any]) -> Dict[str, Any]:
+    text, spans = generator.generate_preview_with_spans(payload.get("product_type"), selected_marker_values=_selected(payload), template_str=_template_of(generator, payload))
+    return {"text": text, "spans": spans}
+
+
+def _batch(generator: PromptGenerator, payload: Dict[str, Any]) -> Dict[str, Any]:
+    try:
+        count = int(payload.get("count", 1))
+    except (TypeError, ValueError):
+        raise HTTPError(400, "count 须为整数")
+    if not 0 < count <= MAX_BATCH_COUNT:
+        raise HTTPError(400, f"count 须在 1 ~ {MAX_BATCH_COUNT} 之间")
+    name = str(payload["name"]) if payload.get("name") else None
+    template = generator.get_template_by_name(name) if name else generator.template
+    if template is None:
+        raise HTTPError(404, f"模板预设不存在: {name}")
+    selected = _selected(payload)
+    # 生成前检查剩余值，不够时直接拒绝，不消耗任何取值
+    capacity = generator.remaining_capacity(template, selected)
+    if capacity is not None and capacity < count:
+        raise HTTPError(409, f"模板最多还能生成 {capacity} 条，不足 {count} 条")
+    results = generator.generate_batch(name, count, selected, _flag(payload, "mark_used", True))
+    return {"results": [{"text": text, "spans": spans} for text, spans in results]}
+
+
+def _mark_used(generator: PromptGenerator, payload: Dict[str, Any]) -> Dict[str, Any]:
+    text = payload.get("text")
+    spans = payload.get("spans")
+    if not isinstance(text, str) or not isinstance(spans, list):
+        raise HTTPError(400, "需要 text（字符串）与 spans（列表）")
+    # 其中有值已被其他调用方记为已用时抛出 ValueError（409）
+    return {"ok": True, "marked": generator.claim_used_from_spans(text, spans)}
+
+
+ROUTES: Dict[Tuple[str, str], Callable[[PromptGenerator, Dict[str, Any]], Dict[str, Any]]] = {
+    ("GET", "/health"): _health,
+    ("GET", "/templates"): _templates,
+    ("GET", "/capacity"): _capacity,
+    ("GET", "/template-versions"): _template_versions,
+    ("POST", "/render"): _render,
+    ("POST", "/preview"): _preview,
+    ("POST", "/batch"): _batch,
+    ("POST", "/mark-used"): _mark_used,
+}
+
+
+class GenerationServer:
+    """最小的 HTTP/1.1 实现：支持 keep-alive 与 Content-Length 请求体，只返回 JSON"""
+
+    def __init__(self, owner: GeneratorOwner) -> None:
+        self.owner = owner
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                method, target, headers, body = request
+                status, result = await self._dispatch(method, target, body)
+                keep_alive = headers.get("connection", "").lower() != "close"
+                self._write_response(writer, status, result, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except HTTPError as e:
+            # 请求格式错误时无法继续解析同一连接上的后续请求
+            self._write_response(writer, e.status, {"error": e.message}, False)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            try:
+                writer.close()
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+    @staticmethod
+    async def _read_line(reader: asyncio.StreamReader) -> bytes:
+        try:
+            return await reader.readline()
+        except (ValueError, asyncio.LimitOverrunError):
+            # 超过 StreamReader 的行长度上限（64 KiB）
+            raise HTTPError(431, "请求行或请求头过长")
+
+    @classmethod
+    async def _read_request(cls, reader: asyncio.StreamReader) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+        line = await cls._read_line(reader)
+        if not line.strip():
+            return None
+        try:
+            # 请求目标按 UTF-8 解码，未做百分号编码的中文参数也能正确解析
+            method, target, _ = line.decode("utf-8").split(" ", 2)
+        except ValueError:
+            raise HTTPError(400, "无法解析请求行")
+        headers: Dict[str, str] = {}
+        while True:
+            line = await cls._read_line(reader)
+            if line in (b"\r\n", b"\n", b""):
+                break
+            key, _, value = line.decode("latin-1").partition(":")
+            headers[key.strip().lower()] = value.strip()
+        try:
+            length = int(headers.get("content-length", "0"))
+        except ValueError:
+            raise HTTPError(400, "Content-Length 无效")
+        if length > MAX_BODY_BYTES:
+            raise HTTPError(413, "请求体过大")
+        body = await reader.readexactly(length) if length > 0 else b""
+        return method.upper(), target, headers, body
+
+    async def _dispatch(self, method: str, target: str, body: bytes) -> Tuple[int, Dict[str, Any]]:
+        url = urlsplit(target)
+        handler = ROUTES.get((method, url.path))
+        if handler is None:
+            if any(path == url.path for _, path in ROUTES):
+                return 405, {"error": f"不支持的方法: {method}"}
+            return 404, {"error": f"未知接口: {url.path}"}
+        payload: Dict[str, Any] = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        if body:
+            try:
+                data = json.loads(body.decode("utf-8"))
+            except ValueError:
+                return 400, {"error": "请求体不是有效的 JSON"}
+            if not isinstance(data, dict):
+                return 400, {"error": "请求体须为 JSON 对象"}
+            payload.update(data)
+        try:
+            return 200, await self.owner.call(handler, payload)
+        except HTTPError as e:
+            return e.status, {"error": e.message}
+        except ValueError as e:
+            # 如用完即删字段耗尽、模板不存在、取值已被其他调用方记为已用
+            return 409, {"error": str(e)}
+        except Exception as e:
+            return 500, {"error": str(e)}
+
+    @staticmethod
+    def _write_response(writer: asyncio.StreamWriter, status: int, result: Dict[str, Any], keep_alive: bool) -> None:
+        body = json.dumps(result, ensure_ascii=False).encode("utf-8")
+        head = (
+            f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+            "Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + body)
+
+
+def _reload_library(generator: PromptGenerator) -> Dict[str, Tuple[int, int]]:
+    return generator.reload_changed_library_sources()
+
+
+async def _watch_library(owner: GeneratorOwner) -> None:
+    """定期检查变量库文件，被修改后经所有者任务增量重新加载"""
+    while True:
+        await asyncio.sleep(LIBRARY_WATCH_SECONDS)
+        try:
+            changes = await owner.call(_reload_library)
+        except Exception:
+            continue
+        if changes:
+            summary = "，".join(f"{field} +{added}/-{removed}" for field, (added, removed) in changes.items())
+            print(f"变量库已更新: {summary}", file=sys.stderr)
+
+
+async def serve(generator: PromptGenerator, host: str, port: int, watch: bool = True) -> None:
+    owner = GeneratorOwner(generator)
+    owner.start()
+    server = await asyncio.start_server(GenerationServer(owner).handle_connection, host, port)
+    watcher = asyncio.get_running_loop().create_task(_watch_library(owner)) if watch else None
+    try:
+        # 收到 SIGTERM 时同样正常退出，把尚未落盘的已用记录写入文件
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    except (NotImplementedError, AttributeError, RuntimeError):
+        pass
+    addresses = ", ".join(f"{s.getsockname()[0]}:{s.getsockname()[1]}" for s in server.sockets or [])
+    print(f"生成服务已启动: http://{addresses}", file=sys.stderr)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+        await owner.close()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m server", description="本地 HTTP/JSON 提示词生成服务")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址（默认只允许本机访问）")
+    parser.add_argument("--port", type=int, default=8765, help="监听端口")
+    parser.add_argument("--library", nargs="+", help="变量库 Excel 路径（可多个），默认使用上次加载的变量库")
+    parser.add_argument("--seed", type=int, help="随机种子，省略时随机生成")
+    parser.add_argument("--no-watch", action="store_true", help="不自动重新加载被修改的变量库文件")
+    args = parser.parse_args(argv)
+
+    generator = PromptGenerator(load_library=not args.library)
+    if args.library:
+        ok, message = generator.load_library_sources(args.library)
+        if not ok:
+            print(message, file=sys.stderr)
+            return 1
+    if not generator.value_library:
+        print("变量库为空，请通过 --library 指定 Excel 文件", file=sys.stderr)
+        return 1
+    seed = generator.set_seed(args.seed)
+    print(f"随机种子: {seed}", file=sys.stderr)
+    try:
+        asyncio.run(serve(generator, args.host, args.port, watch=not args.no_watch))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,342 @@
+"""可选的 SQLite 单文件存储：设置、模板预设（含历史版本）、变量库取值与已用记录
+
+数据目录中存在 prompt.sqlite3 时，PromptGenerator 改为从这里读写，而不再整文件重写
+settings.json / templates.json / used_values.json：
+- 设置按键保存，只写入有变化的键；模板预设只写入有变化的行
+- 模板的历史版本（全文或 delta，见 template_history）逐条追加，各版本的渲染次数按增量累加
+- 变量库取值（字段、文本、哈希、权重）镜像到 field_values 表，按 (字段, 哈希) 建唯一索引，
+  取值删除后保留行（position 置空），已用记录引用的 id 不变
+- 已用记录是只追加的事件表（use / clear），按取值 id 建索引；
+  “某字段还有哪些未用取值”是一次索引查询，而不是扫描列表
+- 导入时变量库中找不到的已用值（只有内容哈希）记为 digest，同步到包含该值的变量库后自动关联取值 id
+- 使用 WAL 日志模式，多个程序实例可同时读取；写入均为小事务
+
+原有 JSON 文件作为导入导出途径：python -m sqlite_store enable 把当前 JSON 数据导入数据库并启用，
+python -m sqlite_store export 目录 把数据库内容导出为 JSON 文件。
+"""
+import argparse
+import hashlib
+import json
+import sqlite3
+import sys
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS templates (
+    position INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    template TEXT NOT NULL,
+    time TEXT
+);
+CREATE TABLE IF NOT EXISTS template_history (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    record TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS template_renders (
+    id INTEGER PRIMARY KEY REFERENCES template_history (id),
+    count INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS fields (
+    field TEXT PRIMARY KEY,
+    table_sha1 TEXT
+);
+CREATE TABLE IF NOT EXISTS field_values (
+    id INTEGER PRIMARY KEY,
+    field TEXT NOT NULL,
+    text TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    weight REAL NOT NULL DEFAULT 1,
+    position INTEGER
+);
+CREATE UNIQUE INDEX IF NOT EXISTS field_values_hash ON field_values (field, hash);
+CREATE INDEX IF NOT EXISTS field_values_position ON field_values (field, position);
+CREATE TABLE IF NOT EXISTS usage (
+    id INTEGER PRIMARY KEY,
+    field TEXT NOT NULL,
+    op TEXT NOT NULL DEFAULT 'use',
+    value_id INTEGER REFERENCES field_values (id),
+    value TEXT,
+    ts TEXT,
+    cleared INTEGER NOT NULL DEFAULT 0,
+    digest TEXT
+);
+CREATE INDEX IF NOT EXISTS usage_value ON usage (value_id) WHERE op = 'use' AND cleared = 0;
+CREATE INDEX IF NOT EXISTS usage_field ON usage (field, cleared);
+"""
+
+
+def _text_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class SQLiteStore:
+    """SQLite 存储。一个连接由同一生成器的多个线程共用（界面后台线程、服务执行线程），内部加锁串行化"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        if "digest" not in {r[1] for r in self._conn.execute("PRAGMA table_info(usage)")}:
+            self._conn.execute("ALTER TABLE usage ADD COLUMN digest TEXT")
+        # 最近一次读写的设置（JSON 文本），保存时只写入变化的键
+        self._settings: Dict[str, str] = {}
+        self._templates: List[Tuple[str, str, Optional[str]]] = []
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _transaction(self) -> "_Transaction":
+        return _Transaction(self)
+
+    def is_empty(self) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT (SELECT COUNT(*) FROM settings) + (SELECT COUNT(*) FROM templates)").fetchone()
+        return not row[0]
+
+    # ---- 设置 ----
+
+    def load_settings(self) -> Dict[str, Any]:
+        with self._lock:
+            rows = self._conn.execute("SELECT key, value FROM settings").fetchall()
+        self._settings = dict(rows)
+        data: Dict[str, Any] = {}
+        for key, value in rows:
+            try:
+                data[key] = json.loads(value)
+            except ValueError:
+                continue
+        return data
+
+    def save_settings(self, data: Dict[str, Any]) -> None:
+        """保存设置：只写入变化的键，删除不再出现的键（与整文件覆盖的结果一致）"""
+        encoded = {k: json.dumps(v, ensure_ascii=False, sort_keys=True) for k, v in data.items()}
+        changed = [(k, v) for k, v in encoded.items() if self._settings.get(k) != v]
+        removed = [(k,) for k in self._settings if k not in encoded]
+        if not changed and not removed:
+            return
+        with self._transaction() as conn:
+            conn.executemany("INSERT INTO settings (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value", changed)
+            conn.executemany("DELETE FROM settings WHERE key = ?", removed)
+        self._settings = encoded
+
+    # ---- 模板预设 ----
+
+    def load_templates(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute("SELECT name, template, time FROM templates ORDER BY position").fetchall()
+        self._templates = [tuple(r) for r in rows]
+        return [{"name": name, "template": template, "time": time} for name, template, time in rows]
+
+    def save_templates(self, presets: Sequence[Dict[str, Any]]) -> None:
+        """保存模板预设：只写入变化的行"""
+        rows = [(str(p.get("name", "")), str(p.get("template", "")), p.get("time")) for p in presets]
+        changed = [(i, *row) for i, row in enumerate(rows) if i >= len(self._templates) or self._templates[i] != row]
+        if not changed and len(rows) == len(self._templates):
+            return
+        with self._transaction() as conn:
+            conn.executemany("INSERT INTO templates (position, name, template, time) VALUES (?, ?, ?, ?) ON CONFLICT(position) DO UPDATE SET name = excluded.name, template = excluded.template, time = excluded.time", changed)
+            conn.execute("DELETE FROM templates WHERE position >= ?", (len(rows),))
+        self._templates = rows
+
+    def load_template_history(self) -> Tuple[List[Dict[str, Any]], Dict[int, int]]:
+        """模板版本记录（按 id 顺序）与各版本的渲染次数"""
+        with self._lock:
+            rows = self._conn.execute("SELECT record FROM template_history ORDER BY id").fetchall()
+            counts = dict(self._conn.execute("SELECT id, count FROM template_renders").fetchall())
+        return [json.loads(r[0]) for r in rows], counts
+
+    def template_history_after(self, record_id: int) -> List[Dict[str, Any]]:
+        """id 之后的模板版本记录（其他程序实例追加的）"""
+        with self._lock:
+            rows = self._conn.execute("SELECT record FROM template_history WHERE id > ? ORDER BY id", (record_id,)).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def append_template_history(self, records: Iterable[Dict[str, Any]]) -> None:
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO template_history (id, name, version, record) VALUES (?, ?, ?, ?)",
+                ((r["id"], r["name"], r["version"], json.dumps(r, ensure_ascii=False)) for r in records),
+            )
+
+    def add_render_counts(self, deltas: Dict[int, int]) -> None:
+        """累加渲染次数（多个程序实例的计数互相叠加）"""
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO template_renders (id, count) VALUES (?, ?) ON CONFLICT(id) DO UPDATE SET count = count + excluded.count",
+                deltas.items(),
+            )
+
+    # ---- 变量库取值 ----
+
+    def sync_field(self, field: str, table: Sequence[str], table_sha1: str, weights: Optional[Sequence[float]] = None) -> bool:
+        """把字段的取值表镜像到 field_values；取值表哈希未变时直接返回 False"""
+        with self._lock:
+            row = self._conn.execute("SELECT table_sha1 FROM fields WHERE field = ?", (field,)).fetchone()
+        if row is not None and row[0] == table_sha1:
+            return False
+        with self._transaction() as conn:
+            conn.execute("UPDATE field_values SET position = NULL WHERE field = ? AND position IS NOT NULL", (field,))
+            conn.executemany(
+                "INSERT INTO field_values (field, text, hash, weight, position) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(field, hash) DO UPDATE SET weight = excluded.weight, position = excluded.position",
+                ((field, v, _text_hash(v), float(weights[i]) if weights is not None else 1.0, i) for i, v in enumerate(table)),
+            )
+            conn.execute("INSERT INTO fields (field, table_sha1) VALUES (?, ?) ON CONFLICT(field) DO UPDATE SET table_sha1 = excluded.table_sha1", (field, table_sha1))
+            # 只有内容哈希的已用记录：取值出现在变量库中后关联其 id
+            conn.execute(
+                "UPDATE usage SET value_id = (SELECT v.id FROM field_values v WHERE v.field = usage.field AND v.hash >= usage.digest AND v.hash < usage.digest || 'g') "
+                "WHERE field = ? AND cleared = 0 AND value_id IS NULL AND digest IS NOT NULL",
+                (field,),
+            )
+        return True
+
+    def remove_fields(self, fields: Iterable[str]) -> None:
+        """字段已从变量库移除：取值保留（已用记录仍可引用），只标记为不在变量库中"""
+        with self._transaction() as conn:
+            for field in fields:
+                conn.execute("UPDATE field_values SET position = NULL WHERE field = ?", (field,))
+                conn.execute("DELETE FROM fields WHERE field = ?", (field,))
+
+    def library_fields(self) -> List[str]:
+        with self._lock:
+            return [r[0] for r in self._conn.execute("SELECT field FROM fields")]
+
+    def unused_values(self, field: str, limit: Optional[int] = None) -> List[str]:
+        """字段中尚未用过的取值（按变量库顺序），为一次索引查询"""
+        sql = (
+            "SELECT v.text FROM field_values v WHERE v.field = ? AND v.position IS NOT NULL "
+            "AND NOT EXISTS (SELECT 1 FROM usage u WHERE u.value_id = v.id AND u.op = 'use' AND u.cleared = 0) "
+            "ORDER BY v.position"
+        )
+        params: Tuple[Any, ...] = (field,)
+        if limit is not None:
+            sql += " LIMIT ?"
+            params += (int(limit),)
+        with self._lock:
+            return [r[0] for r in self._conn.execute(sql, params)]
+
+    # ---- 已用记录 ----
+
+    def load_used(self) -> Tuple[Dict[str, List[str]], int]:
+        """当前有效的已用值（按使用顺序），以及最后一条事件的 id"""
+        used: Dict[str, List[str]] = {}
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT u.field, COALESCE(v.text, u.value) FROM usage u LEFT JOIN field_values v ON v.id = u.value_id "
+                "WHERE u.op = 'use' AND u.cleared = 0 ORDER BY u.id"
+            ).fetchall()
+            last = self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM usage").fetchone()[0]
+        for field, value in rows:
+            if value is not None:
+                used.setdefault(field, []).append(value)
+        for field, values in used.items():
+            used[field] = list(dict.fromkeys(values))
+        return used, last
+
+    def unresolved_used(self) -> Dict[str, List[str]]:
+        """尚未关联到变量库取值的已用记录：{字段: [内容哈希, ...]}"""
+        result: Dict[str, List[str]] = {}
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT field, digest FROM usage WHERE op = 'use' AND cleared = 0 AND value_id IS NULL AND digest IS NOT NULL ORDER BY id"
+            ).fetchall()
+        for field, digest in rows:
+            result.setdefault(field, []).append(digest)
+        return {field: list(dict.fromkeys(digests)) for field, digests in result.items()}
+
+    def last_event_id(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM usage").fetchone()[0]
+
+    def events_after(self, event_id: int) -> List[Dict[str, Any]]:
+        """id 之后的已用事件（其他进程写入的记录），格式与日志记录相同"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT u.id, u.field, u.op, COALESCE(v.text, u.value), u.ts FROM usage u LEFT JOIN field_values v ON v.id = u.value_id "
+                "WHERE u.id > ? ORDER BY u.id",
+                (event_id,),
+            ).fetchall()
+        return [{"id": i, "field": field, "op": op, "value": value, "ts": ts} for i, field, op, value, ts in rows]
+
+    def append_usage(self, records: Iterable[Dict[str, Any]]) -> int:
+        """在一个事务中追加已用事件（格式同日志记录，或以 digest 代替 value 只给出内容哈希），
+        clear 事件同时把该字段之前的记录标为已清除；返回最后一条事件的 id
+        """
+        with self._transaction() as conn:
+            for r in records:
+                field = r["field"]
+                ts = r.get("ts") or datetime.now().isoformat(timespec="seconds")
+                if r.get("op") == "clear":
+                    conn.execute("UPDATE usage SET cleared = 1 WHERE field = ? AND cleared = 0", (field,))
+                    conn.execute("INSERT INTO usage (field, op, ts, cleared) VALUES (?, 'clear', ?, 1)", (field, ts))
+                    continue
+                digest = r.get("digest")
+                if digest:
+                    row = conn.execute("SELECT id FROM field_values WHERE field = ? AND hash >= ? AND hash < ?", (field, digest, digest + "g")).fetchone()
+                    conn.execute("INSERT INTO usage (field, value_id, ts, digest) VALUES (?, ?, ?, ?)", (field, row[0] if row else None, ts, digest))
+                    continue
+                value = r["value"]
+                row = conn.execute("SELECT id FROM field_values WHERE field = ? AND hash = ?", (field, _text_hash(value))).fetchone()
+                if row is not None:
+                    conn.execute("INSERT INTO usage (field, value_id, ts) VALUES (?, ?, ?)", (field, row[0], ts))
+                else:
+                    # 不在变量库中的值保存原文
+                    conn.execute("INSERT INTO usage (field, value, ts) VALUES (?, ?, ?)", (field, value, ts))
+            return conn.execute("SELECT COALESCE(MAX(id), 0) FROM usage").fetchone()[0]
+
+
+class _Transaction:
+    """持有存储锁并以 BEGIN IMMEDIATE 开启写事务，正常结束时提交，出错时回滚"""
+
+    def __init__(self, store: SQLiteStore) -> None:
+        self.store = store
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.store._lock.acquire()
+        try:
+            self.store._conn.execute("BEGIN IMMEDIATE")
+        except Exception:
+            self.store._lock.release()
+            raise
+        return self.store._conn
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        try:
+            self.store._conn.execute("COMMIT" if exc_type is None else "ROLLBACK")
+        finally:
+            self.store._lock.release()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m sqlite_store", description="启用 SQLite 存储，或把其内容导出为 JSON 文件")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("enable", help="把当前 JSON 数据（设置、模板、已用记录、已加载的变量库）导入数据库并启用")
+    export = sub.add_parser("export", help="把当前数据导出为 settings.json / templates.json / used_values.json")
+    export.add_argument("directory", help="导出目录")
+    args = parser.parse_args(argv)
+
+    from core import PromptGenerator
+
+    generator = PromptGenerator()
+    if args.command == "enable":
+        ok, msg = generator.enable_sqlite_store()
+    else:
+        ok, msg = generator.export_json_files(args.directory)
+    print(msg, file=sys.stderr if not ok else sys.stdout)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,198 @@
+"""模板预设的版本历史：基准全文 + 差异（delta）存储
+
+每次保存预设只追加一条版本记录，不重写已有记录：
+- 与父版本相比差异更小时记录为 delta（复制父版本的字符区间 + 新插入的文本），否则保存全文
+- 父版本链每隔 KEYFRAME_INTERVAL 层保存一次全文，因此取出任意版本最多依次应用 KEYFRAME_INTERVAL 个 delta
+- 新建预设时以最相似的现有预设的最新版本为父版本，近似的变体只保存与它不同的部分
+
+记录格式（JSON 可序列化）：{"id", "name", "version", "time", "text"} 或
+{"id", "name", "version", "time", "parent", "depth", "delta"}，其中 delta 的每一项为
+[起, 止)（复制父版本 text[起:止]）或字符串（插入的文本）。
+记录 id 由调用方保证在共享同一数据目录的多个程序实例间不重复（追加前加锁并合并其他实例的新记录，见 add）。
+"""
+import json
+from difflib import SequenceMatcher
+from typing import Any, Dict, Iterable, List, Optional, Set, Union
+
+Delta = List[Union[List[int], str]]
+
+
+def make_delta(old: str, new: str) -> Delta:
+    """计算由 old 得到 new 的 delta（字符级）"""
+    delta: Delta = []
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, old, new, autojunk=False).get_opcodes():
+        if tag == "equal":
+            delta.append([i1, i2])
+        elif j2 > j1:
+            if delta and isinstance(delta[-1], str):
+                delta[-1] += new[j1:j2]
+            else:
+                delta.append(new[j1:j2])
+    return delta
+
+
+def apply_delta(old: str, delta: Delta) -> str:
+    return "".join(old[op[0]:op[1]] if isinstance(op, list) else op for op in delta)
+
+
+class TemplateHistory:
+    """全部预设的版本记录（按记录 id 索引），以及各版本的渲染次数"""
+
+    # 父版本链的最大长度，超过后保存全文
+    KEYFRAME_INTERVAL: int = 16
+    # 新建预设时，与现有预设的相似度（quick_ratio）达到该值才以其为父版本
+    SIMILARITY_THRESHOLD: float = 0.6
+
+    def __init__(self, records: Iterable[Dict[str, Any]] = ()) -> None:
+        self.records: Dict[int, Dict[str, Any]] = {}
+        # 预设名 -> 各版本的记录 id（版本号从 1 开始，第 n 个即版本 n）
+        self.versions: Dict[str, List[int]] = {}
+        # 记录 id -> 渲染次数
+        self.render_counts: Dict[int, int] = {}
+        # 各预设最新版本的全文，以及全文 -> 记录 id（用于按模板文本统计渲染次数）
+        self._heads: Dict[int, str] = {}
+        self._head_by_text: Dict[str, int] = {}
+        self._next_id = 1
+        self.add(records)
+
+    @property
+    def last_id(self) -> int:
+        return self._next_id - 1
+
+    def add(self, records: Iterable[Dict[str, Any]]) -> int:
+        """加入已有的版本记录（加载时，或合并其他程序实例追加的记录），返回加入的条数
+        损坏、id 重复或缺少父版本的记录单独跳过，不影响其他记录
+        """
+        added = 0
+        names: Set[str] = set()
+        for record in records:
+            try:
+                self._index(record)
+            except (KeyError, TypeError, ValueError):
+                continue
+            names.add(record["name"])
+            added += 1
+        for name in names:
+            self.head_text(name)
+        return added
+
+    def _index(self, record: Dict[str, Any]) -> None:
+        rid = int(record["id"])
+        name = record["name"]
+        if rid in self.records or not isinstance(name, str):
+            raise ValueError(f"无效的版本记录: {rid}")
+        if "text" in record:
+            if not isinstance(record["text"], str):
+                raise ValueError(f"无效的版本记录: {rid}")
+        elif record["parent"] not in self.records or not all(
+            isinstance(op, str) or (isinstance(op, list) and len(op) == 2 and all(isinstance(i, int) for i in op)) for op in record["delta"]
+        ):
+            raise ValueError(f"无效的版本记录: {rid}")
+        ids = self.versions.setdefault(name, [])
+        if ids:
+            old = self._heads.pop(ids[-1], None)
+            if old is not None and self._head_by_text.get(old) == ids[-1]:
+                del self._head_by_text[old]
+        self.records[rid] = record
+        ids.append(rid)
+        self._next_id = max(self._next_id, rid + 1)
+
+    def _text(self, rid: int) -> str:
+        text = self._heads.get(rid)
+        if text is not None:
+            return text
+        chain: List[Dict[str, Any]] = []
+        record = self.records[rid]
+        while "text" not in record:
+            chain.append(record)
+            record = self.records[record["parent"]]
+        text = record["text"]
+        for record in reversed(chain):
+            text = apply_delta(text, record["delta"])
+        return text
+
+    def head(self, name: str) -> Optional[int]:
+        ids = self.versions.get(name)
+        return ids[-1] if ids else None
+
+    def head_text(self, name: str) -> Optional[str]:
+        rid = self.head(name)
+        if rid is None:
+            return None
+        text = self._heads.get(rid)
+        if text is None:
+            text = self._heads[rid] = self._text(rid)
+            self._head_by_text[text] = rid
+        return text
+
+    def record_id(self, name: str, version: Optional[int] = None) -> Optional[int]:
+        ids = self.versions.get(name)
+        if not ids:
+            return None
+        if version is None:
+            return ids[-1]
+        if 1 <= version <= len(ids):
+            return ids[version - 1]
+        return None
+
+    def checkout(self, name: str, version: Optional[int] = None) -> Optional[str]:
+        """取出某个版本的全文（省略 version 为最新版本）；最多应用 KEYFRAME_INTERVAL 个 delta"""
+        rid = self.record_id(name, version)
+        if rid is None:
+            return None
+        if rid == self.head(name):
+            return self.head_text(name)
+        return self._text(rid)
+
+    def _similar_head(self, text: str) -> Optional[int]:
+        best: Optional[int] = None
+        best_ratio = self.SIMILARITY_THRESHOLD
+        for name in self.versions:
+            head_text = self.head_text(name)
+            if head_text is None:
+                continue
+            ratio = SequenceMatcher(None, head_text, text, autojunk=False).quick_ratio()
+            if ratio >= best_ratio:
+                best, best_ratio = self.head(name), ratio
+        return best
+
+    def commit(self, name: str, text: str, time: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """为预设追加一个版本，返回新记录（需由调用方持久化）；与最新版本相同时返回 None"""
+        head = self.head(name)
+        if head is not None and self.head_text(name) == text:
+            return None
+        record: Dict[str, Any] = {"id": self._next_id, "name": name, "version": len(self.versions.get(name, [])) + 1, "time": time}
+        parent = head if head is not None else self._similar_head(text)
+        if parent is not None:
+            depth = int(self.records[parent].get("depth", 0)) + 1
+            delta = make_delta(self._text(parent), text)
+            if depth < self.KEYFRAME_INTERVAL and len(json.dumps(delta, ensure_ascii=False)) < len(json.dumps(text, ensure_ascii=False)):
+                record.update(parent=parent, depth=depth, delta=delta)
+        if "delta" not in record:
+            record["text"] = text
+        self._index(record)
+        self._heads[record["id"]] = text
+        self._head_by_text[text] = record["id"]
+        return record
+
+    def count_render(self, text: str, n: int = 1) -> Optional[int]:
+        """按模板全文为对应预设的最新版本累加渲染次数，返回记录 id（不是任何预设的最新版本时返回 None）"""
+        rid = self._head_by_text.get(text)
+        if rid is not None:
+            self.render_counts[rid] = self.render_counts.get(rid, 0) + n
+        return rid
+
+    def describe(self, name: str) -> List[Dict[str, Any]]:
+        """预设的版本列表（从旧到新）：版本号、时间、存储方式与大小、渲染次数"""
+        result: List[Dict[str, Any]] = []
+        for version, rid in enumerate(self.versions.get(name, []), 1):
+            record = self.records[rid]
+            stored = record.get("text") if "text" in record else record["delta"]
+            result.append({
+                "version": version,
+                "time": record.get("time"),
+                "kind": "full" if "text" in record else "delta",
+                "stored_size": len(json.dumps(stored, ensure_ascii=False)),
+                "renders": self.render_counts.get(rid, 0),
+            })
+        return result
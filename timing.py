@@ -0,0 +1,57 @@
+"""启动耗时统计
+
+设置环境变量 PROMPT_STARTUP_TIMING=1，或以 `python main.py --timing` 启动时，
+记录模块导入、PromptGenerator 初始化各阶段以及首次绘制窗口的耗时，并输出到标准错误。
+未启用时各函数几乎没有开销。
+"""
+import os
+import sys
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, TextIO, Tuple
+
+_START = time.perf_counter()
+_enabled: bool = os.environ.get("PROMPT_STARTUP_TIMING", "") not in ("", "0")
+# (阶段名称, 相对启动的开始时间, 耗时)，耗时为 None 表示时间点
+_records: List[Tuple[str, float, Optional[float]]] = []
+
+
+def enable() -> None:
+    global _enabled
+    _enabled = True
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+@contextmanager
+def phase(label: str) -> Iterator[None]:
+    """统计一个阶段的耗时"""
+    if not _enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _records.append((label, start - _START, time.perf_counter() - start))
+
+
+def mark(label: str) -> None:
+    """记录一个时间点（相对进程内首次导入本模块的时间）"""
+    if _enabled:
+        _records.append((label, time.perf_counter() - _START, None))
+
+
+def report(stream: Optional[TextIO] = None) -> None:
+    if not _enabled or not _records:
+        return
+    out = stream or sys.stderr
+    out.write("启动耗时统计（毫秒）:\n")
+    for label, offset, duration in _records:
+        if duration is None:
+            out.write(f"  @{offset * 1000:9.1f}  {label}\n")
+        else:
+            out.write(f"  @{offset * 1000:9.1f}  {label}: {duration * 1000:.1f}\n")
+    out.flush()
@@ -0,0 +1,105 @@
+"""后台任务执行：让耗时的 PromptGenerator 操作离开 Tk 主线程
+
+所有任务在同一个后台线程中按提交顺序串行执行（PromptGenerator 本身不是线程安全的），
+任务结果、异常和进度通过 root.after 轮询回到主线程后再回调，回调里可以放心操作界面。
+"""
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+
+class TaskCancelled(Exception):
+    """任务已被取消（由进度回调抛出，用于中断正在执行的任务）"""
+
+
+class TaskHandle:
+    def __init__(self) -> None:
+        self._cancel_event = threading.Event()
+        self.future: Optional[Future] = None
+
+    def cancel(self) -> None:
+        """请求取消：尚未开始的任务不再执行；正在执行的任务在下一次汇报进度时中断；结果不再回调"""
+        self._cancel_event.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def check(self) -> None:
+        if self._cancel_event.is_set():
+            raise TaskCancelled()
+
+    def done(self) -> bool:
+        return self.future is not None and self.future.done()
+
+
+class BackgroundRunner:
+    POLL_MS = 30
+
+    def __init__(self, root: Any) -> None:
+        self.root = root
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prompt-worker")
+        self._progress: "queue.Queue" = queue.Queue()
+
+    def submit(
+        self,
+        func: Callable[..., Any],
+        on_done: Optional[Callable[[Any], None]] = None,
+        on_error: Optional[Callable[[BaseException], None]] = None,
+        on_progress: Optional[Callable[..., None]] = None,
+    ) -> TaskHandle:
+        """在后台线程执行 func(report)，report(*args) 用于汇报进度（会转发给 on_progress）"""
+        handle = TaskHandle()
+
+        def report(*args: Any) -> None:
+            handle.check()
+            if on_progress is not None:
+                self._progress.put((handle, on_progress, args))
+
+        def run() -> Any:
+            handle.check()
+            return func(report)
+
+        handle.future = self._executor.submit(run)
+        self.root.after(self.POLL_MS, self._poll, handle, on_done, on_error)
+        return handle
+
+    def _drain_progress(self) -> None:
+        while True:
+            try:
+                handle, callback, args = self._progress.get_nowait()
+            except queue.Empty:
+                return
+            if not handle.cancelled:
+                try:
+                    callback(*args)
+                except Exception:
+                    pass
+
+    def _poll(self, handle: TaskHandle, on_done: Optional[Callable[[Any], None]], on_error: Optional[Callable[[BaseException], None]]) -> None:
+        self._drain_progress()
+        future = handle.future
+        if future is None or not future.done():
+            self.root.after(self.POLL_MS, self._poll, handle, on_done, on_error)
+            return
+        if handle.cancelled or future.cancelled():
+            return
+        exc = future.exception()
+        if exc is not None:
+            if isinstance(exc, TaskCancelled):
+                return
+            if on_error is not None:
+                on_error(exc)
+        elif on_done is not None:
+            on_done(future.result())
+
+    def shutdown(self) -> None:
+        """不再接受新任务；排队中的任务取消，正在执行的任务在后台自然结束"""
+        try:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        except TypeError:
+            # Python 3.8 不支持 cancel_futures
+            self._executor.shutdown(wait=False)